@@ -1,11 +1,11 @@
+import os
 import sys
 from pathlib import Path
-import mlflow
-import mlflow.pytorch
+import json
 import torch
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 import uvicorn
 import subprocess
 
@@ -18,27 +18,111 @@ sys.path.append(str(root_path))
 # Wir nutzen dieselbe Logik wie in deinen Eval-Skripten
 db_path = root_path.parent / "ML_DATA" / "mlflow.db"
 db_url = f"sqlite:///{db_path.as_posix()}"
-mlflow.set_tracking_uri(db_url)
 
 app = FastAPI(title="MIMIC Mortality Predictor API")
 
+# Welche Modell-Variante serviert wird: "fp32" oder "int8" (Dynamic Quantization, nur CPU)
+MODEL_VARIANT = os.environ.get("MODEL_VARIANT", "fp32")
+# Inferenz-Backend: "mlflow" (Lightning-Modul aus der Registry, eager PyTorch), "torchscript"
+# (inference/model.pt aus train.py, lädt mit reinem torch -> kein mlflow/pytorch_lightning Import,
+# schneller Start) oder "onnx" (inference/model.onnx im onnxruntime CPUExecutionProvider,
+# Threads/Optimierung über ORT_INTRA_OP_THREADS, ORT_INTER_OP_THREADS, ORT_GRAPH_OPTIMIZATION)
+MODEL_FORMAT = os.environ.get("MODEL_FORMAT", "mlflow")
+# Pfad zum Artefakt, sonst das neueste inference/model.pt bzw. model.onnx unter den Artefakt-Ordnern
+MODEL_PATH = os.environ.get("MODEL_PATH")
+# Kaskade (nur MODEL_FORMAT=mlflow): billiger Scorer aus der Registry (z.B. MIMIC_Mortality_Predictor_student),
+# das Hauptmodell rechnet nur, wenn das billige Risiko in [CASCADE_LOW, CASCADE_HIGH] liegt.
+# Band mit eval/eval_cascade.py auf dem Val-Split wählen
+CASCADE_CHEAP_MODEL = os.environ.get("CASCADE_CHEAP_MODEL")
+CASCADE_LOW = float(os.environ.get("CASCADE_LOW", "0.05"))
+CASCADE_HIGH = float(os.environ.get("CASCADE_HIGH", "0.5"))
+
 # Globaler Modell-Speicher
 model = None
 model_meta = {}
+device = "cpu"
+# Hierarchisches Modell: Chunk-Embeddings + LSTM-Zustand pro Patient (/predict_patient)
+chunk_cache = None
+# CascadePredictor, wenn CASCADE_CHEAP_MODEL gesetzt ist
+cascade = None
 
 class PatientSequence(BaseModel):
     token_ids: List[int]
+    # Optional: Hash des Vokabulars, mit dem token_ids erzeugt wurden (vocab_meta.json)
+    vocab_hash: Optional[str] = None
+
+class PatientChunks(BaseModel):
+    subject_id: int
+    # Token-Listen ab Chunk first_chunk_id (chunk_id aus preprocess_duckdb), der letzte ist der aktuelle.
+    # Schon gecachte Chunks müssen nicht erneut geschickt werden.
+    chunks: List[List[int]]
+    first_chunk_id: int = 0
+    vocab_hash: Optional[str] = None
 
 @app.on_event("startup")
 def load_model():
-    global model, model_meta
-    model_name = "MIMIC_Mortality_Predictor"
+    if MODEL_FORMAT == "torchscript":
+        load_torchscript_model()
+    elif MODEL_FORMAT == "onnx":
+        load_onnx_model()
+    else:
+        load_mlflow_model()
+
+def find_inference_artifact(filename):
+    # MODEL_PATH oder das neueste inference/<filename> (train.py loggt es in den Run)
+    if MODEL_PATH:
+        return Path(MODEL_PATH)
+    roots = [Path("/ML_DATA/artifacts"), root_path.parent / "ML_DATA" / "artifacts"]
+    candidates = [p for r in roots if r.exists() for p in r.rglob(filename) if p.parent.name == "inference"]
+    if not candidates:
+        raise RuntimeError(f"Kein Artefakt inference/{filename} gefunden, MODEL_PATH setzen")
+    return max(candidates, key=lambda p: p.stat().st_mtime)
+
+def load_onnx_model():
+    global model, model_meta, device
+    from src.models.onnx_runtime import ONNX_FILE, OnnxRuntimeModel
+
+    path = find_inference_artifact(ONNX_FILE)
+    print(f"🔌 Lade ONNX-Modell (onnxruntime, CPU): {path}")
+    model = OnnxRuntimeModel.from_env(path)
+    device = "cpu"
+    model_meta = {"source": "ONNX Runtime", "path": path.as_posix(), "model_name": model.meta.get("model_name"),
+                  "vocab_hash": model.meta.get("vocab_hash")}
+    print(f"   🔑 Vokabular-Hash des Modells: {model_meta['vocab_hash']}")
+
+def load_torchscript_model():
+    global model, model_meta, device
+    path = find_inference_artifact("model.pt")
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"🔌 Lade TorchScript-Modell: {path}")
+    extra = {"meta.json": ""}
+    model = torch.jit.load(str(path), map_location=device, _extra_files=extra).eval()
+    meta = json.loads(extra["meta.json"] or "{}")
+    model_meta = {"source": "TorchScript", "path": path.as_posix(), "model_name": meta.get("model_name"),
+                  "vocab_hash": meta.get("vocab_hash")}
+    print(f"   🔑 Vokabular-Hash des Modells: {model_meta['vocab_hash']}")
+
+def load_mlflow_model():
+    global model, model_meta, device, chunk_cache, cascade
+    # Erst hier importiert: im TorchScript-Modus bleiben mlflow & Lightning ungeladen
+    import mlflow
+    import mlflow.pytorch
+    from src.models.cascade import CascadePredictor
+    from src.models.hierarchical_module import ChunkCache
+    from src.models.quantization import disable_mha_fastpath
+    mlflow.set_tracking_uri(db_url)
+
+    model_name = "MIMIC_Mortality_Predictor" + ("_int8" if MODEL_VARIANT == "int8" else "")
+    # Artefakt-Ordner im Run (train.py): "model" bzw. "model_int8", für die Suche auf der Platte
+    artifact_dir = "model_int8" if MODEL_VARIANT == "int8" else "model"
     # Wir laden die neueste Version aus der Production oder Staging Stage
     # Falls du keine Stages nutzt, nehmen wir "latest" via None
     model_uri = f"models:/{model_name}/latest"
     
     # Bestimme Device für das Laden (wichtig für Docker ohne GPU)
-    map_loc = "cuda" if torch.cuda.is_available() else "cpu"
+    # Quantisierte Modelle laufen nur auf der CPU
+    map_loc = "cuda" if torch.cuda.is_available() and MODEL_VARIANT != "int8" else "cpu"
 
     # --- FIX: Datenbank Schema Update ---
     print("🔧 Prüfe und aktualisiere MLflow Datenbank-Schema...")
@@ -92,7 +176,7 @@ def load_model():
                 
                 for root in search_roots:
                     if root.exists():
-                        matches = list(root.rglob("MLmodel"))
+                        matches = [m for m in root.rglob("MLmodel") if m.parent.name == artifact_dir]
                         if matches:
                             found_path = matches[0].parent
                             print(f"   ✅ Artefakte gefunden: {found_path}")
@@ -124,7 +208,7 @@ def load_model():
                 
                 if artifact_root.exists():
                     # Suche rekursiv nach ALLEN 'MLmodel' Dateien
-                    candidates = list(artifact_root.rglob("MLmodel"))
+                    candidates = [m for m in artifact_root.rglob("MLmodel") if m.parent.name == artifact_dir]
                     
                     if candidates:
                         # Sortiere nach Änderungsdatum (neueste zuerst)
@@ -169,23 +253,64 @@ def load_model():
         except Exception as e:
             print(f"   ⚠️ Konnte Run-Namen nicht laden: {e}")
 
+    # Vokabular, mit dem das Modell trainiert wurde (fehlt bei alten Modellen)
+    model_cfg = getattr(model, "cfg", None)
+    model_meta["vocab_hash"] = model_cfg.data.get("vocab_hash") if model_cfg is not None else None
+    print(f"   🔑 Vokabular-Hash des Modells: {model_meta['vocab_hash']}")
+
+    quantization = getattr(model, "quantization", None)
+    if quantization:
+        # Fast-Path verträgt keine quantisierten Feed-Forward-Layer (siehe src/models/quantization.py)
+        disable_mha_fastpath()
+        model_meta["quantization"] = quantization
+        print(f"   🗜️  Quantisiertes Modell: {quantization}")
+
+    if hasattr(model, "encode_chunks"):
+        chunk_cache = ChunkCache()
+
     model.eval()
-    if torch.cuda.is_available():
-        model.cuda()
+    device = map_loc
+    model.to(device)
+
+    if CASCADE_CHEAP_MODEL:
+        cheap_uri = f"models:/{CASCADE_CHEAP_MODEL}/latest"
+        print(f"🪜 Kaskade: lade billigen Scorer {cheap_uri}, Band [{CASCADE_LOW}, {CASCADE_HIGH}]")
+        cheap = mlflow.pytorch.load_model(cheap_uri, map_location=map_loc).eval().to(device)
+        cheap_hash = cheap.cfg.data.get("vocab_hash")
+        if cheap_hash and model_meta["vocab_hash"] and cheap_hash != model_meta["vocab_hash"]:
+            raise RuntimeError(f"Kaskade: Vokabular des billigen Scorers ({cheap_hash}) passt nicht zum Modell")
+        cascade = CascadePredictor(cheap, model, CASCADE_LOW, CASCADE_HIGH)
+        model_meta["cascade"] = {"cheap_model": CASCADE_CHEAP_MODEL, "low": CASCADE_LOW, "high": CASCADE_HIGH}
 
 @app.post("/predict")
 def predict_risk(data: PatientSequence):
     if model is None:
         raise HTTPException(status_code=503, detail="Modell nicht geladen")
+
+    # Andere Token-IDs -> Vorhersage wäre Unsinn, also lieber ablehnen
+    if data.vocab_hash and model_meta.get("vocab_hash") and data.vocab_hash != model_meta["vocab_hash"]:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Vokabular passt nicht: Modell {model_meta['vocab_hash']}, Anfrage {data.vocab_hash}"
+        )
     
     try:
         # Daten vorbereiten
         # Modell erwartet: [Batch_Size, Seq_Len]
         input_tensor = torch.tensor([data.token_ids], dtype=torch.long)
         
-        if torch.cuda.is_available():
-            input_tensor = input_tensor.cuda()
+        input_tensor = input_tensor.to(device)
             
+        if cascade is not None:
+            # Billiger Score zuerst, Transformer nur im Unsicherheits-Band
+            probs, cheap_probs, escalated = cascade.predict(input_tensor)
+            return {
+                "mortality_risk": probs.item(),
+                "seq_len": len(data.token_ids),
+                "cascade": {"cheap_risk": cheap_probs.item(), "escalated": bool(escalated.item())},
+                "model_info": model_meta
+            }
+
         with torch.no_grad():
             logits = model(input_tensor)
             # Wahrscheinlichkeit für Klasse 1 (Tod)
@@ -200,6 +325,74 @@ def predict_risk(data: PatientSequence):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/predict_trajectory")
+def predict_trajectory(data: PatientSequence):
+    """Risiko nach jedem Event (Präfix 1..n) in einem Aufruf, statt n Aufrufen von /predict."""
+    if model is None:
+        raise HTTPException(status_code=503, detail="Modell nicht geladen")
+
+    if data.vocab_hash and model_meta.get("vocab_hash") and data.vocab_hash != model_meta["vocab_hash"]:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Vokabular passt nicht: Modell {model_meta['vocab_hash']}, Anfrage {data.vocab_hash}"
+        )
+
+    try:
+        input_tensor = torch.tensor([data.token_ids], dtype=torch.long)
+        input_tensor = input_tensor.to(device)
+
+        with torch.no_grad():
+            if hasattr(model, "trajectory"):
+                # LSTM / kausaler Transformer: alle Präfixe in einem Durchlauf
+                logits = model.trajectory(input_tensor)[0]
+            else:
+                # Bidirektionaler Transformer: jeder Präfix einzeln
+                logits = torch.cat([model(input_tensor[:, :t]) for t in range(1, input_tensor.shape[1] + 1)])
+            probs = torch.softmax(logits, dim=1)[:, 1].tolist()
+
+        return {
+            "mortality_risks": probs,
+            "seq_len": len(data.token_ids),
+            "model_info": model_meta
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/predict_patient")
+def predict_patient(data: PatientChunks):
+    """
+    Risiko über die ganze Historie (hierarchisches Modell). Encodiert werden nur Chunks, die
+    noch nicht im Cache liegen, bei einem wiederkehrenden Patienten also nur der neueste.
+    """
+    if model is None:
+        raise HTTPException(status_code=503, detail="Modell nicht geladen")
+    if not hasattr(model, "encode_chunks"):
+        raise HTTPException(status_code=400, detail="Geladenes Modell ist nicht hierarchisch, /predict nutzen")
+    if not data.chunks:
+        raise HTTPException(status_code=422, detail="Mindestens ein Chunk nötig")
+
+    if data.vocab_hash and model_meta.get("vocab_hash") and data.vocab_hash != model_meta["vocab_hash"]:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Vokabular passt nicht: Modell {model_meta['vocab_hash']}, Anfrage {data.vocab_hash}"
+        )
+
+    try:
+        logits, encoded = chunk_cache.score(model, data.subject_id, data.chunks, data.first_chunk_id)
+    except (LookupError, ValueError) as e:
+        # Client kennt den Cache-Stand nicht (z.B. nach Neustart/Eviction) -> ganze Historie schicken
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "mortality_risk": torch.softmax(logits, dim=1)[0, 1].item(),
+        "n_chunks": data.first_chunk_id + len(data.chunks),
+        "encoded_chunks": encoded,
+        "model_info": model_meta
+    }
+
 if __name__ == "__main__":
     # Startet den Server lokal
     uvicorn.run(app, host="0.0.0.0", port=8000)
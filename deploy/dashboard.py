@@ -13,9 +13,11 @@ root_path = Path(__file__).resolve().parent.parent
 sys.path.append(str(root_path))
 
 from src.data.mimic_loader import MimicDataModule
+from src.data.vocab import read_vocab_meta
 from omegaconf import OmegaConf
 
 API_URL = "http://localhost:8000/predict"
+TRAJECTORY_URL = "http://localhost:8000/predict_trajectory"
 
 st.set_page_config(page_title="MIMIC-IV basiertes Frühwarnsystem", layout="wide")
 
@@ -32,6 +34,8 @@ def load_demo_data():
     cfg = OmegaConf.load(config_path)
     # Cache Pfad anpassen
     cache_dir = root_path.parent / "ML_DATA"
+    # Die Demo gruppiert val_df pro Patient -> DataFrame-Pfad statt Token-Store
+    cfg.data.use_token_store = False
     dm = MimicDataModule(cfg, cache_path=cache_dir)
     dm.setup(stage="fit")
     
@@ -68,6 +72,9 @@ if vocab_path.exists():
 else:
     st.warning("⚠️ vocab.json nicht gefunden. Events werden als IDs angezeigt.")
 
+# Wird bei jeder Anfrage mitgeschickt -> API lehnt ab, wenn das Modell ein anderes Vokabular hat
+vocab_meta = read_vocab_meta(vocab_path.parent) or {}
+
 # --- SIDEBAR ---
 st.sidebar.header("Patienten Auswahl")
 patient_idx = st.sidebar.number_input("Patient Index", 0, len(dataset)-1, 0)
@@ -83,19 +90,19 @@ if st.sidebar.button("🚀 Gesamten Verlauf berechnen"):
     status_text = st.sidebar.empty()
     prog_bar = st.sidebar.progress(0)
     
-    for t in range(1, len(full_sequence) + 1):
-        k = (patient_idx, t)
-        if k not in st.session_state.risk_cache:
-            try:
-                # API Call für den Schritt t
-                resp = requests.post(API_URL, json={"token_ids": full_sequence[:t]})
-                if resp.status_code == 200:
-                    st.session_state.risk_cache[k] = resp.json()
-            except Exception:
-                pass
-        
-        prog_bar.progress(t / len(full_sequence))
-        status_text.text(f"Berechne {t}/{len(full_sequence)}")
+    status_text.text(f"Berechne {len(full_sequence)} Events...")
+    try:
+        # Ein Aufruf für alle Präfixe (LSTM: ein Durchlauf) statt eines Calls pro Schritt
+        resp = requests.post(TRAJECTORY_URL, json={"token_ids": full_sequence, "vocab_hash": vocab_meta.get("vocab_hash")})
+        if resp.status_code == 200:
+            data = resp.json()
+            for t, r in enumerate(data["mortality_risks"], start=1):
+                st.session_state.risk_cache[(patient_idx, t)] = {"mortality_risk": r, "model_info": data.get("model_info", {})}
+        else:
+            st.sidebar.error(f"API Fehler: {resp.status_code}")
+    except Exception as e:
+        st.sidebar.warning(f"API nicht erreichbar: {e}")
+    prog_bar.progress(1.0)
     
     status_text.empty()
     prog_bar.empty()
@@ -150,12 +157,15 @@ if cache_key in st.session_state.risk_cache:
     model_info = data.get("model_info", {})
 else:
     try:
-        response = requests.post(API_URL, json={"token_ids": current_seq})
+        response = requests.post(API_URL, json={"token_ids": current_seq, "vocab_hash": vocab_meta.get("vocab_hash")})
         if response.status_code == 200:
             data = response.json()
             risk = data["mortality_risk"]
             model_info = data.get("model_info", {})
             st.session_state.risk_cache[cache_key] = data
+        elif response.status_code == 409:
+            st.error(f"API Fehler: {response.json().get('detail')}")
+            risk = 0.0
         else:
             st.error("API Fehler")
             risk = 0.0
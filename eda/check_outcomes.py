@@ -1,8 +1,17 @@
 import duckdb
+import sys
 from pathlib import Path
 
+# --- PFAD FIX ---
+root_path = Path(__file__).resolve().parent.parent
+sys.path.append(str(root_path))
+
+from src.data.staging import table_source
+
 # Wir brauchen die Rohdaten (Admissions), nicht nur die Sequenzen
-MIMIC_RAW_PATH = Path("../data/mimic-iv-3.1/hosp/admissions.csv.gz")
+# -> bevorzugt die gestagte Parquet-Kopie, sonst die CSV.gz
+MIMIC_PATH = Path("../data/mimic-iv-3.1")
+STAGING_DIR = Path("../ML_DATA/staged")
 
 def analyze_quality_of_life():
     print("🏥 Analysiere Entlassungs-Orte (Proxy für Lebensqualität)...")
@@ -12,7 +21,7 @@ def analyze_quality_of_life():
         SELECT 
             discharge_location,
             COUNT(*) as count
-        FROM read_csv_auto('{MIMIC_RAW_PATH}')
+        FROM {table_source('admissions', MIMIC_PATH, STAGING_DIR)}
         WHERE hospital_expire_flag = 0
         GROUP BY discharge_location
         ORDER BY count DESC
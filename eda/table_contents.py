@@ -1,9 +1,21 @@
 import pandas as pd
+import duckdb
 import glob
 import os
+import sys
+from pathlib import Path
+
+# --- PFAD FIX ---
+root_path = Path(__file__).resolve().parent.parent
+sys.path.append(str(root_path))
+
+from src.data.staging import RAW_TABLES, table_source
 
 # Konfiguration
 base_path = "../../data/mimic-iv-3.1/"
+staging_dir = "../../ML_DATA/staged"
+# Gestagte Tabellen (z.B. "hosp/labevents.csv.gz" -> "labevents") lesen wir aus dem Parquet-Cache
+staged_names = {spec["file"]: name for name, spec in RAW_TABLES.items()}
 dirs = ["icu", "hosp"]
 output_file = "mimic_tabellen_report.md"
 
@@ -26,7 +38,11 @@ with open(output_file, "w", encoding="utf-8") as f:
             
             try:
                 # WICHTIG: Nur 1 Zeile laden, um RAM zu sparen!
-                df_preview = pd.read_csv(datei_pfad, nrows=1)
+                staged_name = staged_names.get(f"{ordner}/{dateiname}")
+                if staged_name:
+                    df_preview = duckdb.query(f"SELECT * FROM {table_source(staged_name, base_path, staging_dir)} LIMIT 1").df()
+                else:
+                    df_preview = pd.read_csv(datei_pfad, nrows=1)
                 
                 # Markdown Inhalt schreiben
                 f.write(f"### 📂 Tabelle: `{titel}` (aus `{ordner}`)\n")
@@ -0,0 +1,96 @@
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+# --- PFAD FIX ---
+root_path = Path(__file__).resolve().parent.parent
+sys.path.append(str(root_path))
+
+from eval.bench_padding import MODELS, make_cfg, real_lengths
+from src.models.export import export_onnx_model
+from src.models.onnx_runtime import GRAPH_OPTIMIZATIONS, OnnxRuntimeModel
+
+
+def latency_ms(fn, x, repeats):
+    # Einzelne /predict-Anfrage: Batch 1, Latenz pro Aufruf
+    fn(x)  # Warm-up
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(x)
+        times.append(1000 * (time.perf_counter() - start))
+    return np.percentile(times, 50), np.percentile(times, 95)
+
+
+def run(name, lengths, vocab_size, repeats, threads, graph_optimization, seed):
+    torch.manual_seed(seed)
+    model = MODELS[name][0](make_cfg(name, vocab_size)).eval()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = export_onnx_model(model, tmp)
+        ort_model = OnnxRuntimeModel(path, intra_op_threads=threads, inter_op_threads=1,
+                                     graph_optimization=graph_optimization)
+
+    def eager(x):
+        with torch.inference_mode():
+            return model(x)
+
+    generator = torch.Generator().manual_seed(seed)
+    results = []
+    for n in lengths:
+        x = torch.randint(1, vocab_size, (1, int(n)), generator=generator)
+        torch_p50, torch_p95 = latency_ms(eager, x, repeats)
+        ort_p50, ort_p95 = latency_ms(ort_model, x, repeats)
+        results.append({
+            "model": name,
+            "seq_len": int(n),
+            "torch_p50_ms": round(torch_p50, 3), "torch_p95_ms": round(torch_p95, 3),
+            "onnx_p50_ms": round(ort_p50, 3), "onnx_p95_ms": round(ort_p95, 3),
+            "speedup_p50": round(torch_p50 / ort_p50, 2),
+            "max_abs_diff": (eager(x) - ort_model(x)).abs().max().item(),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", type=Path, default=Path("../ML_DATA/processed"),
+                        help="Output-Verzeichnis von preprocess_duckdb, Sequenzlängen als Quantile der echten Verteilung")
+    parser.add_argument("--lengths", type=int, nargs="+", default=None,
+                        help="Feste Sequenzlängen statt Quantilen aus --data")
+    parser.add_argument("--models", nargs="+", choices=list(MODELS), default=list(MODELS))
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--seq-len", type=int, default=1024)
+    parser.add_argument("--vocab-size", type=int, default=20924)
+    parser.add_argument("--threads", type=int, default=4, help="Intra-Op Threads für torch und onnxruntime")
+    parser.add_argument("--graph-optimization", choices=GRAPH_OPTIMIZATIONS, default="all")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", type=Path, default=None, help="Ergebnisse zusätzlich als JSON speichern")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    if args.lengths:
+        lengths = args.lengths
+    else:
+        # Median, 90%- und 99%-Quantil der echten Chunk-Längen
+        lengths = sorted({int(q) for q in np.percentile(real_lengths(args.data, args.seq_len), [50, 90, 99])})
+    print(f"⚖️  Backend-Benchmark torch vs. onnxruntime: Längen {lengths}, {args.threads} Threads,"
+          f" Graph-Optimierung {args.graph_optimization}")
+
+    results = []
+    for name in args.models:
+        for result in run(name, lengths, args.vocab_size, args.repeats, args.threads, args.graph_optimization, args.seed):
+            results.append(result)
+            print(f"   {name:<12} len {result['seq_len']:>5}: torch {result['torch_p50_ms']:>8.2f} ms"
+                  f" | onnx {result['onnx_p50_ms']:>8.2f} ms (x{result['speedup_p50']}, p95 {result['onnx_p95_ms']:.2f})"
+                  f" | max. Abweichung {result['max_abs_diff']:.1e}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Ergebnisse gespeichert: {args.out}")
@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+from torch.utils.data import DataLoader
+
+# --- PFAD FIX ---
+root_path = Path(__file__).resolve().parent.parent
+sys.path.append(str(root_path))
+
+from src.data.mimic_loader import MimicMemmapDataset, MimicTokenDataset, collate_fn
+from src.data.token_store import TOKEN_STORE_DIR
+
+# memmap_single: Token-Store, aber pro Sample __getitem__ + pad_sequence (ohne __getitems__)
+IMPLEMENTATIONS = ("dataframe", "memmap_single", "memmap")
+
+
+def child_pids(pid):
+    # DataLoader-Worker sind direkte Kinder des Prozesses (Linux: /proc/<pid>/stat, Feld 4 = ppid)
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def memory_kb(pid):
+    """
+    RSS und PSS eines Prozesses. PSS teilt geteilte Seiten (memmap, fork-COW) anteilig
+    auf -> die Summe über alle Prozesse ist der echte RAM-Bedarf.
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                values[key.lower()] = int(rest.split()[0])
+    return values
+
+
+def make_dataset(impl, data_dir, seq_len):
+    if impl in ("memmap", "memmap_single"):
+        return MimicMemmapDataset(data_dir / TOKEN_STORE_DIR, max_len=seq_len, batched=impl == "memmap")
+    data_path = data_dir / "mimic_sequences.parquet"
+    if not data_path.exists():
+        data_path = data_path.with_suffix("")
+    df = pd.read_parquet(data_path, columns=["subject_id", "chunk_id", "token_ids", "label"])
+    return MimicTokenDataset(df, seq_len)
+
+
+def run_single(impl, data_dir, workers, batch_size, seq_len, epochs):
+    """Ein Messpunkt. Läuft in einem eigenen Prozess, damit sich die Varianten nicht den RAM teilen."""
+    dataset = make_dataset(impl, data_dir, seq_len)
+    loader = DataLoader(
+        dataset, batch_size=batch_size, shuffle=True, collate_fn=collate_fn,
+        num_workers=workers, persistent_workers=workers > 0,
+    )
+    # Erste Epoche wärmt Worker und Page-Cache auf, gemessen werden die folgenden
+    for _ in loader:
+        pass
+    items = 0
+    start = time.perf_counter()
+    for _ in range(epochs):
+        for tokens, labels in loader:
+            items += len(labels)
+    seconds = time.perf_counter() - start
+
+    # Worker leben dank persistent_workers noch -> RAM inklusive aller Worker
+    pids = [os.getpid()] + child_pids(os.getpid())
+    memory = [memory_kb(pid) for pid in pids]
+    return {
+        "impl": impl,
+        "workers": workers,
+        "items_per_second": round(items / seconds, 1),
+        "rss_mb": round(sum(m.get("rss", 0) for m in memory) / 1024, 1),
+        "pss_mb": round(sum(m.get("pss", 0) for m in memory) / 1024, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", type=Path, default=Path("../ML_DATA/processed"),
+                        help="Output-Verzeichnis von preprocess_duckdb (mit --token-store erzeugt)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4])
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--seq-len", type=int, default=1024)
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--impl", choices=IMPLEMENTATIONS, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--out", type=Path, default=None, help="Ergebnisse zusätzlich als JSON speichern")
+    args = parser.parse_args()
+
+    if args.impl:
+        # Kindprozess: genau ein Messpunkt, Ergebnis als JSON auf stdout
+        result = run_single(args.impl, args.data, args.workers[0], args.batch_size, args.seq_len, args.epochs)
+        print(json.dumps(result))
+        sys.exit(0)
+
+    if not (args.data / TOKEN_STORE_DIR).exists():
+        print(f"❌ Kein Token-Store unter {args.data / TOKEN_STORE_DIR}. preprocess_duckdb mit --token-store laufen lassen.")
+        sys.exit(1)
+
+    print(f"🏎️  Data-Loading Benchmark: {args.data} (batch {args.batch_size}, seq_len {args.seq_len})")
+    results = []
+    for impl in IMPLEMENTATIONS:
+        for workers in args.workers:
+            cmd = [sys.executable, __file__, "--impl", impl, "--data", str(args.data), "--workers", str(workers),
+                   "--batch-size", str(args.batch_size), "--seq-len", str(args.seq_len), "--epochs", str(args.epochs)]
+            output = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            results.append(result)
+            print(f"   {impl:<14} workers={workers}: {result['items_per_second']:>10.1f} items/s"
+                  f" | RSS {result['rss_mb']:>8.1f} MB | PSS {result['pss_mb']:>8.1f} MB")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Ergebnisse gespeichert: {args.out}")
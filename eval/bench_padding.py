@@ -0,0 +1,134 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+from omegaconf import OmegaConf, open_dict
+
+# --- PFAD FIX ---
+root_path = Path(__file__).resolve().parent.parent
+sys.path.append(str(root_path))
+
+from src.data.token_store import TOKEN_STORE_DIR, TokenStore
+from src.models.rnn_module import DiseasePredictor as RNNPredictor
+from src.models.transformer_module import DiseasePredictor as TransformerPredictor
+
+# Transformer mit dem Champion-Setup aus config.yaml, LSTM aus conf/model/lstm.yaml
+MODELS = {
+    "transformer": (TransformerPredictor, None),
+    "lstm": (RNNPredictor, "conf/model/lstm.yaml"),
+}
+
+
+def real_lengths(data_dir, seq_len):
+    """Chunk-Längen aus dem Token-Store (schnell) oder aus dem Sequenz-Parquet, gekappt auf seq_len."""
+    if (data_dir / TOKEN_STORE_DIR).exists():
+        lengths = TokenStore(data_dir / TOKEN_STORE_DIR).lengths
+    else:
+        data_path = data_dir / "mimic_sequences.parquet"
+        if not data_path.exists():
+            data_path = data_path.with_suffix("")
+        lengths = pd.read_parquet(data_path, columns=["token_ids"])["token_ids"].map(len).to_numpy()
+    return np.minimum(lengths, seq_len)
+
+
+def make_cfg(name, vocab_size):
+    cfg = OmegaConf.load(root_path / "conf" / "config.yaml")
+    model_file = MODELS[name][1]
+    if model_file:
+        cfg.model = OmegaConf.load(root_path / model_file)
+    with open_dict(cfg):
+        cfg.model.input_dim = vocab_size
+    return cfg
+
+
+def make_pair(name, vocab_size):
+    # Zwei Modelle mit identischen Gewichten, nur skip_padding unterscheidet sich
+    models = {}
+    for skip in (False, True):
+        cfg = make_cfg(name, vocab_size)
+        with open_dict(cfg):
+            cfg.model.skip_padding = skip
+        torch.manual_seed(0)
+        models[skip] = MODELS[name][0](cfg).eval()
+    return models
+
+
+def random_batch(lengths, vocab_size, generator):
+    x = torch.zeros(len(lengths), int(lengths.max()), dtype=torch.long)
+    for row, n in enumerate(lengths):
+        x[row, :n] = torch.randint(1, vocab_size, (int(n),), generator=generator)
+    return x
+
+
+def time_forward(model, batches, repeats):
+    with torch.inference_mode():
+        model(batches[0])  # Warm-up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for x in batches:
+                model(x)
+        seconds = time.perf_counter() - start
+    return sum(int((x != 0).sum()) for x in batches) * repeats / seconds
+
+
+def run(name, lengths, vocab_size, batch_size, n_batches, repeats, seed):
+    models = make_pair(name, vocab_size)
+    rng = np.random.default_rng(seed)
+    generator = torch.Generator().manual_seed(seed)
+    batches = [random_batch(rng.choice(lengths, batch_size), vocab_size, generator) for _ in range(n_batches)]
+
+    # Ohne Padding müssen beide Pfade dasselbe liefern
+    full = random_batch(np.full(batch_size, int(lengths.max())), vocab_size, generator)
+    with torch.inference_mode():
+        identical = torch.equal(models[False](full), models[True](full))
+
+    padded = time_forward(models[False], batches, repeats)
+    skipped = time_forward(models[True], batches, repeats)
+    return {
+        "model": name,
+        "padding_ratio": round(1 - sum(int((x != 0).sum()) for x in batches) / sum(x.numel() for x in batches), 3),
+        "tokens_per_second_padded": round(padded, 1),
+        "tokens_per_second_skip_padding": round(skipped, 1),
+        "speedup": round(skipped / padded, 2),
+        "identical_unpadded": identical,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", type=Path, default=Path("../ML_DATA/processed"),
+                        help="Output-Verzeichnis von preprocess_duckdb (Token-Store oder Sequenz-Parquet)")
+    parser.add_argument("--models", nargs="+", choices=list(MODELS), default=list(MODELS))
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--batches", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seq-len", type=int, default=1024)
+    parser.add_argument("--vocab-size", type=int, default=20924)
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads (Default: alle Kerne)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", type=Path, default=None, help="Ergebnisse zusätzlich als JSON speichern")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    lengths = real_lengths(args.data, args.seq_len)
+    print(f"📏 Padding-Benchmark: {len(lengths)} Chunks, Median-Länge {int(np.median(lengths))},"
+          f" batch {args.batch_size}, seq_len {args.seq_len}")
+
+    results = []
+    for name in args.models:
+        result = run(name, lengths, args.vocab_size, args.batch_size, args.batches, args.repeats, args.seed)
+        results.append(result)
+        print(f"   {name:<12} Padding {result['padding_ratio']:.1%}: {result['tokens_per_second_padded']:>10.1f} -> "
+              f"{result['tokens_per_second_skip_padding']:>10.1f} Token/s (x{result['speedup']})"
+              f" | ohne Padding identisch: {'✅' if result['identical_unpadded'] else '❌'}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Ergebnisse gespeichert: {args.out}")
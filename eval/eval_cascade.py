@@ -0,0 +1,99 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import mlflow
+import mlflow.pytorch
+import numpy as np
+import torch
+
+# --- PFAD FIX ---
+root_path = Path(__file__).resolve().parent.parent
+sys.path.append(str(root_path))
+
+db_path = root_path.parent / "ML_DATA" / "mlflow.db"
+mlflow.set_tracking_uri(f"sqlite:///{db_path.as_posix()}")
+
+from src.data.mimic_loader import MimicDataModule, collate_fn
+from src.models.cascade import CascadePredictor, band_report, collect_scores, percentiles, request_latency, risk
+
+DEFAULT_BANDS = ["0.02:0.5", "0.05:0.5", "0.05:0.7", "0.1:0.5", "0.1:0.7"]
+
+
+def parse_band(text):
+    low, high = text.split(":")
+    return float(low), float(high)
+
+
+def latency_rows(dataset, n_scored, n, seed):
+    # Stichprobe aus den bewerteten Val-Zeilen, je als Batch 1 ohne Padding (wie eine Anfrage)
+    rows = np.sort(np.random.default_rng(seed).choice(n_scored, min(n, n_scored), replace=False))
+    return rows, [collate_fn([dataset[int(i)]])[0] for i in rows]
+
+
+def measure_cascade(cascade, requests):
+    # Echte Ende-zu-Ende Zeit der Kaskade pro Anfrage (billig + ggf. Transformer)
+    escalated = sum(int(cascade.predict(x)[2].sum()) for x in requests)
+    return percentiles(request_latency(cascade.predict, requests)), escalated / max(len(requests), 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cheap", type=str, default="MIMIC_Mortality_Predictor_student",
+                        help="Registry-Name des billigen Scorers (LSTM / Bag-of-Tokens)")
+    parser.add_argument("--full", type=str, default="MIMIC_Mortality_Predictor", help="Registry-Name des Transformers")
+    parser.add_argument("--version", type=str, default="latest")
+    parser.add_argument("--bands", nargs="+", default=DEFAULT_BANDS, help="Unsicherheits-Bänder low:high")
+    parser.add_argument("--max-batches", type=int, default=None)
+    parser.add_argument("--cpu", action="store_true", help="Scores auf der CPU rechnen (Latenz immer auf der CPU)")
+    parser.add_argument("--latency-rows", type=int, default=200, help="Val-Zeilen für die Latenz pro Anfrage")
+    parser.add_argument("--threads", type=int, default=4, help="Intra-Op Threads für die Latenz-Messung")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", type=Path, default=Path("cascade_report.json"))
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() and not args.cpu else "cpu"
+    cheap = mlflow.pytorch.load_model(f"models:/{args.cheap}/{args.version}", map_location=device).eval()
+    full = mlflow.pytorch.load_model(f"models:/{args.full}/{args.version}", map_location=device).eval()
+
+    # Val-Split aus der Config des Transformers, wie in eval_early_warnings.py
+    cfg = full.cfg
+    dm = MimicDataModule(cfg, cache_path=Path(cfg.mlflow.storage_dir).resolve())
+    dm.setup()
+
+    print(f"🪜 Kaskade {args.cheap} -> {args.full} auf dem Val-Split ({device})")
+    scores = collect_scores(cheap, full, dm.val_dataloader(), device, args.max_batches)
+
+    # Latenz wie im Serving: CPU, einzelne Anfragen (Batch 1), p50/p95 statt Durchschnitt über Batches
+    cheap, full = cheap.cpu(), full.cpu()
+    torch.set_num_threads(args.threads)
+    rows, requests = latency_rows(dm.make_dataset("val"), len(scores["targets"]), args.latency_rows, args.seed)
+    latency = {
+        "rows": rows,
+        "cheap_ms": request_latency(lambda x: risk(cheap, x), requests),
+        "full_ms": request_latency(lambda x: risk(full, x), requests),
+    }
+    cheap_p, full_p = percentiles(latency["cheap_ms"]), percentiles(latency["full_ms"])
+    print(f"   Latenz pro Anfrage (CPU, {len(requests)} Zeilen, {args.threads} Threads):"
+          f" billig p50 {cheap_p['p50_ms']:.2f} / p95 {cheap_p['p95_ms']:.2f} ms"
+          f" | Transformer p50 {full_p['p50_ms']:.2f} / p95 {full_p['p95_ms']:.2f} ms")
+
+    bands = [parse_band(b) for b in args.bands]
+    report = band_report(scores, bands, latency)
+    print(f"   {'Band':<12} {'Eskalation':>10} {'AUROC':>8} {'Δ Transf.':>10} {'AUPRC':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in report:
+        print(f"   [{row['low']:.2f}, {row['high']:.2f}] {row['escalation_rate']:>10.1%} {row['auroc']:>8.4f}"
+              f" {row['auroc'] - row['auroc_full']:>+10.4f} {row['auprc']:>8.4f} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f}")
+    print(f"   Nur billig: AUROC {report[0]['auroc_cheap']:.4f} | Nur Transformer: AUROC {report[0]['auroc_full']:.4f}")
+
+    # Ende-zu-Ende für das erste Band, als Abgleich zur Schätzung
+    cascade = CascadePredictor(cheap, full, *bands[0])
+    measured, rate = measure_cascade(cascade, requests)
+    print(f"   Gemessen [{bands[0][0]:.2f}, {bands[0][1]:.2f}]: p50 {measured['p50_ms']:.2f} / p95"
+          f" {measured['p95_ms']:.2f} ms pro Anfrage, Eskalation {rate:.1%}")
+
+    with open(args.out, "w") as f:
+        json.dump({"bands": report, "measured": {"band": bands[0], **measured, "escalation_rate": rate},
+                   "cheap": cheap_p, "full": full_p, "latency_rows": len(requests), "threads": args.threads}, f, indent=2)
+    print(f"✅ Report gespeichert: {args.out}")
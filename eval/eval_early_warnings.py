@@ -28,10 +28,33 @@ import torchmetrics
 # Wir brauchen die Imports noch, damit Pickle die Klassen findet, 
 # auch wenn wir sie nicht direkt instanziieren.
 from src.models.rnn_module import DiseasePredictor as RNNPredictor
-from src.data.mimic_loader import MimicDataModule
+from src.models.causal_transformer_module import DiseasePredictor as CausalTransformerPredictor
+from src.models.hierarchical_module import DiseasePredictor as HierarchicalPredictor, check_chunk_cache
+from src.models.bag_of_tokens_module import DiseasePredictor as BagOfTokensPredictor
+from src.data.mimic_loader import MimicDataModule, MimicMemmapDataset, MimicPatientDataset
 
 
-def evaluate_from_registry(model_name="MIMIC_Mortality_Predictor", version="latest", fractions=[0.2, 0.4, 0.6, 0.8, 1.0]):
+def truncate_patients(x, fraction):
+    # Die ersten fraction * n echten Token jedes Patienten behalten (Chunks in chunk_id-Reihenfolge,
+    # Padding rechts in jedem Chunk), Rest auf <PAD> -> Chunks danach sind leer
+    real = (x != 0).flatten(1)
+    cutoff = (real.sum(dim=1, keepdim=True) * fraction).long().clamp(min=1)
+    keep = real & (real.cumsum(dim=1) <= cutoff)
+    return x * keep.view_as(x)
+
+
+def check_cache_patients(model, dm, n_patients=20):
+    # /predict_patient (ChunkCache) muss dasselbe Risiko liefern wie forward() auf der ganzen Historie
+    chunks = dm.make_dataset("val")
+    if isinstance(chunks, MimicMemmapDataset):
+        chunks.batched = False
+    patients = MimicPatientDataset(chunks, dm.subject_ids("val"), model.cfg.model.get("max_chunks"))
+    sample = [[t.tolist() for t in patients[i][0]] for i in range(min(n_patients, len(patients)))]
+    diff = check_chunk_cache(model, sample)
+    print(f"✅ ChunkCache == forward() auf {len(sample)} Patienten (max. Abweichung {diff:.1e})")
+
+
+def evaluate_from_registry(model_name="MIMIC_Mortality_Predictor", version="latest", fractions=[0.2, 0.4, 0.6, 0.8, 1.0], hours=None):
     
     model_uri = f"models:/{model_name}/{version}"
     print(f"☁️ Lade Modell aus Registry: {model_uri}")
@@ -58,30 +81,40 @@ def evaluate_from_registry(model_name="MIMIC_Mortality_Predictor", version="late
     
     dm = MimicDataModule(cfg, cache_path=Path(cfg.mlflow.storage_dir).resolve())
     dm.setup()
-    val_loader = dm.val_dataloader()
+
+    if dm.hierarchical:
+        check_cache_patients(model, dm)
 
     # 3. Evaluation Loop (wie vorher)
     auroc_metric = torchmetrics.classification.BinaryAUROC().to(model.device)
     results = {}
 
     print(f"🔬 Starte Early Warning Analyse...")
-    
-    for frac in fractions:
+
+    # Mit hours: zeitbasiert "N Stunden vor Ende" (aus time_deltas), sonst Anteil der Token
+    steps = hours if hours else fractions
+    for step in steps:
         all_probs = []
         all_targets = []
+        val_loader = dm.val_dataloader(hours_before_end=step) if hours else dm.val_dataloader()
+        desc = f"{step}h vor Ende" if hours else f"Sicht {int(step*100)}%"
         
         with torch.no_grad():
-            for batch in tqdm(val_loader, desc=f"Sicht {int(frac*100)}%", leave=False):
+            for batch in tqdm(val_loader, desc=desc, leave=False):
                 x, y = batch
                 x = x.to(model.device)
                 y = y.to(model.device).long()
                 
-                # Truncation
-                seq_len = x.shape[1]
-                cutoff = int(seq_len * frac)
-                if cutoff < 1: cutoff = 1
-                
-                x_truncated = x[:, :cutoff]
+                # Truncation (mit hours hat der Loader das Zeitfenster schon geschnitten)
+                if x.dim() == 3:
+                    # Hierarchisch [Batch, Chunks, ChunkLen]: Anteil der echten Token über alle Chunks
+                    x_truncated = x if hours else truncate_patients(x, step)
+                else:
+                    seq_len = x.shape[1]
+                    cutoff = seq_len if hours else int(seq_len * step)
+                    if cutoff < 1: cutoff = 1
+
+                    x_truncated = x[:, :cutoff]
                 
                 logits = model(x_truncated)
                 probs = torch.softmax(logits, dim=1)[:, 1]
@@ -90,18 +123,22 @@ def evaluate_from_registry(model_name="MIMIC_Mortality_Predictor", version="late
                 all_targets.append(y)
         
         score = auroc_metric(torch.cat(all_probs), torch.cat(all_targets)).item()
-        results[frac] = score
-        print(f"   -> {int(frac*100)}% Sicht: AUROC {score:.4f}")
+        results[step] = score
+        print(f"   -> {desc}: AUROC {score:.4f}")
 
     return results
 
-def plot_results(results):
-    x = [k * 100 for k in results.keys()]
+def plot_results(results, hours=False):
+    x = list(results.keys()) if hours else [k * 100 for k in results.keys()]
     y = list(results.values())
     plt.figure(figsize=(10, 6))
     plt.plot(x, y, marker='o', linestyle='-', color='purple', linewidth=2)
     plt.title("Early Warning Performance (Loaded from MLflow)", fontsize=14)
-    plt.xlabel("Percentage of Stay Observed (%)")
+    if hours:
+        plt.gca().invert_xaxis()
+        plt.xlabel("Hours Before Discharge/Death")
+    else:
+        plt.xlabel("Percentage of Stay Observed (%)")
     plt.ylabel("AUROC")
     plt.grid(True, alpha=0.3)
     plt.ylim(0.5, 1.0)
@@ -111,8 +148,10 @@ def plot_results(results):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--version", type=str, default="Latest", help="Modell Version (z.B. '1', '2' oder 'Latest'/'Production')")
+    parser.add_argument("--hours", type=float, nargs="+", default=None,
+                        help="Zeit-Horizonte statt Token-Anteil, z.B. --hours 48 24 12 6 0")
     args = parser.parse_args()
 
-    results = evaluate_from_registry(version=args.version)
+    results = evaluate_from_registry(version=args.version, hours=args.hours)
     if results:
-        plot_results(results)
\ No newline at end of file
+        plot_results(results, hours=bool(args.hours))
\ No newline at end of file
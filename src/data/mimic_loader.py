@@ -1,35 +1,498 @@
 import torch
-import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from functools import partial
 from pathlib import Path
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, IterableDataset, get_worker_info
 from torch.nn.utils.rnn import pad_sequence
 import pytorch_lightning as pl
 
+from src.data.samplers import LengthBucketBatchSampler, PackedBatchSampler, pack_rows, padding_ratio, random_batches
+from src.data.splits import N_FOLDS, TRAIN_FRAC, hash_split_mask, load_split_index, split_rows
+from src.data.token_store import TOKEN_STORE_DIR, TokenStore
+from src.data.vocab import check_vocab_hash, parquet_vocab_hash
+
+def window_before_end(tokens, deltas, hours):
+    """
+    Schneidet die letzten `hours` Stunden des Chunks ab (Zeit aus time_deltas, kein Rejoin
+    auf die Rohdaten). Nur beim letzten Chunk eines Patienten ist das Ende Entlassung bzw.
+    Tod -> die Datasets behalten mit hours_before_end nur diesen Chunk (last_chunk_mask).
+    """
+    minutes = np.cumsum(deltas)
+    keep = int(np.searchsorted(minutes, minutes[-1] - hours * 60, side="right"))
+    # Mindestens ein Token, sonst gibt es nichts zu klassifizieren
+    return tokens[:max(keep, 1)]
+
+
+def last_chunk_mask(subject_ids):
+    # Zeilen in (subject_id, chunk_id)-Reihenfolge: True beim letzten Chunk jedes Patienten
+    subject_ids = np.asarray(subject_ids)
+    return np.append(subject_ids[1:] != subject_ids[:-1], True) if len(subject_ids) else np.zeros(0, dtype=bool)
+
+
 class MimicTokenDataset(Dataset):
-    def __init__(self, df, max_len=None):
+    def __init__(self, df, max_len=None, hours_before_end=None, keep_deltas=False):
+        if hours_before_end is not None:
+            # "N Stunden vor Ende" gilt nur für den letzten Chunk, frühere enden nicht mit Entlassung/Tod
+            df = df[last_chunk_mask(df['subject_id'].to_numpy())]
         self.tokens = df['token_ids'].tolist()
         self.labels = df['label'].tolist()
         self.max_len = max_len 
+        # Länge nach Truncation, für den Length-Bucketing Sampler
+        self.lengths = np.fromiter(map(len, self.tokens), dtype=np.int64, count=len(self.tokens))
+        if max_len:
+            self.lengths = np.minimum(self.lengths, max_len)
+        self.hours_before_end = hours_before_end
+        self.time_deltas = None
+        # keep_deltas: Zeitfenster über die ganze Historie (MimicPatientDataset)
+        if hours_before_end is not None or keep_deltas:
+            if 'time_deltas' not in df.columns:
+                raise ValueError("❌ hours_before_end braucht die Spalte time_deltas (Preprocessing neu laufen lassen)")
+            self.time_deltas = df['time_deltas'].tolist()
 
     def __len__(self):
         return len(self.tokens)
 
+    def deltas(self, idx):
+        return self.time_deltas[idx]
+
     def __getitem__(self, idx):
         tokens = self.tokens[idx]
         label = self.labels[idx]
+
+        if self.hours_before_end is not None:
+            tokens = window_before_end(tokens, self.time_deltas[idx], self.hours_before_end)
         
         if self.max_len and len(tokens) > self.max_len:
             tokens = tokens[:self.max_len]
             
         return torch.tensor(tokens, dtype=torch.long), torch.tensor(label, dtype=torch.float32)
 
+class MimicMemmapDataset(Dataset):
+    """
+    Chunks direkt aus dem Token-Store (flacher Token-Buffer + Offsets als np.memmap).
+    __getitem__ liefert einen Tensor-View auf den Buffer, keine Python-Listen pro Chunk:
+    die Seiten teilen sich alle DataLoader-Worker über den Page-Cache, der RAM bleibt
+    bei mehr Workern flach. Tokens bleiben int16/int32, collate_fn macht daraus long.
+
+    batched=True: der DataLoader ruft __getitems__ mit allen Indizes eines Batches auf,
+    der gepaddete Batch entsteht in einem Gather direkt aus dem Token-Buffer.
+    """
+    def __init__(self, store_dir, indices=None, max_len=None, hours_before_end=None, batched=True, pin_memory=False,
+                 keep_deltas=False):
+        self.store_dir = Path(store_dir)
+        self.max_len = max_len
+        self.hours_before_end = hours_before_end
+        self.batched = batched
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self._store = None
+        store = self.store
+        self.indices = np.arange(len(store)) if indices is None else np.asarray(indices, dtype=np.int64)
+        if hours_before_end is not None:
+            # Nur der letzte Chunk jedes Patienten (siehe window_before_end)
+            self.indices = self.indices[last_chunk_mask(store.subject_id)[self.indices]]
+        # Ein float pro Chunk, klein genug für eine echte Kopie
+        self.labels = store.label[self.indices].astype(np.float32)
+        self.lengths = store.lengths[self.indices]
+        if max_len:
+            self.lengths = np.minimum(self.lengths, max_len)
+        if (hours_before_end is not None or keep_deltas) and store.time_deltas is None:
+            raise ValueError("❌ hours_before_end braucht time_deltas im Token-Store (Preprocessing neu laufen lassen)")
+
+    @property
+    def store(self):
+        # Erst im Worker öffnen: ein gepickelter memmap würde die Daten kopieren (spawn/Windows)
+        if self._store is None:
+            # "c" = copy-on-write: beschreibbar für torch.from_numpy, Seiten bleiben geteilt
+            self._store = TokenStore(self.store_dir, mmap_mode="c")
+        return self._store
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_store"] = None
+        return state
+
+    def __len__(self):
+        return len(self.indices)
+
+    def deltas(self, i):
+        return self.store.deltas(self.indices[i])
+
+    def __getitem__(self, i):
+        idx = self.indices[i]
+        tokens = self.store[idx]
+
+        if self.hours_before_end is not None:
+            tokens = window_before_end(tokens, self.store.deltas(idx), self.hours_before_end)
+
+        if self.max_len and len(tokens) > self.max_len:
+            tokens = tokens[:self.max_len]
+
+        return torch.from_numpy(tokens), torch.tensor(self.labels[i])
+
+    def batch_lengths(self, rows):
+        lengths = self.store.offsets[rows + 1] - self.store.offsets[rows]
+        if self.hours_before_end is not None:
+            # Zeitfenster nur pro Chunk berechenbar (cumsum der deltas), betrifft nur die Eval
+            lengths = np.array([
+                len(window_before_end(self.store[row], self.store.deltas(row), self.hours_before_end)) for row in rows
+            ], dtype=np.int64)
+        if self.max_len:
+            lengths = np.minimum(lengths, self.max_len)
+        return lengths
+
+    def allocate(self, n_rows, width):
+        if get_worker_info() is not None:
+            # Worker: direkt in Shared Memory, sonst kopiert torch den Batch beim Senden nochmal
+            return torch.empty((n_rows, width), dtype=torch.long).share_memory_()
+        if not self.pin_memory:
+            return torch.empty((n_rows, width), dtype=torch.long)
+        # Hauptprozess: eigener gepinnter Tensor pro Batch, Batches dürfen beliebig lange leben
+        # (Eval-Inputs sammeln, tiefer Prefetch, laufende non_blocking-Kopie). Der Caching-Host-
+        # Allocator von torch gibt einen Block erst nach dem Freigeben wieder aus -> kein cudaHostAlloc pro Batch
+        return torch.empty((n_rows, width), dtype=torch.long, pin_memory=True)
+
+    def __getitems__(self, batch_idx):
+        if not self.batched:
+            # Für collate_packed: Liste einzelner Samples wie beim normalen Fetch
+            return [self[i] for i in batch_idx]
+        batch_idx = np.asarray(batch_idx, dtype=np.int64)
+        rows = self.indices[batch_idx]
+        lengths = self.batch_lengths(rows)
+        width = max(int(lengths.max()), 1) if len(lengths) else 1
+
+        # Ein Gather für den ganzen Batch: Position = Start des Chunks + Spalte, Padding zeigt auf 0
+        cols = np.arange(width)
+        valid = cols[None, :] < lengths[:, None]
+        positions = np.where(valid, self.store.offsets[rows][:, None] + cols[None, :], 0)
+        tokens = self.allocate(len(rows), width)
+        out = tokens.numpy()
+        np.copyto(out, self.store.tokens[positions])
+        out[~valid] = 0
+        # Tuple = fertiger Batch, collate_fn reicht ihn nur durch
+        return tokens, torch.from_numpy(self.labels[batch_idx])
+
+
+class MimicPatientDataset(Dataset):
+    """
+    Ein Item = ein Patient: alle seine Chunks (Reihenfolge chunk_id) aus einem Chunk-Dataset,
+    für das hierarchische Modell. Die Zeilen sind nach (subject_id, chunk_id) sortiert,
+    die Chunks eines Patienten liegen also am Stück. max_chunks behält die neuesten.
+
+    hours_before_end: die letzten N Stunden der Historie abschneiden, über Chunk-Grenzen
+    hinweg (time_deltas laufen über die Chunks weiter, chunks.deltas(j) muss gehen).
+    """
+    def __init__(self, chunks, subject_ids, max_chunks=None, hours_before_end=None):
+        self.chunks = chunks
+        self.max_chunks = max_chunks
+        self.hours_before_end = hours_before_end
+        # Grenzen der Patienten-Blöcke: [0, Wechsel der subject_id..., n]
+        subject_ids = np.asarray(subject_ids)
+        self.bounds = np.r_[0, np.flatnonzero(subject_ids[1:] != subject_ids[:-1]) + 1, len(subject_ids)]
+        if len(subject_ids) == 0:
+            self.bounds = self.bounds[:1]
+
+    def __len__(self):
+        return len(self.bounds) - 1
+
+    def __getitem__(self, i):
+        start, end = self.bounds[i], self.bounds[i + 1]
+        if self.max_chunks:
+            start = max(start, end - self.max_chunks)
+        items = [self.chunks[j] for j in range(start, end)]
+        tokens = [t for t, _ in items]
+        if self.hours_before_end is not None:
+            tokens = self.window(tokens, range(start, end))
+        # Label des Patienten = Label des letzten Chunks
+        return tokens, items[-1][1]
+
+    def window(self, tokens, rows):
+        # Wie window_before_end, nur über alle Chunks: Chunks ganz im Fenster fallen weg
+        deltas = [np.asarray(self.chunks.deltas(j)) for j in rows]
+        minutes = np.cumsum(np.concatenate(deltas))
+        cut = minutes[-1] - self.hours_before_end * 60
+        kept, offset = [], 0
+        for t, d in zip(tokens, deltas):
+            keep = min(int(np.searchsorted(minutes[offset:offset + len(d)], cut, side="right")), len(t))
+            offset += len(d)
+            if keep == 0:
+                break
+            kept.append(t[:keep])
+        # Mindestens ein Token, sonst gibt es nichts zu klassifizieren
+        return kept or [tokens[0][:1]]
+
+
+class TeacherLogitsDataset(Dataset):
+    """
+    Distillation: Chunk-Dataset plus vorberechnete Teacher-Logits (gleiche Zeilen-Reihenfolge).
+    Items sind (tokens, teacher_logits, label), .lengths bleibt für die Sampler erhalten.
+    """
+    def __init__(self, chunks, teacher_logits):
+        if len(chunks) != len(teacher_logits):
+            raise ValueError(f"❌ {len(teacher_logits)} Teacher-Logits für {len(chunks)} Chunks")
+        self.chunks = chunks
+        self.teacher_logits = torch.from_numpy(np.ascontiguousarray(teacher_logits, dtype=np.float32))
+        self.lengths = chunks.lengths
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def __getitem__(self, i):
+        tokens, label = self.chunks[i]
+        return tokens, self.teacher_logits[i], label
+
+
+def collate_distill(batch):
+    tokens_list, teacher_list, labels_list = zip(*batch)
+    tokens_padded = pad_sequence(tokens_list, batch_first=True, padding_value=0).long()
+    return tokens_padded, torch.stack(teacher_list), torch.stack(labels_list)
+
+
+def collate_patients(batch):
+    # [Batch, Chunks, ChunkLen]: fehlende Chunks und Token rechts mit 0 aufgefüllt
+    chunk_lists, labels_list = zip(*batch)
+    n_chunks = max(len(chunks) for chunks in chunk_lists)
+    width = max(len(t) for chunks in chunk_lists for t in chunks)
+    tokens = torch.zeros(len(batch), n_chunks, width, dtype=torch.long)
+    for b, chunks in enumerate(chunk_lists):
+        for c, t in enumerate(chunks):
+            tokens[b, c, :len(t)] = t
+    return tokens, torch.stack(labels_list)
+
+
+def parquet_row_groups(path):
+    # (Datei, Row-Group) für eine Datei oder ein Hive-partitioniertes Dataset, stabile Reihenfolge
+    path = Path(path)
+    files = sorted(path.rglob("*.parquet")) if path.is_dir() else [path]
+    return [(f, rg) for f in files for rg in range(pq.ParquetFile(f).num_row_groups)]
+
+
+def read_rows(path, columns, row_sets):
+    """
+    Liest nur die Zeilen aus row_sets (Positionen in der kanonischen Reihenfolge
+    (subject_id, chunk_id) wie im Split-Index), Row-Group für Row-Group. Statt der ganzen
+    Tabelle plus take()-Kopie liegt so höchstens eine Row-Group zusätzlich im RAM, Row-Groups
+    ohne ausgewählte Zeilen werden gar nicht gelesen. Gibt eine pyarrow-Tabelle pro Set zurück.
+    """
+    row_groups = parquet_row_groups(path)
+    sizes = [pq.ParquetFile(f).metadata.row_group(rg).num_rows for f, rg in row_groups]
+    starts = np.concatenate([[0], np.cumsum(sizes)])
+    perm = None
+    if Path(path).is_dir():
+        # Dataset: Dateien sind nur in sich sortiert -> kanonische Zeile -> Position über die kleinen Spalten
+        ids = pa.concat_tables([pq.read_table(f, columns=['subject_id', 'chunk_id']) for f in sorted({f for f, _ in row_groups})])
+        perm = np.lexsort((ids.column('chunk_id').to_numpy(), ids.column('subject_id').to_numpy()))
+
+    positions, orders = [], []
+    for rows in row_sets:
+        pos = np.asarray(rows, dtype=np.int64) if perm is None else perm[rows]
+        order = np.argsort(pos, kind="stable")
+        positions.append(pos[order])
+        orders.append(order)
+
+    pieces = [[] for _ in row_sets]
+    for (f, rg), start, end in zip(row_groups, starts[:-1], starts[1:]):
+        bounds = [np.searchsorted(pos, [start, end]) for pos in positions]
+        if all(lo == hi for lo, hi in bounds):
+            continue
+        table = pq.ParquetFile(f).read_row_group(rg, columns=columns)
+        for piece, pos, (lo, hi) in zip(pieces, positions, bounds):
+            if lo < hi:
+                piece.append(table.take(pos[lo:hi] - start))
+
+    tables = []
+    for piece, order in zip(pieces, orders):
+        table = pa.concat_tables(piece) if piece else pq.read_schema(row_groups[0][0]).empty_table().select(columns)
+        # Zurück in die Reihenfolge von rows (beim Dataset nach Position sortiert gelesen)
+        tables.append(table if perm is None else table.take(np.argsort(order)))
+    return tables
+
+
+def distributed_rank():
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        return torch.distributed.get_rank(), torch.distributed.get_world_size()
+    return 0, 1
+
+
+class MimicStreamingDataset(IterableDataset):
+    """
+    Streaming über die Parquet Row-Groups statt pd.read_parquet der ganzen Datei: der RAM
+    hängt nur an Row-Group-Größe und shuffle_buffer, nicht an der Datenmenge, und der
+    erste Batch kommt sofort.
+
+    - Row-Groups werden pro Epoche gemischt und dann auf alle Worker aller Ranks verteilt
+      (jeder liest nur seinen Teil, disjunkt).
+    - Split per Hash der subject_id (src/data/splits.py), Zeile für Zeile.
+    - Shuffle nur innerhalb des Buffers (approximativ, wie bei Sharded-Datasets üblich).
+    - DDP: jeder Shard (Rank, Worker) liefert gleich viele Zeilen -> jeder Rank gleich viele
+      Batches, sonst hängt der Gradient-Sync am Epochenende. Train schneidet auf den kleinsten
+      Shard ab, Val füllt bis zum größten mit wiederholten Zeilen auf (wie der DistributedSampler).
+
+    Kein __len__: die Split-Größe steht erst nach dem Lesen fest.
+    """
+    def __init__(self, path, split, seed=0, train_frac=TRAIN_FRAC, max_len=None, hours_before_end=None,
+                 shuffle=True, shuffle_buffer=10_000, read_batch_size=1024):
+        self.path = Path(path)
+        self.split = split
+        self.seed = seed
+        self.train_frac = train_frac
+        self.max_len = max_len
+        self.hours_before_end = hours_before_end
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.read_batch_size = read_batch_size
+        self.row_groups = parquet_row_groups(self.path)
+        self.epoch = 0
+        # Zeilen im Split pro Row-Group, erst bei DDP gebraucht (lazy, siehe shard_rows)
+        self.row_group_rows = None
+        self.columns = ['subject_id', 'token_ids', 'label']
+        self.last_chunks = None
+        if hours_before_end is not None:
+            if 'time_deltas' not in pq.ParquetDataset(self.path).schema.names:
+                raise ValueError("❌ hours_before_end braucht die Spalte time_deltas (Preprocessing neu laufen lassen)")
+            self.columns += ['chunk_id', 'time_deltas']
+            # Letzter Chunk pro Patient (siehe window_before_end). Ein Patient kann über
+            # Row-Groups hinweg liegen -> einmal vorab über die beiden Int-Spalten
+            ids = pq.read_table(self.path, columns=['subject_id', 'chunk_id']).group_by('subject_id').aggregate([('chunk_id', 'max')])
+            order = np.argsort(ids.column('subject_id').to_numpy())
+            self.last_chunks = (ids.column('subject_id').to_numpy()[order], ids.column('chunk_id_max').to_numpy()[order])
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def shard(self, epoch):
+        """
+        Eine globale Reihenfolge pro Epoche, dann Round-Robin auf (Rank, Worker).
+        Gibt (Row-Groups, shard_id, Ziel-Zeilen) zurück, Ziel None = ohne DDP nicht angleichen.
+        """
+        order = np.arange(len(self.row_groups))
+        if self.shuffle:
+            order = np.random.default_rng([self.seed, epoch]).permutation(order)
+        rank, world_size = distributed_rank()
+        info = get_worker_info()
+        worker_id, num_workers = (info.id, info.num_workers) if info is not None else (0, 1)
+        n_shards = world_size * num_workers
+        shard_id = rank * num_workers + worker_id
+        target = None
+        if world_size > 1:
+            rows = self.shard_rows()
+            per_shard = [int(rows[order[s::n_shards]].sum()) for s in range(n_shards)]
+            if min(per_shard) == 0:
+                raise ValueError(f"❌ Ein Streaming-Shard hat keine Zeilen ({len(self.row_groups)} Row-Groups"
+                                 f" für {world_size} Ranks x {num_workers} Worker). Weniger Worker nutzen.")
+            target = max(per_shard) if self.split == "val" else min(per_shard)
+        return [self.row_groups[i] for i in order[shard_id::n_shards]], shard_id, target
+
+    def shard_rows(self):
+        # Einmal nur die subject_id (bzw. chunk_id) Spalte lesen: Zeilen im Split pro Row-Group
+        if self.row_group_rows is None:
+            columns = ['subject_id', 'chunk_id'] if self.last_chunks is not None else ['subject_id']
+            self.row_group_rows = np.array([
+                int(self.split_mask(pq.ParquetFile(path).read_row_group(rg, columns=columns)).sum())
+                for path, rg in self.row_groups
+            ], dtype=np.int64)
+        return self.row_group_rows
+
+    def split_mask(self, batch):
+        subject_ids = batch.column('subject_id').to_numpy()
+        mask = hash_split_mask(subject_ids, self.seed, self.split, self.train_frac)
+        if self.last_chunks is not None:
+            subjects, last = self.last_chunks
+            mask &= batch.column('chunk_id').to_numpy() == last[np.searchsorted(subjects, subject_ids)]
+        return mask
+
+    def equalize(self, row_groups, target):
+        # Genau target Zeilen: abschneiden bzw. den eigenen Shard von vorne wiederholen
+        count = 0
+        while count < target:
+            for item in self.read(row_groups):
+                if count == target:
+                    return
+                yield item
+                count += 1
+
+    def read(self, row_groups):
+        for path, rg in row_groups:
+            batches = pq.ParquetFile(path).iter_batches(
+                batch_size=self.read_batch_size, row_groups=[rg], columns=self.columns
+            )
+            for batch in batches:
+                keep = np.flatnonzero(self.split_mask(batch))
+                if len(keep) == 0:
+                    continue
+                tokens = batch.column('token_ids')
+                offsets, values = tokens.offsets.to_numpy(), tokens.values.to_numpy()
+                labels = batch.column('label').to_numpy()
+                if self.hours_before_end is not None:
+                    deltas = batch.column('time_deltas')
+                    delta_offsets, delta_values = deltas.offsets.to_numpy(), deltas.values.to_numpy()
+                for i in keep:
+                    # Views in den Arrow-Buffer, kopiert wird erst beim Truncaten/Padding
+                    chunk = values[offsets[i]:offsets[i + 1]]
+                    if self.hours_before_end is not None:
+                        chunk = window_before_end(chunk, delta_values[delta_offsets[i]:delta_offsets[i + 1]], self.hours_before_end)
+                    if self.max_len and len(chunk) > self.max_len:
+                        chunk = chunk[:self.max_len]
+                    yield torch.from_numpy(chunk.copy()), torch.tensor(labels[i], dtype=torch.float32)
+
+    def __iter__(self):
+        epoch = self.epoch
+        # Ohne set_epoch() (persistente Worker behalten ihre Kopie) trotzdem jede Epoche neu mischen
+        self.epoch += 1
+        row_groups, shard_id, target = self.shard(epoch)
+        items = self.read(row_groups) if target is None else self.equalize(row_groups, target)
+        if not self.shuffle or self.shuffle_buffer <= 1:
+            yield from items
+            return
+        rng = np.random.default_rng([self.seed, epoch, shard_id])
+        buffer = []
+        for item in items:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(item)
+                continue
+            j = rng.integers(len(buffer))
+            yield buffer[j]
+            buffer[j] = item
+        rng.shuffle(buffer)
+        yield from buffer
+
+
 def collate_fn(batch):
+    if isinstance(batch, tuple):
+        # Schon per __getitems__ gebaut (MimicMemmapDataset), die Samples kämen als Liste
+        return batch
     tokens_list, labels_list = zip(*batch)
-    tokens_padded = pad_sequence(tokens_list, batch_first=True, padding_value=0)
+    # Memmap-Dataset liefert int16/int32 Views -> erst nach dem Padding nach long
+    tokens_padded = pad_sequence(tokens_list, batch_first=True, padding_value=0).long()
     labels = torch.stack(labels_list)
     return tokens_padded, labels
 
+
+def collate_packed(batch, seq_len):
+    """
+    Sequence Packing: mehrere Chunks pro Zeile der Länge seq_len (First-Fit-Decreasing).
+    segment_ids: 1..k pro Zeile für die Chunks, 0 für den Rest. Die Labels sind pro Segment
+    in Zeilen-Reihenfolge (Zeile 0 Segment 1, 2, ..., dann Zeile 1, ...), wie die Logits
+    des Modells.
+    """
+    tokens_list, labels_list = zip(*batch)
+    rows = pack_rows([len(t) for t in tokens_list], seq_len)
+    tokens = torch.zeros(len(rows), seq_len, dtype=torch.long)
+    segment_ids = torch.zeros(len(rows), seq_len, dtype=torch.long)
+    order = []
+    for r, row in enumerate(rows):
+        pos = 0
+        for s, i in enumerate(row, start=1):
+            n = len(tokens_list[i])
+            tokens[r, pos:pos + n] = tokens_list[i]
+            segment_ids[r, pos:pos + n] = s
+            pos += n
+            order.append(i)
+    labels = torch.stack([labels_list[i] for i in order])
+    return tokens, segment_ids, labels
+
+
 class MimicDataModule(pl.LightningDataModule):
     def __init__(self, cfg, cache_path=None):
         super().__init__()
@@ -43,35 +506,159 @@ class MimicDataModule(pl.LightningDataModule):
             
         self.train_df = None
         self.val_df = None
+        self.vocab_hash = None
+        # Token-Store Modus: statt DataFrames nur Chunk-Indizes in den Store
+        self.store_dir = None
+        # Streaming Modus: nichts laden, die Datasets lesen Row-Groups selbst
+        self.streaming = False
+        self.train_idx = None
+        self.val_idx = None
+        # Distillation: Teacher-Logits pro Zeile des Train-Splits (src/models/distillation.py)
+        self.teacher_logits = None
 
     def setup(self, stage=None):
+        if self.train_df is not None or self.store_dir is not None or self.streaming:
+            # Schon geladen (Distillation ruft setup() vor trainer.fit auf)
+            return
         if not self.data_path.exists():
-            raise FileNotFoundError(f"❌ Datei fehlt: {self.data_path}")
+            # Parallel-Preprocessing schreibt ein Hive-partitioniertes Dataset (mimic_sequences/bucket=k/...)
+            dataset_dir = self.data_path.with_suffix("")
+            if not dataset_dir.is_dir():
+                raise FileNotFoundError(f"❌ Datei fehlt: {self.data_path}")
+            self.data_path = dataset_dir
+
+        # Billiger Check über den Parquet-Footer: Modell (cfg.data.vocab_hash) und Daten
+        # müssen dasselbe Vokabular haben, sonst bedeuten die Token-IDs etwas anderes
+        self.vocab_hash = parquet_vocab_hash(self.data_path)
+        check_vocab_hash(self.cfg.data.get("vocab_hash"), self.vocab_hash, str(self.data_path))
+
+        if self.cfg.data.get("streaming", False):
+            if self.cfg.data.get("fold") is not None:
+                raise ValueError("❌ data.fold (stratifizierte Folds) braucht den Split-Index, nicht data.streaming")
+            self.streaming = True
+            print(f"🌊 Streaming aus {self.data_path}: {len(parquet_row_groups(self.data_path))} Row-Groups, Hash-Split auf subject_id")
+            return
+
+        # Patient-Level Split (Hash auf subject_id, persistiert neben dem Parquet)
+        # Zeilen-Indizes in der Reihenfolge (subject_id, chunk_id), gilt für Parquet und Token-Store
+        index = load_split_index(self.data_path, self.cfg.seed, n_folds=self.cfg.data.get("n_folds", N_FOLDS))
+        fold = self.cfg.data.get("fold")
+        train_rows, val_rows = split_rows(index, fold)
+        split_name = f"Fold {fold} von {self.cfg.data.get('n_folds', N_FOLDS)}" if fold is not None else "Hash-Split"
+        print(f"✂️  Patient-Level Split aus Index ({split_name})")
+
+        store_dir = self.data_path.parent / TOKEN_STORE_DIR
+        if self.cfg.data.get("use_token_store", True) and store_dir.exists():
+            store = TokenStore(store_dir)
+            if store.vocab_hash == self.vocab_hash and len(store) == len(train_rows) + len(val_rows):
+                print(f"📥 Nutze Token-Store (memmap): {store.store_dir}")
+                self.store_dir = store.store_dir
+                self.train_idx, self.val_idx = train_rows, val_rows
+                self.report_split(len(self.train_idx), len(self.val_idx))
+                return
+            print(f"⚠️ Token-Store passt nicht zu {self.data_path}. Lade Parquet.")
 
         print(f"📥 Lade Parquet: {self.data_path}")
-        full_df = pd.read_parquet(self.data_path, columns=['subject_id', 'token_ids', 'label', 'chunk_id'])
-        
-        # Patient-Level Split
-        all_subjects = full_df['subject_id'].unique()
-        print(f"📊 Gefunden: {len(full_df)} Chunks von {len(all_subjects)} Patienten.")
-        
-        np.random.seed(self.cfg.seed)
-        np.random.shuffle(all_subjects)
-        
-        split_idx = int(len(all_subjects) * 0.8)
-        train_subjects = set(all_subjects[:split_idx])
-        val_subjects = set(all_subjects[split_idx:])
-        
-        print("✂️  Führe Patient-Level Split durch...")
-        self.train_df = full_df[full_df['subject_id'].isin(train_subjects)].copy()
-        self.val_df = full_df[full_df['subject_id'].isin(val_subjects)].copy()
-        
-        print(f"   ✅ Train: {len(self.train_df)} Chunks")
-        print(f"   ✅ Val:   {len(self.val_df)} Chunks")
+        columns = ['subject_id', 'token_ids', 'label', 'chunk_id']
+        # Ältere Outputs haben noch keine time_deltas
+        if 'time_deltas' in pq.ParquetDataset(self.data_path).schema.names:
+            columns.append('time_deltas')
+        # Nur die Zeilen der beiden Splits, Row-Group für Row-Group (keine Kopie der ganzen Tabelle)
+        train_table, val_table = read_rows(self.data_path, columns, [train_rows, val_rows])
+        self.train_df = train_table.to_pandas()
+        self.val_df = val_table.to_pandas()
+        self.report_split(len(self.train_df), len(self.val_df))
+
+    def report_split(self, n_train, n_val):
+        print(f"   ✅ Train: {n_train} Chunks")
+        print(f"   ✅ Val:   {n_val} Chunks")
+
+    @property
+    def hierarchical(self):
+        return self.cfg.model.get("name") == "hierarchical"
+
+    def subject_ids(self, split):
+        # subject_id pro Zeile des Splits, gleiche Reihenfolge wie make_dataset
+        if self.store_dir is not None:
+            return TokenStore(self.store_dir).subject_id[self.train_idx if split == "train" else self.val_idx]
+        df = self.train_df if split == "train" else self.val_df
+        return df['subject_id'].to_numpy()
+
+    def patient_dataloader(self, split, hours_before_end=None):
+        # Hierarchisches Modell: ein Batch = model.patients_per_batch Patienten mit allen Chunks
+        if self.streaming:
+            raise ValueError("❌ model=hierarchical braucht alle Chunks eines Patienten, nicht data.streaming")
+        # Alle Chunks, das Zeitfenster schneidet MimicPatientDataset über die ganze Historie
+        chunks = self.make_dataset(split, keep_deltas=hours_before_end is not None)
+        if isinstance(chunks, MimicMemmapDataset):
+            chunks.batched = False
+        dataset = MimicPatientDataset(chunks, self.subject_ids(split), self.cfg.model.get("max_chunks"), hours_before_end)
+        return DataLoader(
+            dataset,
+            batch_size=self.cfg.model.get("patients_per_batch", 16),
+            shuffle=split == "train",
+            collate_fn=collate_patients,
+            num_workers=4,
+            persistent_workers=True,
+            pin_memory=True
+        )
+
+    def make_dataset(self, split, hours_before_end=None, keep_deltas=False, max_len=None):
+        # max_len: Kürzung pro Chunk, z.B. die seq_len des Teachers bei der Distillation
+        max_len = max_len or self.cfg.data.seq_len
+        if self.streaming:
+            return MimicStreamingDataset(
+                self.data_path, split, seed=self.cfg.seed, max_len=max_len,
+                hours_before_end=hours_before_end, shuffle=split == "train",
+                shuffle_buffer=self.cfg.data.get("shuffle_buffer", 10_000),
+            )
+        if self.store_dir is not None:
+            indices = self.train_idx if split == "train" else self.val_idx
+            return MimicMemmapDataset(self.store_dir, indices, max_len, hours_before_end, pin_memory=True,
+                                      keep_deltas=keep_deltas)
+        df = self.train_df if split == "train" else self.val_df
+        return MimicTokenDataset(df, max_len, hours_before_end, keep_deltas)
 
     def train_dataloader(self):
+        if self.hierarchical:
+            return self.patient_dataloader("train", self.cfg.data.get("hours_before_end"))
+        dataset = self.make_dataset("train", self.cfg.data.get("hours_before_end"))
+        max_tokens = self.cfg.data.get("max_tokens")
+        if self.teacher_logits is not None:
+            return self.distill_dataloader(dataset, max_tokens)
+        if self.streaming:
+            # Sampler brauchen die Längen aller Chunks vorab -> im Streaming nicht verfügbar
+            if self.cfg.data.get("packing", False) or self.cfg.data.get("length_bucketing", False) or max_tokens:
+                raise ValueError("❌ data.streaming geht nicht mit packing/length_bucketing/max_tokens")
+            return DataLoader(
+                dataset,
+                batch_size=self.cfg.data.batch_size,
+                collate_fn=collate_fn,
+                num_workers=4,
+                persistent_workers=True,
+                pin_memory=True
+            )
+        if self.cfg.data.get("packing", False):
+            return self.packed_dataloader(dataset, max_tokens)
+        if self.cfg.data.get("length_bucketing", False) or max_tokens:
+            # Ähnlich lange Chunks pro Batch -> kaum <PAD>. Mit max_tokens: Token-Budget statt fester Batch-Größe
+            sampler = LengthBucketBatchSampler(
+                dataset.lengths,
+                batch_size=None if max_tokens else self.cfg.data.batch_size,
+                max_tokens=max_tokens,
+                seed=self.cfg.seed,
+            )
+            self.report_padding(dataset.lengths, sampler)
+            return DataLoader(
+                dataset,
+                batch_sampler=sampler,
+                collate_fn=collate_fn,
+                num_workers=4,
+                persistent_workers=True,
+                pin_memory=True
+            )
         return DataLoader(
-            MimicTokenDataset(self.train_df, self.cfg.data.seq_len),
+            dataset,
             batch_size=self.cfg.data.batch_size,
             shuffle=True, 
             collate_fn=collate_fn,
@@ -80,9 +667,69 @@ class MimicDataModule(pl.LightningDataModule):
             pin_memory=True
         )
 
-    def val_dataloader(self):
+    def distill_dataloader(self, dataset, max_tokens=None):
+        # Batches (tokens, teacher_logits, labels) für BaseDiseasePredictor.training_step
+        if self.streaming or self.cfg.data.get("packing", False):
+            raise ValueError("❌ Distillation braucht Zeilen-Indizes, nicht data.streaming/packing")
+        if isinstance(dataset, MimicMemmapDataset):
+            dataset.batched = False
+        dataset = TeacherLogitsDataset(dataset, self.teacher_logits)
+        if self.cfg.data.get("length_bucketing", False) or max_tokens:
+            sampler = LengthBucketBatchSampler(
+                dataset.lengths,
+                batch_size=None if max_tokens else self.cfg.data.batch_size,
+                max_tokens=max_tokens,
+                seed=self.cfg.seed,
+            )
+            loader_args = {"batch_sampler": sampler}
+        else:
+            loader_args = {"batch_size": self.cfg.data.batch_size, "shuffle": True}
+        return DataLoader(
+            dataset,
+            collate_fn=collate_distill,
+            num_workers=4,
+            persistent_workers=True,
+            pin_memory=True,
+            **loader_args
+        )
+
+    def packed_dataloader(self, dataset, max_tokens=None):
+        # Batches liefern (tokens, segment_ids, labels) -> nur das Transformer-Modell versteht das
+        if self.cfg.model.get("name") != "transformer_encoder":
+            raise ValueError("❌ data.packing braucht model=transformer (segment-weise Attention)")
+        seq_len = self.cfg.data.seq_len
+        # collate_packed braucht die einzelnen Samples, keinen gepaddeten Batch
+        dataset.batched = False
+        sampler = PackedBatchSampler(dataset.lengths, max_tokens or self.cfg.data.batch_size * seq_len, seed=self.cfg.seed)
+        baseline = padding_ratio(dataset.lengths, random_batches(len(dataset.lengths), self.cfg.data.batch_size, self.cfg.seed))
+        packed = sampler.padding_ratio(row_len=seq_len)
+        print(f"📦 Sequence Packing: Padding-Anteil {packed:.1%} statt {baseline:.1%} (zufällige Batches) | {len(sampler)} Batches")
+        if self.trainer is not None and self.trainer.logger is not None:
+            self.trainer.logger.log_metrics({"train_padding_ratio": packed, "train_padding_ratio_uniform": baseline})
+        return DataLoader(
+            dataset,
+            batch_sampler=sampler,
+            collate_fn=partial(collate_packed, seq_len=seq_len),
+            num_workers=4,
+            persistent_workers=True,
+            pin_memory=True
+        )
+
+    def report_padding(self, lengths, sampler):
+        baseline = padding_ratio(lengths, random_batches(len(lengths), self.cfg.data.batch_size, self.cfg.seed))
+        bucketed = sampler.padding_ratio()
+        print(f"📏 Padding-Anteil: {bucketed:.1%} (Length-Bucketing) statt {baseline:.1%} (zufällige Batches)"
+              f" | {len(sampler)} Batches, Ø {len(lengths) / max(len(sampler), 1):.0f} Chunks")
+        if self.trainer is not None and self.trainer.logger is not None:
+            self.trainer.logger.log_metrics({"train_padding_ratio": bucketed, "train_padding_ratio_uniform": baseline})
+
+    def val_dataloader(self, hours_before_end=None, max_len=None):
+        if hours_before_end is None:
+            hours_before_end = self.cfg.data.get("hours_before_end")
+        if self.hierarchical:
+            return self.patient_dataloader("val", hours_before_end)
         return DataLoader(
-            MimicTokenDataset(self.val_df, self.cfg.data.seq_len),
+            self.make_dataset("val", hours_before_end, max_len=max_len),
             batch_size=self.cfg.data.batch_size,
             shuffle=False, 
             collate_fn=collate_fn,
@@ -1,255 +1,989 @@
 import duckdb
 import pandas as pd
-import json
 import os
 import shutil
 import sys
+import time
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+# Damit 'src' auch beim direkten Aufruf als Skript gefunden wird
+root_path = Path(__file__).resolve().parent.parent.parent
+sys.path.append(str(root_path))
+
+from src.data.staging import RAW_TABLES, sql_path, stage_raw_tables, table_source
+from src.data.stage_runner import ProfiledConnection, StageRunner, checkpoint_matches
+from src.data.token_store import TOKEN_STORE_DIR, export_token_store
+from src.data.value_bins import (BIN_EDGES_FILE, VALUE_TOKEN_PREFIX, compute_bin_edges, create_bin_view,
+                                  read_bin_count, value_id_sql, value_tokens)
+from src.data.vocab import VOCAB_FILE, VOCAB_HASH_KEY, load_vocab, read_vocab_meta, save_vocab, vocab_hash
+
 # --- KONFIGURATION ---
-MIMIC_PATH = Path("../data/mimic-iv-3.1") 
-OUTPUT_PATH = Path("../ML_DATA/processed") 
-TEMP_DIR = Path("../ML_DATA/duckdb_temp") 
+MIMIC_PATH = Path("../data/mimic-iv-3.1")
+OUTPUT_PATH = Path("../ML_DATA/processed")
+TEMP_DIR = Path("../ML_DATA/duckdb_temp")
+STAGING_DIR = Path("../ML_DATA/staged")
 
-CHUNK_SIZE = 512 
-MIN_FREQ = 5 
+CHUNK_SIZE = 512
+MIN_FREQ = 5
 
-def run_pipeline():
-    print(f"🦆 Starte DuckDB Pipeline (Type-Safe & Debugged)...")
-    
-    # Pfade absolut machen (WICHTIG für Windows)
-    abs_mimic = MIMIC_PATH.resolve()
-    abs_output = OUTPUT_PATH.resolve()
-    abs_temp = TEMP_DIR.resolve()
-    
-    print(f"   📂 Rohdaten: {abs_mimic}")
-    print(f"   💾 Output:   {abs_output}")
-    print(f"   ⚙️ Temp:     {abs_temp}")
+SEQUENCES_FILE = "mimic_sequences.parquet"
+# time_deltas: Minuten seit dem vorherigen Token (INT32, parallel zu token_ids). Das erste Token
+# eines Chunks bezieht sich auf das letzte des vorherigen Chunks -> cumsum über alle Chunks
+# eines Patienten = Minuten seit dem ersten Event.
+SEQUENCE_COLUMNS = "subject_id, chunk_id, label, token_ids, time_deltas"
+# Kleine Row-Groups (max. CHUNK_SIZE Token pro Zeile -> wenige MB): Einheit für das
+# Streaming-Dataset, das Row-Groups auf DataLoader-Worker verteilt
+SEQUENCE_ROW_GROUP_SIZE = 4096
+# Parallel-Modus: Hive-partitioniertes Dataset (bucket=k/data_0.parquet) statt einer Datei
+SEQUENCES_DIR = "mimic_sequences"
+# Fingerprint pro Patient -> erkennt im Incremental-Modus neue/geänderte subject_ids
+FINGERPRINT_FILE = "subject_fingerprints.parquet"
+# Laufzeit, Zeilen, Peak-RAM und Spill pro Stage
+REPORT_FILE = "pipeline_report.json"
 
-    abs_output.mkdir(parents=True, exist_ok=True)
-    if abs_temp.exists(): shutil.rmtree(abs_temp)
-    abs_temp.mkdir(parents=True, exist_ok=True)
+# Zeitabstand (Minuten, strikt größer) -> Time-Token. Reihenfolge = Priorität im CASE.
+TIME_BUCKETS = [
+    (525600, "TIME_GT_12M"),
+    (262800, "TIME_GT_6M"),
+    (43200, "TIME_GT_1M"),
+    (20160, "TIME_GT_14D"),
+    (7200, "TIME_GT_5D"),
+    (2880, "TIME_GT_2D"),
+    (1440, "TIME_GT_24H"),
+    (720, "TIME_GT_12H"),
+    (480, "TIME_GT_8H"),
+    (240, "TIME_GT_4H"),
+    (120, "TIME_GT_2H"),
+    (30, "TIME_GT_30MIN"),
+    (1, "TIME_GT_1MIN"),
+]
+
+SPECIAL_TOKENS = ["<PAD>", "<UNK>", "<CLS>", "<SEP>"]
+# Struktur-Tokens bekommen feste IDs direkt hinter den Special Tokens, unabhängig davon,
+# ob sie in den Daten vorkommen -> Vokabular ist deterministisch und für beide Pfade gleich.
+STRUCTURE_TOKENS = ["ADM_START", "ADM_END"] + [token for _, token in reversed(TIME_BUCKETS)]
 
-    db_file = abs_output / "mimic_temp.db"
-    if db_file.exists(): os.remove(db_file)
 
-    con = duckdb.connect(str(db_file))
-    
+def events_sql(value_bins=0):
+    """
+    Alle Events eines Patienten. priority sortiert Events mit identischem Zeitstempel.
+    value_bin: Quantil-Bin des Laborwerts (nur mit value_bins > 0, sonst NULL). Das
+    Value-Token wird beim Mapping direkt hinter sein Labor-Token gesetzt.
+    """
+    if value_bins:
+        # Range-Join auf die kleine Bin-Tabelle (Hash auf itemid + Bereichsfilter, vektorisiert)
+        labs = """
+            SELECT l.subject_id, l.charttime as t, 1 as priority, 'LAB_' || l.itemid || '_' || COALESCE(l.flag, 'normal') as token, b.bin as value_bin
+            FROM raw_labs l
+            LEFT JOIN lab_bins b ON l.itemid = b.itemid AND l.valuenum >= b.lo AND l.valuenum < b.hi"""
+    else:
+        labs = "SELECT subject_id, charttime as t, 1 as priority, 'LAB_' || itemid || '_' || COALESCE(flag, 'normal') as token, NULL as value_bin FROM raw_labs"
+    return f"""
+        SELECT subject_id, admittime as t, 0 as priority, 'ADM_START' as token, CAST(NULL AS INTEGER) as value_bin FROM raw_admissions
+        UNION ALL
+        {labs}
+        UNION ALL
+        SELECT subject_id, starttime as t, 1 as priority, 'MED_' || drug as token, NULL as value_bin FROM raw_meds WHERE drug IS NOT NULL
+        UNION ALL
+        SELECT d.subject_id, a.dischtime as t, 2 as priority, 'DIAG_' || icd_code as token, NULL as value_bin FROM raw_diagnoses d JOIN raw_admissions a ON d.hadm_id = a.hadm_id
+        UNION ALL
+        SELECT subject_id, dischtime as t, 3 as priority, 'ADM_END' as token, NULL as value_bin FROM raw_admissions
+    """
+
+
+def raw_sources(abs_mimic, use_staging=True):
+    """
+    SQL-Quelle je Rohtabelle. Mit Staging wird der Parquet-Cache (falls nötig) erst
+    aktualisiert, sonst lesen wir wie früher direkt die CSV.gz.
+    """
+    if use_staging:
+        stage_raw_tables(abs_mimic, STAGING_DIR.resolve())
+        return {name: table_source(name, abs_mimic, STAGING_DIR.resolve()) for name in RAW_TABLES}
+    return {name: f"read_csv('{sql_path(abs_mimic / spec['file'])}', AUTO_DETECT=TRUE)" for name, spec in RAW_TABLES.items()}
+
+
+def open_connection(db_file, temp_dir, memory_limit="8GB", threads=4):
+    con = duckdb.connect(str(db_file) if db_file else ":memory:")
+
     # RAM & Temp Config
-    con.execute("SET memory_limit='8GB'") 
+    con.execute(f"SET memory_limit='{memory_limit}'")
     # Temp Verzeichnis muss absolut sein und Slashes haben
-    temp_sql_path = str(abs_temp).replace("\\", "/")
-    con.execute(f"SET temp_directory='{temp_sql_path}'")
-    con.execute("SET threads=4")
+    con.execute(f"SET temp_directory='{sql_path(temp_dir)}'")
+    con.execute(f"SET threads={threads}")
     con.execute("SET preserve_insertion_order=false")
+    return con
 
-    # ---------------------------------------------------------
-    # 1. VIEWS (Mit Typ-Casting!)
-    # ---------------------------------------------------------
-    print("   ... 1/7 Lade Tabellen (mit Type-Safety)")
-    
-    # Helper um Pfade sicher zu machen
-    def safe_path(subpath):
-        return str(abs_mimic / subpath).replace("\\", "/")
+
+def create_raw_views(con, sources, subject_filter=None, bucket=None):
+    """
+    Legt die raw_* Views an. Mit subject_filter (Name einer Tabelle mit Spalte
+    subject_id) werden nur diese Patienten gelesen (Incremental-Modus), mit
+    bucket=(lo, hi) nur der subject_id-Bereich [lo, hi) (Parallel-Modus, None = offen).
+    Die gestagten Parquets sind nach subject_id sortiert -> der Bereichsfilter wird über
+    die Row-Group Statistiken gepruned, jeder Worker liest nur seinen Teil der Tabellen.
+    """
+    where = ""
+    if subject_filter:
+        where = f"WHERE CAST(subject_id AS BIGINT) IN (SELECT subject_id FROM {subject_filter})"
+    elif bucket:
+        bounds = [f"CAST(subject_id AS BIGINT) >= {bucket[0]}" if bucket[0] is not None else None,
+                  f"CAST(subject_id AS BIGINT) < {bucket[1]}" if bucket[1] is not None else None]
+        where = "WHERE " + " AND ".join(b for b in bounds if b) if any(bounds) else ""
 
     # WICHTIG: Wir lesen alles, casten aber subject_id sofort zu BIGINT
-    con.execute(f"CREATE OR REPLACE VIEW raw_diagnoses AS SELECT CAST(subject_id AS BIGINT) as subject_id, hadm_id, icd_code FROM read_csv('{safe_path('hosp/diagnoses_icd.csv.gz')}', AUTO_DETECT=TRUE)")
-    con.execute(f"CREATE OR REPLACE VIEW raw_labs AS SELECT CAST(subject_id AS BIGINT) as subject_id, itemid, flag, charttime FROM read_csv('{safe_path('hosp/labevents.csv.gz')}', AUTO_DETECT=TRUE)")
-    con.execute(f"CREATE OR REPLACE VIEW raw_meds AS SELECT CAST(subject_id AS BIGINT) as subject_id, drug, starttime FROM read_csv('{safe_path('hosp/prescriptions.csv.gz')}', AUTO_DETECT=TRUE)")
-    con.execute(f"CREATE OR REPLACE VIEW raw_admissions AS SELECT CAST(subject_id AS BIGINT) as subject_id, hadm_id, admittime, dischtime, hospital_expire_flag FROM read_csv('{safe_path('hosp/admissions.csv.gz')}', AUTO_DETECT=TRUE)")
+    con.execute(f"CREATE OR REPLACE VIEW raw_diagnoses AS SELECT CAST(subject_id AS BIGINT) as subject_id, hadm_id, icd_code FROM {sources['diagnoses_icd']} {where}")
+    con.execute(f"CREATE OR REPLACE VIEW raw_labs AS SELECT CAST(subject_id AS BIGINT) as subject_id, itemid, flag, charttime, valuenum FROM {sources['labevents']} {where}")
+    con.execute(f"CREATE OR REPLACE VIEW raw_meds AS SELECT CAST(subject_id AS BIGINT) as subject_id, drug, starttime FROM {sources['prescriptions']} {where}")
+    con.execute(f"CREATE OR REPLACE VIEW raw_admissions AS SELECT CAST(subject_id AS BIGINT) as subject_id, hadm_id, admittime, dischtime, hospital_expire_flag FROM {sources['admissions']} {where}")
 
-    # ---------------------------------------------------------
-    # 2. UNION
-    # ---------------------------------------------------------
-    print("   ... 2/7 Vereinige Events (Union)")
-    con.execute("""
-        CREATE OR REPLACE TABLE all_events_base AS
-        SELECT subject_id, admittime as t, 0 as priority, 'ADM_START' as token FROM raw_admissions
-        UNION ALL
-        SELECT subject_id, charttime as t, 1 as priority, 'LAB_' || itemid || '_' || COALESCE(flag, 'normal') as token FROM raw_labs
-        UNION ALL
-        SELECT subject_id, starttime as t, 1 as priority, 'MED_' || drug as token FROM raw_meds WHERE drug IS NOT NULL
-        UNION ALL
-        SELECT d.subject_id, a.dischtime as t, 2 as priority, 'DIAG_' || icd_code as token FROM raw_diagnoses d JOIN raw_admissions a ON d.hadm_id = a.hadm_id
-        UNION ALL
-        SELECT subject_id, dischtime as t, 3 as priority, 'ADM_END' as token FROM raw_admissions
+
+def compute_fingerprints(con, value_bins=0):
+    """
+    Ein Hash pro Patient über alle Rohzeilen, die in seine Sequenz einfließen.
+    SUM statt XOR, damit sich doppelte Zeilen nicht gegenseitig aufheben.
+    """
+    # valuenum fließt nur mit Value-Tokens in die Sequenz ein
+    lab_columns = "itemid, flag, charttime, valuenum" if value_bins else "itemid, flag, charttime"
+    con.execute(f"""
+        CREATE OR REPLACE TABLE subject_fingerprints AS
+        WITH parts AS (
+            SELECT subject_id, 'adm' as src, count(*) as n, SUM(hash(hadm_id, admittime, dischtime, hospital_expire_flag)) as h FROM raw_admissions GROUP BY subject_id
+            UNION ALL
+            SELECT subject_id, 'lab' as src, count(*) as n, SUM(hash({lab_columns})) as h FROM raw_labs GROUP BY subject_id
+            UNION ALL
+            SELECT subject_id, 'med' as src, count(*) as n, SUM(hash(drug, starttime)) as h FROM raw_meds GROUP BY subject_id
+            UNION ALL
+            SELECT subject_id, 'diag' as src, count(*) as n, SUM(hash(hadm_id, icd_code)) as h FROM raw_diagnoses GROUP BY subject_id
+        )
+        SELECT subject_id, hash(LIST(struct_pack(src := src, n := n, h := h) ORDER BY src)) as fingerprint
+        FROM parts
+        GROUP BY subject_id
     """)
-    
+
+
+def time_token_sql(diff_expr, vocab=None):
+    """
+    CASE-Ausdruck Zeitabstand -> Time-Token. Mit vocab direkt als Token-ID
+    (fused Pfad), sonst als Token-String (staged Pfad).
+    """
+    whens = []
+    for threshold, token in TIME_BUCKETS:
+        value = vocab.get(token, 1) if vocab is not None else f"'{token}'"
+        whens.append(f"WHEN {diff_expr} > {threshold} THEN {value}")
+    return "CASE " + " ".join(whens) + " ELSE NULL END"
+
+
+def count_tokens(con, source):
+    # Frequenzen der Inhalts-Tokens von `source` (Tabelle/View mit Spalte token)
+    return con.execute(f"""
+        SELECT token, count(*) as freq FROM {source}
+        WHERE token NOT LIKE 'TIME_%' AND token NOT LIKE 'ADM_%'
+        GROUP BY token
+    """).df()
+
+
+def build_vocab(con, source, value_bins=0):
+    return vocab_from_counts(con, count_tokens(con, source), value_bins)
+
+
+def vocab_from_counts(con, counts_df, value_bins=0):
+    """
+    Vokabular aus (ggf. über mehrere Buckets zusammengeführten) Token-Frequenzen.
+    Gleichstand bei der Frequenz wird über den Token-String aufgelöst.
+    Value-Tokens (VAL_Q1..n) bekommen wie die Struktur-Tokens feste IDs.
+    """
+    con.register("token_counts", counts_df)
+    vocab_df = con.execute(f"""
+        SELECT token, SUM(freq) as freq FROM token_counts
+        GROUP BY token HAVING SUM(freq) >= {MIN_FREQ}
+        ORDER BY freq DESC, token ASC
+    """).df()
+    con.unregister("token_counts")
+
+    vocab = {}
+    for t in SPECIAL_TOKENS + STRUCTURE_TOKENS + value_tokens(value_bins):
+        vocab[t] = len(vocab)
+    for t in vocab_df['token'].tolist():
+        if t not in vocab: vocab[t] = len(vocab)
+    return vocab
+
+
+def stage_union(con, value_bins=0):
+    print("   ... 2/7 Vereinige Events (Union)")
+    con.execute(f"CREATE OR REPLACE TABLE all_events_base AS {events_sql(value_bins)}")
+
     # DEBUG CHECK
     count = con.execute("SELECT count(*) FROM all_events_base").fetchone()[0]
     print(f"      📊 Events gefunden: {count}")
-    if count == 0:
-        print("❌ FEHLER: Keine Events geladen! Pfade prüfen.")
-        sys.exit(1)
+    return count
 
-    # ---------------------------------------------------------
-    # 3. TIME DELTAS
-    # ---------------------------------------------------------
+
+def stage_time_deltas(con):
     print("   ... 3/7 Berechne Zeitabstände")
     con.execute("""
         CREATE OR REPLACE TABLE events_with_lag AS
         SELECT *, date_diff('minute', LAG(t) OVER (PARTITION BY subject_id ORDER BY t, priority), t) as diff_minutes
         FROM all_events_base
     """)
-    con.execute("DROP TABLE all_events_base")
+    return con.execute("SELECT count(*) FROM events_with_lag").fetchone()[0]
 
-    # ---------------------------------------------------------
-    # 4. TIME TOKENS
-    # ---------------------------------------------------------
+
+def stage_time_tokens(con):
     print("   ... 4/7 Generiere Time-Tokens")
-    con.execute("""
+    con.execute(f"""
         CREATE OR REPLACE TABLE time_tokens AS
-        SELECT subject_id, t, priority, 
-            CASE 
-                WHEN diff_minutes > 525600 THEN 'TIME_GT_12M'
-                WHEN diff_minutes > 262800 THEN 'TIME_GT_6M'
-                WHEN diff_minutes > 43200  THEN 'TIME_GT_1M'
-                WHEN diff_minutes > 20160  THEN 'TIME_GT_14D'
-                WHEN diff_minutes > 7200   THEN 'TIME_GT_5D'
-                WHEN diff_minutes > 2880   THEN 'TIME_GT_2D'
-                WHEN diff_minutes > 1440   THEN 'TIME_GT_24H'
-                WHEN diff_minutes > 720    THEN 'TIME_GT_12H'
-                WHEN diff_minutes > 480    THEN 'TIME_GT_8H'
-                WHEN diff_minutes > 240    THEN 'TIME_GT_4H'
-                WHEN diff_minutes > 120    THEN 'TIME_GT_2H'
-                WHEN diff_minutes > 30     THEN 'TIME_GT_30MIN'
-                WHEN diff_minutes > 1      THEN 'TIME_GT_1MIN'
-                ELSE NULL
-            END as token
+        SELECT subject_id, t, priority, {time_token_sql('diff_minutes')} as token
         FROM events_with_lag WHERE diff_minutes > 1
     """)
 
     con.execute("""
         CREATE OR REPLACE TABLE final_stream AS
-        SELECT subject_id, t, priority, 1 as sub_priority, token FROM events_with_lag
+        SELECT subject_id, t, priority, 1 as sub_priority, token, value_bin FROM events_with_lag
         UNION ALL
-        SELECT subject_id, t, priority, 0 as sub_priority, token FROM time_tokens WHERE token IS NOT NULL
+        SELECT subject_id, t, priority, 0 as sub_priority, token, NULL as value_bin FROM time_tokens WHERE token IS NOT NULL
     """)
-    
-    con.execute("DROP TABLE events_with_lag")
-    con.execute("DROP TABLE time_tokens")
+    return con.execute("SELECT count(*) FROM final_stream").fetchone()[0]
 
-    # ---------------------------------------------------------
-    # 5. VOKABULAR
-    # ---------------------------------------------------------
-    print("   ... 5/7 Erstelle Vokabular")
-    vocab_df = con.execute(f"""
-        SELECT token, count(*) as freq FROM final_stream 
-        WHERE token NOT LIKE 'TIME_%' AND token NOT LIKE 'ADM_%'
-        GROUP BY token HAVING count(*) >= {MIN_FREQ}
-        ORDER BY freq DESC
-    """).df()
-    special_df = con.execute("SELECT DISTINCT token FROM final_stream WHERE token LIKE 'TIME_%' OR token LIKE 'ADM_%'").df()
-    
-    vocab = {"<PAD>": 0, "<UNK>": 1, "<CLS>": 2, "<SEP>": 3}
-    for t in special_df['token'].tolist():
-        if t not in vocab: vocab[t] = len(vocab)
-    for t in vocab_df['token'].tolist():
-        if t not in vocab: vocab[t] = len(vocab)
-        
-    with open(abs_output / "vocab.json", "w") as f:
-        json.dump(vocab, f)
-    print(f"      ✅ Vokabular Größe: {len(vocab)} Token")
-
-    # ---------------------------------------------------------
-    # 6. MAPPING & CHUNKING
-    # ---------------------------------------------------------
-    print("   ... 6/7 Berechne Chunks")
-    
-    con.execute("CREATE OR REPLACE TABLE vocab_map (token VARCHAR, id INTEGER)")
-    con.executemany("INSERT INTO vocab_map VALUES (?, ?)", [(k, v) for k, v in vocab.items()])
 
+def stage_chunks(con, vocab=None, value_bins=0):
+    """
+    Stage 6 (Debug-Pfad): Mapping auf IDs + Chunk-Zuordnung. Ergebnis: stream_integers.
+    Ein Event mit Value-Token belegt zwei Positionen (Labor-Token, direkt danach Value-Token).
+    """
+    # token (+ value_bin) als letzte Sortierschlüssel machen die Reihenfolge bei Gleichstand deterministisch
     con.execute(f"""
         CREATE OR REPLACE TABLE stream_integers AS
-        WITH ranked_events AS (
-            SELECT 
-                s.subject_id, 
-                s.t, 
-                s.priority, 
+        WITH mapped AS (
+            SELECT
+                s.subject_id,
+                s.t,
+                s.priority,
                 s.sub_priority,
+                s.token,
+                s.value_bin,
                 COALESCE(v.id, 1) as token_id,
-                ROW_NUMBER() OVER (PARTITION BY s.subject_id ORDER BY s.t ASC, s.priority ASC, s.sub_priority ASC) as rn
+                {value_id_sql('s.value_bin', vocab or {}, value_bins)} as value_id
             FROM final_stream s
             LEFT JOIN vocab_map v ON s.token = v.token
+        ),
+        ranked_events AS (
+            SELECT
+                subject_id,
+                t,
+                token_id,
+                value_id,
+                SUM(CASE WHEN value_id IS NULL THEN 1 ELSE 2 END) OVER (w ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) as pos_end,
+                CAST(COALESCE(date_diff('minute', LAG(t) OVER w, t), 0) AS INTEGER) as time_delta
+            FROM mapped
+            WINDOW w AS (PARTITION BY subject_id ORDER BY t ASC, priority ASC, sub_priority ASC, token ASC, value_bin ASC)
+        ),
+        positioned AS (
+            SELECT subject_id, t, pos_end - CAST(value_id IS NOT NULL AS INTEGER) as rn, token_id, time_delta FROM ranked_events
+            UNION ALL
+            SELECT subject_id, t, pos_end as rn, value_id as token_id, 0 as time_delta FROM ranked_events WHERE value_id IS NOT NULL
         )
-        SELECT 
-            subject_id, 
-            t, 
+        SELECT
+            subject_id,
+            t,
+            rn,
             token_id,
+            time_delta,
             CAST(FLOOR((rn - 1) / {CHUNK_SIZE}) AS INTEGER) as chunk_id
-        FROM ranked_events
+        FROM positioned
     """)
 
     # Check ob stream_integers leer ist
     count = con.execute("SELECT count(*) FROM stream_integers").fetchone()[0]
     print(f"      📊 Events nach Mapping: {count}")
-    
+    return count
+
+
+# Inputs, die nach der jeweiligen Stage nicht mehr gebraucht werden. Werden erst NACH dem
+# Checkpoint-Marker gelöscht, damit ein Resume die Stage notfalls wiederholen kann.
+STAGE_DROPS = {
+    "time_deltas": ["DROP TABLE IF EXISTS all_events_base"],
+    "time_tokens": ["DROP TABLE IF EXISTS events_with_lag", "DROP TABLE IF EXISTS time_tokens"],
+    "chunks": ["DROP TABLE IF EXISTS final_stream", "DROP TABLE IF EXISTS vocab_map", "CHECKPOINT"],
+    # fused Pfad
+    "streams": ["DROP TABLE IF EXISTS vocab_map"],
+    "export": ["DROP TABLE IF EXISTS subject_streams", "CHECKPOINT"],
+}
+
+
+def run_staged_stages(con, value_bins=0):
+    """
+    Stage 2-4 als materialisierte Tabellen (Debug-Pfad). Ergebnis: final_stream.
+    """
+    count = stage_union(con, value_bins)
+    for name, stage in (("time_deltas", stage_time_deltas), ("time_tokens", stage_time_tokens)):
+        stage(con)
+        for sql in STAGE_DROPS[name]:
+            con.execute(sql)
+    return count
+
+
+def run_staged_chunking(con, vocab, value_bins=0):
+    stage_chunks(con, vocab, value_bins)
     print("      🧹 Lösche RAM-Tabellen...")
-    con.execute("DROP TABLE final_stream")
-    con.execute("DROP TABLE vocab_map")
-    con.execute("CHECKPOINT")
+    for sql in STAGE_DROPS["chunks"]:
+        con.execute(sql)
 
-    # ---------------------------------------------------------
-    # 7. AGGREGATION & EXPORT
-    # ---------------------------------------------------------
-    print("   ... 7/7 Aggregiere Chunks & Speichere")
-    
-    parquet_sql_path = str(abs_output / 'mimic_sequences.parquet').replace("\\", "/")
-    print(f"      💾 Zielpfad: {parquet_sql_path}")
-    
-    # SCHRITT A: Labels vorkalkulieren (1 Zeile pro Patient!)
+
+def parquet_columns(path):
+    return [row[0] for row in duckdb.execute(f"DESCRIBE SELECT * FROM read_parquet('{sql_path(path)}')").fetchall()]
+
+
+def create_vocab_map(con, vocab):
+    # Über einen registrierten DataFrame statt executemany (das fügt Zeile für Zeile ein)
+    con.register("vocab_df", pd.DataFrame({"token": list(vocab.keys()), "id": list(vocab.values())}))
+    con.execute("CREATE OR REPLACE TABLE vocab_map AS SELECT CAST(token AS VARCHAR) as token, CAST(id AS INTEGER) as id FROM vocab_df")
+    con.unregister("vocab_df")
+
+
+def create_unique_labels(con):
+    # Labels vorkalkulieren (1 Zeile pro Patient!)
     # Verhindert, dass Events mit JEDER Admission multipliziert werden.
     con.execute("""
         CREATE OR REPLACE TABLE unique_labels AS
-        SELECT 
-            CAST(subject_id AS BIGINT) as subject_id, 
+        SELECT
+            CAST(subject_id AS BIGINT) as subject_id,
             MAX(hospital_expire_flag) as label
         FROM raw_admissions
         GROUP BY subject_id
     """)
-    
-    # SCHRITT B: Der saubere Join
-    # Jetzt joinen wir 89 Mio Events mit (nur) ~40k Patienten-Labels.
-    # Das Ergebnis bleibt bei 89 Mio Zeilen (keine Explosion mehr!).
-    
-    # Zuerst prüfen wir die Anzahl der Chunks (nicht Zeilen!)
-    chunk_count_query = """
-        SELECT count(DISTINCT CAST(s.subject_id AS VARCHAR) || '_' || CAST(s.chunk_id AS VARCHAR))
+
+
+def parquet_options(vocab_hash_value=None):
+    # Vokabular-Hash in den Parquet-Footer -> Konsumenten prüfen ohne die Daten zu lesen
+    options = f"FORMAT PARQUET, ROW_GROUP_SIZE {SEQUENCE_ROW_GROUP_SIZE}"
+    if vocab_hash_value is None:
+        return options
+    return f"{options}, KV_METADATA {{{VOCAB_HASH_KEY}: '{vocab_hash_value}'}}"
+
+
+def export_chunks(con, chunks_sql, parquet_sql_path, vocab_hash_value=None):
+    con.execute(f"""
+        COPY (
+            SELECT {SEQUENCE_COLUMNS} FROM ({chunks_sql})
+            ORDER BY subject_id, chunk_id
+        ) TO '{parquet_sql_path}' ({parquet_options(vocab_hash_value)})
+    """)
+
+
+def staged_chunks_sql():
+    return """
+        SELECT
+            s.subject_id,
+            s.chunk_id,
+            -- Das Label kommt jetzt aus der eindeutigen Tabelle
+            MAX(l.label) as label,
+            -- Liste der Tokens im Chunk (Reihenfolge wie im Stream)
+            LIST(s.token_id ORDER BY s.rn ASC) as token_ids,
+            LIST(s.time_delta ORDER BY s.rn ASC) as time_deltas
         FROM stream_integers s
         JOIN unique_labels l ON s.subject_id = l.subject_id
+        GROUP BY s.subject_id, s.chunk_id
     """
-    final_count = con.execute(chunk_count_query).fetchone()[0]
-    print(f"      📊 Zu schreibende Chunks (Sequenzen): {final_count}")
-
-    if final_count > 0:
-        con.execute(f"""
-            COPY (
-                SELECT 
-                    s.subject_id,
-                    s.chunk_id,
-                    -- Das Label kommt jetzt aus der eindeutigen Tabelle
-                    MAX(l.label) as label,
-                    -- Liste der Tokens im Chunk
-                    LIST(s.token_id ORDER BY s.t ASC) as token_ids
-                FROM stream_integers s
-                JOIN unique_labels l ON s.subject_id = l.subject_id
-                GROUP BY s.subject_id, s.chunk_id
-                ORDER BY s.subject_id, s.chunk_id
-            ) TO '{parquet_sql_path}' (FORMAT PARQUET)
-        """)
-        print("      ✅ Export Befehl erfolgreich gesendet.")
+
+
+def fused_streams_sql(vocab, value_bins=0):
+    """
+    Stage 3, 4 und 6 (Mapping) in einem Pass: pro Patient wird genau einmal sortiert
+    (geordnete LIST-Aggregation statt zwei globaler Window-Sorts über alle Events).
+    Time-Tokens und Vokabular-IDs entstehen direkt auf der sortierten Liste.
+    Ergebnis: eine Zeile pro Patient mit dem kompletten Stream (ids, deltas).
+    """
+    diff = "date_diff('minute', ev[i - 1].t, x.t)"
+    # Value-Token direkt hinter seinem Labor-Token (gleicher Zeitpunkt -> Delta 0)
+    value_ids = " || CASE WHEN x.v IS NULL THEN [] ELSE [x.v] END" if value_bins else ""
+    value_deltas = " || CASE WHEN x.v IS NULL THEN [] ELSE [0] END" if value_bins else ""
+    return f"""
+        WITH mapped AS (
+            SELECT e.subject_id, e.t, e.priority, e.token, e.value_bin, COALESCE(v.id, 1) as token_id,
+                {value_id_sql('e.value_bin', vocab, value_bins)} as value_id
+            FROM all_events e
+            LEFT JOIN vocab_map v ON e.token = v.token
+        ),
+        per_subject AS (
+            SELECT subject_id, LIST(struct_pack(t := t, id := token_id, v := value_id) ORDER BY t ASC, priority ASC, token ASC, value_bin ASC) as ev
+            FROM mapped
+            GROUP BY subject_id
+        )
+        -- Time-Token vor jedes Event, das mehr als 1 Minute nach seinem Vorgänger liegt.
+        -- Das Time-Token trägt den Abstand, das Event selbst dann 0 (gleicher Zeitpunkt).
+        SELECT
+            subject_id,
+            flatten(list_transform(ev, (x, i) ->
+                (CASE WHEN i > 1 AND {diff} > 1 THEN [{time_token_sql(diff, vocab)}, x.id] ELSE [x.id] END){value_ids}
+            )) as ids,
+            flatten(list_transform(ev, (x, i) ->
+                (CASE WHEN i > 1 AND {diff} > 1 THEN [CAST({diff} AS INTEGER), 0]
+                      ELSE [CAST(COALESCE(CASE WHEN i > 1 THEN {diff} END, 0) AS INTEGER)] END){value_deltas}
+            )) as deltas
+        FROM per_subject
+    """
+
+
+def stream_chunks_sql(streams):
+    """
+    Stage 6 (Chunking) auf den Streams aus fused_streams_sql (Tabelle oder Subquery).
+    Ergibt exakt dieselben Chunks wie der staged Pfad.
+    """
+    return f"""
+        WITH chunked AS (
+            -- Jeder Chunk bekommt nur seinen eigenen Slice (ein UNNEST über die Slice-Liste).
+            -- Die ganze Liste pro Chunk-Zeile zu kopieren wäre quadratisch in der Historienlänge.
+            SELECT subject_id, UNNEST(list_transform(
+                range(0, (len(ids) + {CHUNK_SIZE - 1}) // {CHUNK_SIZE}),
+                c -> struct_pack(
+                    chunk_id := c,
+                    token_ids := list_slice(ids, c * {CHUNK_SIZE} + 1, (c + 1) * {CHUNK_SIZE}),
+                    time_deltas := list_slice(deltas, c * {CHUNK_SIZE} + 1, (c + 1) * {CHUNK_SIZE})
+                )
+            )) as chunk
+            FROM {streams}
+        )
+        SELECT
+            c.subject_id,
+            CAST(c.chunk.chunk_id AS INTEGER) as chunk_id,
+            l.label,
+            c.chunk.token_ids as token_ids,
+            c.chunk.time_deltas as time_deltas
+        FROM chunked c
+        JOIN unique_labels l ON c.subject_id = l.subject_id
+    """
+
+
+def fused_chunks_sql(vocab, value_bins=0):
+    # Streams + Chunking als eine Query (Bucket-Worker: ihr Resume ist die fertige Part-Datei)
+    return stream_chunks_sql(f"({fused_streams_sql(vocab, value_bins)})")
+
+
+def subject_ranges(con, buckets):
+    """
+    Grenzen für die Buckets: Quantile der subject_id über alle Laborzeilen (der mit Abstand
+    größten Tabelle) -> ungefähr gleich viele Events pro Bucket. Liest nur die subject_id
+    Spalte. Gibt [(lo, hi), ...] zurück, lo/hi = None heißt offen.
+    """
+    if buckets == 1:
+        return [(None, None)]
+    quantiles = ", ".join(str(k / buckets) for k in range(1, buckets))
+    cuts = con.execute(f"SELECT quantile_disc(subject_id, [{quantiles}]) FROM raw_labs").fetchone()[0] or []
+    bounds = [None] + [int(c) for c in cuts] + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def bucket_connection(task):
+    # Jeder Worker hat seine eigene In-Memory DB, eigenes Temp-Verzeichnis und eigenes RAM-Budget
+    temp_dir = Path(task["temp_dir"]) / f"bucket_{task['bucket']}"
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    con = ProfiledConnection(open_connection(None, temp_dir, task["memory_limit"], task["threads"]), temp_dir / "profile.json")
+    create_raw_views(con, task["sources"], bucket=task["range"])
+    if task["value_bins"]:
+        create_bin_view(con, task["bin_edges"])
+    return con
+
+
+def count_bucket_tokens(task):
+    """Worker Phase A: Token-Frequenzen eines Buckets (werden im Hauptprozess gemerged)."""
+    con = bucket_connection(task)
+    # Value-Tokens haben feste IDs, für die Frequenzen reicht der Stream ohne Bins
+    con.execute(f"CREATE OR REPLACE VIEW all_events AS {events_sql()}")
+    counts = count_tokens(con, "all_events")
+    con.close()
+    return counts, con.stats
+
+
+def export_bucket(task):
+    """Worker Phase B: Tokenisierung, Chunking & Export eines Buckets in seine eigene Part-Datei."""
+    con = bucket_connection(task)
+    if task["fused"]:
+        con.execute(f"CREATE OR REPLACE VIEW all_events AS {events_sql(task['value_bins'])}")
     else:
-        print("      ❌ FEHLER: 0 Chunks gefunden. Prüfe Subject-IDs.")
+        run_staged_stages(con, task["value_bins"])
+    create_vocab_map(con, task["vocab"])
+    if not task["fused"]:
+        run_staged_chunking(con, task["vocab"], task["value_bins"])
+    create_unique_labels(con)
 
+    part_file = bucket_part_file(task["parts_dir"], task["bucket"])
+    part_file.parent.mkdir(parents=True, exist_ok=True)
+    # Erst .tmp, dann umbenennen -> eine existierende Part-Datei ist immer vollständig (Resume)
+    tmp_file = part_file.with_suffix(".parquet.tmp")
+    chunks_sql = fused_chunks_sql(task["vocab"], task["value_bins"]) if task["fused"] else staged_chunks_sql()
+    export_chunks(con, chunks_sql, sql_path(tmp_file), vocab_hash(task["vocab"]))
+
+    # Fingerprints des Buckets für den nächsten INCREMENTAL Lauf (Merge im Hauptprozess).
+    # Vor der Part-Datei schreiben: eine existierende Part-Datei hat beim Resume auch ihre Fingerprints.
+    fingerprint_file = bucket_fingerprint_file(task["parts_dir"], task["bucket"])
+    fingerprint_file.parent.mkdir(parents=True, exist_ok=True)
+    compute_fingerprints(con, task["value_bins"])
+    con.execute(f"COPY subject_fingerprints TO '{sql_path(fingerprint_file)}' (FORMAT PARQUET)")
+    os.replace(tmp_file, part_file)
+
+    count = con.execute(f"SELECT count(*) FROM read_parquet('{sql_path(part_file)}')").fetchone()[0]
     con.close()
-    if db_file.exists(): os.remove(db_file)
-    if abs_temp.exists(): shutil.rmtree(abs_temp)
+    return count, con.stats
+
+
+def bucket_part_file(parts_dir, bucket):
+    return Path(parts_dir) / f"bucket={bucket}" / "data_0.parquet"
+
+
+def bucket_fingerprint_file(parts_dir, bucket):
+    # Neben (nicht in) den Hive-Partitionen, damit Konsumenten sie nicht als Daten lesen
+    return Path(parts_dir).parent / "bucket_fingerprints" / f"bucket_{bucket}.parquet"
+
+
+def merge_worker_stats(stats):
+    # Worker laufen gleichzeitig -> Peak RAM / Spill addieren sich im schlimmsten Fall
+    slowest = max(stats, key=lambda s: s["slowest_query_seconds"], default=None)
+    return {
+        "queries": sum(s["queries"] for s in stats),
+        "peak_memory_bytes": sum(s["peak_memory_bytes"] for s in stats),
+        "spilled_bytes": sum(s["spilled_bytes"] for s in stats),
+        "max_worker_peak_memory_bytes": max((s["peak_memory_bytes"] for s in stats), default=0),
+        "slowest_query_seconds": slowest["slowest_query_seconds"] if slowest else 0.0,
+        "slowest_query": slowest["slowest_query"] if slowest else None,
+    }
+
+
+def run_parallel(con, runner, sources, abs_output, abs_temp, buckets, workers, worker_memory, fused,
+                 frozen_vocab=None, frozen_from=None, value_bins=0, bin_edges=None):
+    """
+    Stage 2-7 parallel: Patienten werden per subject_id-Bereich auf Buckets verteilt,
+    jeder Bucket läuft in einem eigenen Prozess. Ergebnis ist ein Hive-partitioniertes
+    Dataset, inhaltlich identisch zur Einzeldatei, plus die gemergten Fingerprints.
+    """
+    workers = workers or min(buckets, os.cpu_count() or 1)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"   ⚡ Parallel: {buckets} Buckets, {workers} Worker à {worker_memory} / {threads} Threads")
+    ranges = subject_ranges(con, buckets)
+
+    base_task = {
+        "sources": sources, "buckets": buckets, "temp_dir": str(abs_temp),
+        "memory_limit": worker_memory, "threads": threads, "fused": fused,
+        "value_bins": value_bins, "bin_edges": str(bin_edges) if bin_edges else None,
+    }
+    tasks = [{**base_task, "bucket": k, "range": ranges[k]} for k in range(buckets)]
+    parts_dir = abs_output / SEQUENCES_DIR
+    tmp_parts_dir = abs_temp / SEQUENCES_DIR
+    fingerprint_file = abs_output / FINGERPRINT_FILE
+
+    # spawn statt fork: keine geerbten DuckDB-Threads, verhält sich wie unter Windows
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+
+        def bucket_counts():
+            print("   ... 2/7 - 5/7 Zähle Token-Frequenzen pro Bucket")
+            results = list(pool.map(count_bucket_tokens, tasks))
+            # In der Temp-DB sichern, damit ein Resume nicht neu zählen muss
+            con.register("counts_df", pd.concat([counts for counts, _ in results], ignore_index=True))
+            con.execute("CREATE OR REPLACE TABLE bucket_token_counts AS SELECT * FROM counts_df")
+            con.unregister("counts_df")
+            return {**merge_worker_stats([stats for _, stats in results]), "rows": sum(len(c) for c, _ in results)}
+
+        def vocab_stage():
+            if frozen_vocab is not None:
+                print("   ... 5/7 Nutze vorgegebenes Vokabular (frozen)")
+                vocab = frozen_vocab
+            else:
+                print("   ... 5/7 Erstelle Vokabular (Merge über alle Buckets)")
+                vocab = vocab_from_counts(con, con.execute("SELECT * FROM bucket_token_counts").df(), value_bins)
+            meta = save_vocab(vocab, abs_output, frozen_from)
+            print(f"      ✅ Vokabular Größe: {len(vocab)} Token (Hash {meta['vocab_hash']}, v{meta['version']})")
+            return len(vocab)
+
+        def bucket_export():
+            vocab = load_vocab(abs_output / VOCAB_FILE)
+            print(f"   ... 6/7 + 7/7 Chunks & Export pro Bucket -> {parts_dir}")
+            # Fertige Part-Dateien eines abgebrochenen Laufs werden wiederverwendet
+            todo = [t for t in tasks if not bucket_part_file(tmp_parts_dir, t["bucket"]).exists()]
+            if len(todo) < len(tasks):
+                print(f"      ⏭️  {len(tasks) - len(todo)} Buckets bereits exportiert, überspringe")
+            results = list(pool.map(export_bucket, [{**t, "vocab": vocab, "parts_dir": str(tmp_parts_dir)} for t in todo]))
+
+            final_count = con.execute(f"SELECT count(*) FROM read_parquet('{sql_path(tmp_parts_dir)}/*/*.parquet')").fetchone()[0]
+            print(f"      📊 Geschriebene Chunks (Sequenzen): {final_count} in {buckets} Part-Dateien")
+            if final_count == 0:
+                print("❌ FEHLER: Keine Events geladen! Pfade prüfen.")
+                sys.exit(1)
+
+            # Erst komplett ins Temp schreiben, dann austauschen -> nie ein halbes Dataset im Output
+            if parts_dir.exists(): shutil.rmtree(parts_dir)
+            shutil.move(str(tmp_parts_dir), str(parts_dir))
+            # Alte Einzeldatei entfernen, sonst lesen Konsumenten veraltete Daten
+            if (abs_output / SEQUENCES_FILE).exists(): os.remove(abs_output / SEQUENCES_FILE)
+            # Fingerprints aller Buckets -> Basis für den nächsten INCREMENTAL Lauf
+            fingerprint_parts = bucket_fingerprint_file(tmp_parts_dir, 0).parent
+            con.execute(f"""
+                COPY (SELECT * FROM read_parquet('{sql_path(fingerprint_parts)}/*.parquet') ORDER BY subject_id)
+                TO '{sql_path(fingerprint_file)}' (FORMAT PARQUET)
+            """)
+            return {**merge_worker_stats([stats for _, stats in results]), "rows": final_count}
+
+        if frozen_vocab is None:
+            runner.run("bucket_counts", bucket_counts)
+        else:
+            # Frozen: keine Frequenzen nötig, die Buckets werden nur gemappt
+            runner.record("bucket_counts", {"skipped": "frozen_vocab"})
+        runner.run("vocab", vocab_stage)
+        runner.run("bucket_export", bucket_export)
+
+    return parts_dir
+
+
+def run_pipeline(incremental=False, rebuild_vocab=False, use_staging=True, fused=True,
+                 buckets=1, workers=None, worker_memory="4GB", resume=False, vocab_path=None, token_store=False,
+                 value_bins=0):
+    print(f"🦆 Starte DuckDB Pipeline (Type-Safe & Debugged)...")
+
+    # Pfade absolut machen (WICHTIG für Windows)
+    abs_mimic = MIMIC_PATH.resolve()
+    abs_output = OUTPUT_PATH.resolve()
+    abs_temp = TEMP_DIR.resolve()
+
+    print(f"   📂 Rohdaten: {abs_mimic}")
+    print(f"   💾 Output:   {abs_output}")
+    print(f"   ⚙️ Temp:     {abs_temp}")
+
+    final_file = abs_output / SEQUENCES_FILE
+    vocab_file = abs_output / VOCAB_FILE
+    fingerprint_file = abs_output / FINGERPRINT_FILE
+    bin_edges_file = abs_output / BIN_EDGES_FILE
+
+    # Frozen-Vocab: neue Daten auf ein bestehendes Vokabular mappen (z.B. das eines registrierten Modells)
+    frozen_vocab, frozen_from = None, None
+    if vocab_path:
+        frozen_from = Path(vocab_path).resolve()
+        if not frozen_from.exists():
+            print(f"❌ FEHLER: Vokabular nicht gefunden: {frozen_from}")
+            sys.exit(1)
+        frozen_vocab = load_vocab(frozen_from)
+        print(f"   🧊 Vokabular: {frozen_from} (frozen, Hash {vocab_hash(frozen_vocab)})")
+        if rebuild_vocab:
+            print("   ⚠️ --rebuild-vocab wird ignoriert, das Vokabular ist über --vocab vorgegeben.")
+            rebuild_vocab = False
+
+    if incremental and buckets > 1:
+        # Das Delta ist klein, dafür lohnt sich kein Prozess-Pool
+        print("   ⚠️ Incremental läuft immer single-process. Ignoriere --buckets.")
+        buckets = 1
+
+    # Basis für den Merge: Einzeldatei oder das Dataset eines Parallel-Laufs (wird zur Einzeldatei)
+    existing_data = final_file
+    if not final_file.exists() and (abs_output / SEQUENCES_DIR).exists():
+        existing_data = abs_output / SEQUENCES_DIR / "*" / "*.parquet"
+    if incremental:
+        missing = [p.name for p in (vocab_file, fingerprint_file) if not p.exists()]
+        if existing_data == final_file and not final_file.exists():
+            missing.insert(0, final_file.name)
+        if missing:
+            print(f"   ⚠️ Incremental nicht möglich (fehlt: {', '.join(missing)}). Mache Full Rebuild.")
+            incremental = False
+        elif "time_deltas" not in parquet_columns(existing_data):
+            # Output aus einer Version ohne Zeitspalte -> nicht mergebar
+            print("   ⚠️ Bestehende Chunks haben keine time_deltas. Mache Full Rebuild.")
+            incremental = False
+        elif rebuild_vocab:
+            # Neues Vokabular verschiebt alle Token-IDs -> alte Chunks wären inkompatibel
+            print("   ⚠️ --rebuild-vocab verschiebt alle Token-IDs. Mache Full Rebuild.")
+            incremental = False
+        elif frozen_vocab is not None and vocab_hash(frozen_vocab) != read_vocab_meta(abs_output)["vocab_hash"]:
+            print("   ⚠️ --vocab weicht vom Vokabular der bestehenden Chunks ab. Mache Full Rebuild.")
+            incremental = False
+        elif (len([t for t in load_vocab(vocab_file) if t.startswith(VALUE_TOKEN_PREFIX)]) != value_bins
+              or (value_bins and read_bin_count(bin_edges_file) != value_bins)):
+            # Andere Bin-Anzahl = andere Token-Semantik -> alte Chunks nicht mergebar
+            print(f"   ⚠️ Bestehende Chunks wurden nicht mit --value-bins {value_bins} erzeugt. Mache Full Rebuild.")
+            incremental = False
+    if incremental and frozen_vocab is None:
+        # Eingefrorenes Vokabular wiederverwenden -> Token-IDs bleiben stabil
+        frozen_vocab, frozen_from = load_vocab(vocab_file), vocab_file
+    print(f"   🔁 Modus:    {'INCREMENTAL' if incremental else 'FULL'} ({'fused' if fused else 'staged'})")
+
+    abs_output.mkdir(parents=True, exist_ok=True)
+    db_file = abs_output / "mimic_temp.db"
+
+    # Checkpoints gelten nur für exakt dieselbe Konfiguration
+    config = {
+        "mimic_path": str(abs_mimic), "incremental": incremental, "fused": fused, "use_staging": use_staging,
+        "buckets": buckets, "chunk_size": CHUNK_SIZE, "min_freq": MIN_FREQ, "value_bins": value_bins,
+        "vocab_hash": vocab_hash(frozen_vocab) if frozen_vocab is not None else None,
+    }
+    if resume and checkpoint_matches(db_file, config):
+        print("   ♻️ Resume: setze auf den Checkpoints in mimic_temp.db auf")
+    else:
+        if resume:
+            print("   ⚠️ Kein passender Checkpoint gefunden. Starte von vorne.")
+        if abs_temp.exists(): shutil.rmtree(abs_temp)
+        if db_file.exists(): os.remove(db_file)
+    abs_temp.mkdir(parents=True, exist_ok=True)
+
+    con = ProfiledConnection(open_connection(db_file, abs_temp), abs_temp / "profile.json")
+    runner = StageRunner(con, abs_output / REPORT_FILE, config)
+
+    def token_store_stage(data_path):
+        # Zusätzliches Exportformat: flache Token-Arrays + Offsets als .npy (memory-mappbar)
+        store_dir = abs_output / TOKEN_STORE_DIR
+        if not token_store:
+            # Ein alter Store passt nicht mehr zu den neuen Chunks
+            if store_dir.exists(): shutil.rmtree(store_dir)
+            return
+
+        def export_store():
+            print(f"   ... Token-Store (CSR) -> {store_dir}")
+            meta = export_token_store(data_path, store_dir, len(load_vocab(vocab_file)))
+            print(f"      ✅ {meta['n_tokens']} Token als {meta['token_dtype']}")
+            return meta["n_sequences"]
+
+        runner.run("token_store", export_store)
+
+    def cleanup():
+        runner.finish()
+        con.close()
+        if db_file.exists(): os.remove(db_file)
+        if abs_temp.exists(): shutil.rmtree(abs_temp)
+
+    # ---------------------------------------------------------
+    # 1. VIEWS (Mit Typ-Casting!)
+    # ---------------------------------------------------------
+    print("   ... 1/7 Lade Tabellen (mit Type-Safety)")
+    # Läuft auch beim Resume: ist der Staging-Cache aktuell, ist das nur ein Stat pro Datei
+    start = time.perf_counter()
+    sources = raw_sources(abs_mimic, use_staging)
+    runner.record("staging", {"seconds": round(time.perf_counter() - start, 3), "rows": len(sources)})
+
+    def load_stage():
+        create_raw_views(con, sources)
+        if buckets > 1:
+            return len(sources)
+
+        # Fingerprints brauchen wir in beiden Modi: FULL legt die Basis für den nächsten INCREMENTAL Lauf
+        print("      🔎 Berechne Patienten-Fingerprints")
+        compute_fingerprints(con, value_bins)
+
+        if incremental:
+            con.execute(f"""
+                CREATE OR REPLACE TABLE changed_subjects AS
+                SELECT subject_id FROM subject_fingerprints
+                EXCEPT
+                SELECT subject_id FROM (
+                    SELECT subject_id, fingerprint FROM subject_fingerprints
+                    INTERSECT
+                    SELECT subject_id, fingerprint FROM read_parquet('{sql_path(fingerprint_file)}')
+                )
+            """)
+            # Patienten, die aus den Rohdaten verschwunden sind, fliegen auch aus dem Output
+            con.execute(f"""
+                CREATE OR REPLACE TABLE removed_subjects AS
+                SELECT subject_id FROM read_parquet('{sql_path(fingerprint_file)}')
+                EXCEPT
+                SELECT subject_id FROM subject_fingerprints
+            """)
+            # Ab hier sehen alle Stages nur noch die geänderten Patienten
+            create_raw_views(con, sources, subject_filter="changed_subjects")
+        return con.execute("SELECT count(*) FROM subject_fingerprints").fetchone()[0]
+
+    runner.run("load", load_stage)
+
+    # ---------------------------------------------------------
+    # 1b. VALUE-BINS (optional): Quantil-Grenzen pro itemid
+    # ---------------------------------------------------------
+    def value_bins_stage():
+        # Die Grenzen gehören zum Vokabular: bei frozen Vocab die Bins von dort übernehmen
+        reuse = frozen_from.parent / BIN_EDGES_FILE if frozen_from else None
+        if reuse is not None and read_bin_count(reuse) == value_bins:
+            print(f"   ... Value-Bins: übernehme {reuse}")
+            if reuse != bin_edges_file: shutil.copyfile(reuse, bin_edges_file)
+        else:
+            if frozen_vocab is not None:
+                print(f"   ⚠️ Keine passenden Bin-Grenzen neben {frozen_from}. Berechne neu.")
+            print(f"   ... Value-Bins: {value_bins} Quantile pro itemid (approx_quantile)")
+            compute_bin_edges(con, value_bins, bin_edges_file, MIN_FREQ)
+        return con.execute(f"SELECT count(DISTINCT itemid) FROM read_parquet('{sql_path(bin_edges_file)}')").fetchone()[0]
+
+    if value_bins:
+        runner.run("value_bins", value_bins_stage)
+        create_bin_view(con, bin_edges_file)
+        if frozen_vocab is not None and any(t not in frozen_vocab for t in value_tokens(value_bins)):
+            print("   ⚠️ Das Vokabular enthält keine Value-Tokens, sie werden zu <UNK>.")
+    elif bin_edges_file.exists():
+        # Passt nicht mehr zum neuen Vokabular
+        os.remove(bin_edges_file)
+
+    if buckets > 1:
+        parts_dir = run_parallel(con, runner, sources, abs_output, abs_temp, buckets, workers, worker_memory, fused,
+                                 frozen_vocab, frozen_from, value_bins, bin_edges_file)
+        token_store_stage(parts_dir)
+        cleanup()
+        size = sum(f.stat().st_size for f in parts_dir.rglob("*.parquet"))
+        print(f"🚀 FERTIG! Dataset erstellt ({size / (1024*1024):.2f} MB).")
+        return
+
+    if incremental:
+        n_changed = con.execute("SELECT count(*) FROM changed_subjects").fetchone()[0]
+        n_removed = con.execute("SELECT count(*) FROM removed_subjects").fetchone()[0]
+        print(f"      📊 Neue/geänderte Patienten: {n_changed} | Entfernt: {n_removed}")
+
+        if n_changed == 0 and n_removed == 0:
+            print("✅ Keine Änderungen gefunden. Output ist aktuell.")
+            cleanup()
+            return
+
+    # ---------------------------------------------------------
+    # 2.-4. UNION, TIME DELTAS, TIME TOKENS
+    # ---------------------------------------------------------
+    if fused:
+        def union_stage():
+            # Nur eine View: Zeitabstände und Time-Tokens entstehen erst im fused Export
+            print("   ... 2/7 Vereinige Events (Union, als View)")
+            con.execute(f"CREATE OR REPLACE VIEW all_events AS {events_sql(value_bins)}")
+            count = con.execute("SELECT count(*) FROM all_events").fetchone()[0]
+            print(f"      📊 Events gefunden: {count}")
+            return count
+
+        count = runner.run("union", union_stage)["rows"]
+        print("   ... 3/7 + 4/7 Zeitabstände & Time-Tokens -> fused in 6/7 (Streams)")
+        for name in ("time_deltas", "time_tokens"):
+            runner.record(name, {"fused_into": "streams"})
+        token_source = "all_events"
+    else:
+        count = runner.run("union", lambda: stage_union(con, value_bins))["rows"]
+        runner.run("time_deltas", lambda: stage_time_deltas(con), cleanup=STAGE_DROPS["time_deltas"])
+        runner.run("time_tokens", lambda: stage_time_tokens(con), cleanup=STAGE_DROPS["time_tokens"])
+        token_source = "final_stream"
+
+    if count == 0 and not incremental:
+        print("❌ FEHLER: Keine Events geladen! Pfade prüfen.")
+        sys.exit(1)
+
+    # ---------------------------------------------------------
+    # 5. VOKABULAR
+    # ---------------------------------------------------------
+    def vocab_stage():
+        if frozen_vocab is not None:
+            # Keine Frequenzen: die Tokens werden nur per Hash-Join auf vocab_map gemappt
+            print("   ... 5/7 Nutze bestehendes Vokabular (frozen)")
+            vocab = frozen_vocab
+        else:
+            print("   ... 5/7 Erstelle Vokabular")
+            vocab = build_vocab(con, token_source, value_bins)
+        meta = save_vocab(vocab, abs_output, frozen_from)
+        print(f"      ✅ Vokabular Größe: {len(vocab)} Token (Hash {meta['vocab_hash']}, v{meta['version']})")
+
+        create_vocab_map(con, vocab)
+
+        if frozen_vocab is not None:
+            unk_count = con.execute(f"SELECT count(*) FROM {token_source} s ANTI JOIN vocab_map v ON s.token = v.token").fetchone()[0]
+            print(f"      ⚠️ Token ohne Vokabular-Eintrag (-> <UNK>): {unk_count}")
+        return len(vocab)
+
+    runner.run("vocab", vocab_stage)
+    # Beim Resume nach Stage 5 kommt das Vokabular aus der Datei
+    vocab = load_vocab(vocab_file)
+
+    # ---------------------------------------------------------
+    # 6. MAPPING & CHUNKING
+    # ---------------------------------------------------------
+    if fused:
+        def streams_stage():
+            # Der eine Sort pro Patient + Time-Tokens + Mapping. Eigener Checkpoint, damit ein
+            # Abbruch im Export nicht die teure Sortierung wiederholt (kostet Platz in mimic_temp.db).
+            print("   ... 6/7 Sortiere & Mappe Streams pro Patient (fused 3/7, 4/7, 6/7)")
+            con.execute(f"CREATE OR REPLACE TABLE subject_streams AS {fused_streams_sql(vocab, value_bins)}")
+            return con.execute("SELECT count(*) FROM subject_streams").fetchone()[0]
+
+        runner.run("streams", streams_stage, cleanup=STAGE_DROPS["streams"])
+        runner.record("chunks", {"fused_into": "export"})
+    else:
+        print("   ... 6/7 Berechne Chunks")
+        runner.run("chunks", lambda: stage_chunks(con, vocab, value_bins), cleanup=STAGE_DROPS["chunks"])
+
+    # ---------------------------------------------------------
+    # 7. AGGREGATION & EXPORT
+    # ---------------------------------------------------------
+    def export_stage():
+        print("   ... 7/7 Aggregiere Chunks & Speichere")
+
+        # Im Incremental-Modus schreiben wir erst nur das Delta und mergen danach
+        export_file = abs_temp / "delta_sequences.parquet" if incremental else final_file
+        parquet_sql_path = sql_path(export_file)
+        print(f"      💾 Zielpfad: {parquet_sql_path}")
+
+        # SCHRITT A: Labels vorkalkulieren (1 Zeile pro Patient!)
+        create_unique_labels(con)
+
+        # SCHRITT B: Der saubere Join
+        # Jetzt joinen wir 89 Mio Events mit (nur) ~40k Patienten-Labels.
+        # Das Ergebnis bleibt bei 89 Mio Zeilen (keine Explosion mehr!).
+        # Im fused Pfad bleibt hier nur noch das Slicen der fertigen Streams in Chunks
+        chunks_sql = stream_chunks_sql("subject_streams") if fused else staged_chunks_sql()
+        export_chunks(con, chunks_sql, parquet_sql_path, vocab_hash(vocab))
+
+        # Anzahl der Chunks (nicht Zeilen!) aus der fertigen Datei
+        final_count = con.execute(f"SELECT count(*) FROM read_parquet('{parquet_sql_path}')").fetchone()[0]
+        print(f"      📊 Geschriebene Chunks (Sequenzen): {final_count}")
+        if final_count > 0 or incremental:
+            print("      ✅ Export Befehl erfolgreich gesendet.")
+        else:
+            print("      ❌ FEHLER: 0 Chunks gefunden. Prüfe Subject-IDs.")
+
+        if incremental:
+            # SCHRITT C: Merge. Alte Chunks der geänderten/entfernten Patienten raus, Delta rein.
+            # Idempotent: ein zweiter Merge nach Absturz liefert dasselbe Ergebnis.
+            print("      🔀 Merge Delta in bestehende Sequenzen...")
+            merged_file = abs_temp / "merged_sequences.parquet"
+            con.execute(f"""
+                COPY (
+                    SELECT * FROM (
+                        SELECT {SEQUENCE_COLUMNS} FROM read_parquet('{sql_path(existing_data)}')
+                        WHERE subject_id NOT IN (SELECT subject_id FROM changed_subjects)
+                          AND subject_id NOT IN (SELECT subject_id FROM removed_subjects)
+                        UNION ALL
+                        SELECT {SEQUENCE_COLUMNS} FROM read_parquet('{parquet_sql_path}')
+                    )
+                    ORDER BY subject_id, chunk_id
+                ) TO '{sql_path(merged_file)}' ({parquet_options(vocab_hash(vocab))})
+            """)
+            # Atomar ersetzen, damit ein Abbruch nie eine halbe Datei hinterlässt
+            os.replace(merged_file, final_file)
+
+        # Ein altes Dataset aus dem Parallel-Modus ist ab jetzt veraltet
+        if (abs_output / SEQUENCES_DIR).exists(): shutil.rmtree(abs_output / SEQUENCES_DIR)
+
+        # Fingerprints erst nach erfolgreichem Export sichern
+        con.execute(f"COPY (SELECT * FROM subject_fingerprints ORDER BY subject_id) TO '{sql_path(fingerprint_file)}' (FORMAT PARQUET)")
+        return final_count
+
+    runner.run("export", export_stage, cleanup=STAGE_DROPS["export"] if fused else ())
+    token_store_stage(final_file)
+    cleanup()
 
-    final_file = abs_output / 'mimic_sequences.parquet'
     if final_file.exists() and final_file.stat().st_size > 0:
         print(f"🚀 FERTIG! Datei erstellt ({final_file.stat().st_size / (1024*1024):.2f} MB).")
     else:
         print("❌ CRITICAL: Datei ist 0 Bytes groß. Export abgebrochen?")
 
 if __name__ == "__main__":
-    run_pipeline()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--incremental", action="store_true", help="Nur neue/geänderte Patienten neu berechnen und in bestehendes Parquet mergen")
+    parser.add_argument("--rebuild-vocab", action="store_true", help="Vokabular neu aufbauen (erzwingt Full Rebuild)")
+    parser.add_argument("--no-staging", action="store_true", help="CSV.gz direkt lesen statt des Parquet Staging-Caches")
+    parser.add_argument("--staged", action="store_true", help="Debug: Stages 2-6 als einzelne Tabellen materialisieren statt fused Single-Sort Pfad")
+    parser.add_argument("--buckets", type=int, default=1, help="Parallel-Modus: Anzahl Buckets (subject_id-Bereiche) (1 = aus)")
+    parser.add_argument("--workers", type=int, default=None, help="Anzahl Worker-Prozesse (Default: min(buckets, CPUs))")
+    parser.add_argument("--worker-memory", type=str, default="4GB", help="DuckDB memory_limit pro Worker")
+    parser.add_argument("--resume", action="store_true", help="Nach Abbruch ab der letzten fertigen Stage weitermachen (mimic_temp.db bleibt erhalten)")
+    parser.add_argument("--token-store", action="store_true", help="Zusätzlich als CSR Token-Store (.npy, memory-mappbar) exportieren")
+    parser.add_argument("--vocab", type=Path, default=None, help="Frozen-Vocab: Daten auf dieses vocab.json mappen statt es neu aufzubauen")
+    parser.add_argument("--value-bins", type=int, default=0, help="Laborwerte in n Quantil-Bins als Value-Token hinter dem Labor-Token (0 = aus)")
+    args = parser.parse_args()
+
+    run_pipeline(
+        incremental=args.incremental, rebuild_vocab=args.rebuild_vocab, use_staging=not args.no_staging,
+        fused=not args.staged, buckets=args.buckets, workers=args.workers, worker_memory=args.worker_memory,
+        resume=args.resume, vocab_path=args.vocab, token_store=args.token_store, value_bins=args.value_bins
+    )
@@ -0,0 +1,141 @@
+import numpy as np
+from torch.utils.data import Sampler
+
+# Megabatch = so viele Batches werden gemeinsam nach Länge sortiert. Größer = weniger
+# Padding, kleiner = mehr Zufall in der Batch-Zusammensetzung.
+MEGABATCH_FACTOR = 50
+
+
+def padding_ratio(lengths, batches):
+    """Anteil der <PAD>-Positionen, wenn jeder Batch auf seine längste Sequenz gepaddet wird."""
+    real = sum(int(lengths[b].sum()) for b in batches)
+    padded = sum(len(b) * int(lengths[b].max()) for b in batches if len(b))
+    return 1.0 - real / padded if padded else 0.0
+
+
+def random_batches(n, batch_size, seed=0):
+    # Referenz: wie DataLoader(shuffle=True) mit fester Batch-Größe
+    order = np.random.default_rng(seed).permutation(n)
+    return [order[i:i + batch_size] for i in range(0, n, batch_size)]
+
+
+class LengthBucketBatchSampler(Sampler):
+    """
+    Batch-Sampler mit ähnlich langen Sequenzen pro Batch ("sorted within megabatch"):
+    jede Epoche neu mischen, in Megabatches schneiden, darin nach Länge sortieren und
+    in Batches teilen, dann die Batch-Reihenfolge mischen. Die Zufälligkeit pro Epoche
+    bleibt, das Padding fällt weg.
+
+    batch_size: feste Anzahl Sequenzen pro Batch.
+    max_tokens: Token-Budget pro Batch (Batch-Größe x längste Sequenz), kurze Sequenzen
+    ergeben dann große Batches. Mit beiden gesetzt gilt batch_size als Obergrenze.
+    """
+    def __init__(self, lengths, batch_size=None, max_tokens=None, megabatch_size=None, shuffle=True, seed=0):
+        if batch_size is None and max_tokens is None:
+            raise ValueError("❌ batch_size oder max_tokens muss gesetzt sein")
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        if max_tokens is not None and len(self.lengths) and self.lengths.max() > max_tokens:
+            raise ValueError(f"❌ max_tokens={max_tokens} ist kleiner als die längste Sequenz ({self.lengths.max()})")
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        if megabatch_size is None:
+            per_batch = batch_size or max(1, max_tokens // max(1, int(self.lengths.mean()) if len(self.lengths) else 1))
+            megabatch_size = MEGABATCH_FACTOR * per_batch
+        self.megabatch_size = megabatch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self._cache = (None, None)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _split(self, sorted_idx):
+        if self.max_tokens is None:
+            return [sorted_idx[i:i + self.batch_size] for i in range(0, len(sorted_idx), self.batch_size)]
+        # Aufsteigend sortiert -> die aktuelle Sequenz ist immer die längste im Batch
+        batches, start = [], 0
+        for pos, length in enumerate(self.lengths[sorted_idx]):
+            count = pos - start + 1
+            if pos > start and (count * length > self.max_tokens or (self.batch_size and count > self.batch_size)):
+                batches.append(sorted_idx[start:pos])
+                start = pos
+        if start < len(sorted_idx):
+            batches.append(sorted_idx[start:])
+        return batches
+
+    def batches(self, epoch=None):
+        epoch = self.epoch if epoch is None else epoch
+        if self._cache[0] == epoch:
+            return self._cache[1]
+        rng = np.random.default_rng([self.seed, epoch])
+        n = len(self.lengths)
+        order = rng.permutation(n) if self.shuffle else np.arange(n)
+        batches = []
+        for start in range(0, n, self.megabatch_size):
+            megabatch = order[start:start + self.megabatch_size]
+            batches.extend(self._split(megabatch[np.argsort(self.lengths[megabatch], kind="stable")]))
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        self._cache = (epoch, batches)
+        return batches
+
+    def padding_ratio(self, epoch=None):
+        return padding_ratio(self.lengths, self.batches(epoch))
+
+    def __iter__(self):
+        batches = self.batches()
+        # Ohne set_epoch() (z.B. eigener Loop) trotzdem jede Epoche neu mischen
+        self.epoch += 1
+        for batch in batches:
+            yield batch.tolist()
+
+    def __len__(self):
+        return len(self.batches())
+
+
+def pack_rows(lengths, row_len):
+    """
+    First-Fit-Decreasing: verteilt Sequenzen (Positionen in `lengths`) auf möglichst wenige
+    Zeilen mit Kapazität row_len. Gibt eine Liste von Zeilen (Listen von Positionen) zurück.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    rows, free = [], np.empty(0, dtype=np.int64)
+    for pos in np.argsort(-lengths, kind="stable"):
+        fits = np.flatnonzero(free >= lengths[pos])
+        if len(fits):
+            rows[fits[0]].append(int(pos))
+            free[fits[0]] -= lengths[pos]
+        else:
+            rows.append([int(pos)])
+            free = np.append(free, row_len - lengths[pos])
+    return rows
+
+
+class PackedBatchSampler(LengthBucketBatchSampler):
+    """
+    Batches für Sequence Packing: zufällige Chunks, bis tokens_per_batch echte Token
+    zusammen sind. collate_packed packt sie dann per pack_rows in Zeilen der Länge seq_len.
+    Sortieren ist unnötig, die Zeilen werden unabhängig von der Länge voll.
+    """
+    def __init__(self, lengths, tokens_per_batch, shuffle=True, seed=0):
+        super().__init__(lengths, max_tokens=tokens_per_batch, megabatch_size=max(1, len(lengths)), shuffle=shuffle, seed=seed)
+
+    def batches(self, epoch=None):
+        epoch = self.epoch if epoch is None else epoch
+        if self._cache[0] == epoch:
+            return self._cache[1]
+        rng = np.random.default_rng([self.seed, epoch])
+        order = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        # Batch-Grenze dort, wo die kumulierte Tokenzahl das Budget überschreitet
+        batch_ids = (np.cumsum(self.lengths[order]) - 1) // self.max_tokens
+        bounds = np.flatnonzero(np.diff(batch_ids)) + 1
+        batches = [b for b in np.split(order, bounds) if len(b)]
+        self._cache = (epoch, batches)
+        return batches
+
+    def padding_ratio(self, epoch=None, row_len=None):
+        # Padding der gepackten Zeilen (nur der Rest jeder Zeile)
+        batches = self.batches(epoch)
+        rows = sum(len(pack_rows(self.lengths[b], row_len)) for b in batches)
+        return 1.0 - int(self.lengths.sum()) / (rows * row_len) if rows else 0.0
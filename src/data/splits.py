@@ -0,0 +1,125 @@
+import json
+import os
+import numpy as np
+import pyarrow.parquet as pq
+from pathlib import Path
+
+# Patient-Level Split per Hash der subject_id statt np.random.shuffle über alle IDs:
+# jede Zeile lässt sich einzeln zuordnen (Streaming, Row-Group für Row-Group), ohne
+# die Patientenliste im RAM zu halten. Gleiche seed -> gleicher Split, unabhängig von
+# Reihenfolge, Partitionierung und Datenmenge.
+TRAIN_FRAC = 0.8
+N_FOLDS = 5
+# Persistierter Split neben dem Parquet, ein File pro seed
+SPLIT_INDEX_FILE = "split_index_s{seed}.npz"
+
+
+def subject_hash(subject_ids, seed=0):
+    # splitmix64 (uint64 läuft in numpy absichtlich über), seed als Salt
+    with np.errstate(over="ignore"):
+        x = np.asarray(subject_ids).astype(np.uint64) + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def hash_fraction(subject_ids, seed=0):
+    # Gleichverteilt in [0, 1): obere 53 Bit als double
+    return (subject_hash(subject_ids, seed) >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+
+def hash_split_mask(subject_ids, seed, split, train_frac=TRAIN_FRAC):
+    """Bool-Maske der Zeilen, deren Patient im Split "train" bzw. "val" liegt."""
+    is_train = hash_fraction(subject_ids, seed) < train_frac
+    if split == "train":
+        return is_train
+    if split == "val":
+        return ~is_train
+    raise ValueError(f"❌ Unbekannter Split: {split}")
+
+
+def stratified_folds(subject_ids, labels, seed=0, n_folds=N_FOLDS):
+    """
+    Fold pro Zeile, stratifiziert nach Patienten-Label: innerhalb jedes Labels werden die
+    Patienten nach Hash sortiert und reihum auf die Folds verteilt -> jeder Fold hat
+    (bis auf einen Patienten) gleich viele Positive. Alle Chunks eines Patienten im selben Fold.
+    """
+    subjects, inverse = np.unique(subject_ids, return_inverse=True)
+    subject_label = np.zeros(len(subjects), dtype=np.int8)
+    np.maximum.at(subject_label, inverse, np.asarray(labels, dtype=np.int8))
+    subject_fold = np.empty(len(subjects), dtype=np.int8)
+    hashes = subject_hash(subjects, seed)
+    for label in np.unique(subject_label):
+        members = np.flatnonzero(subject_label == label)
+        ranked = members[np.argsort(hashes[members], kind="stable")]
+        subject_fold[ranked] = np.arange(len(ranked)) % n_folds
+    return subject_fold[inverse]
+
+
+def source_fingerprint(data_path):
+    # Größe + mtime aller Dateien: ändert sich bei jedem Rewrite (auch Incremental-Merge)
+    data_path = Path(data_path)
+    files = sorted(data_path.rglob("*.parquet")) if data_path.is_dir() else [data_path]
+    return [[str(f.relative_to(data_path) if data_path.is_dir() else f.name), f.stat().st_size, f.stat().st_mtime_ns] for f in files]
+
+
+def read_split_columns(data_path):
+    # Nur die drei kleinen Spalten, in der kanonischen Reihenfolge (subject_id, chunk_id)
+    table = pq.read_table(data_path, columns=["subject_id", "chunk_id", "label"])
+    if Path(data_path).is_dir():
+        table = table.sort_by([("subject_id", "ascending"), ("chunk_id", "ascending")])
+    return (
+        table.column("subject_id").to_numpy(),
+        table.column("label").fill_null(0).to_numpy(),
+    )
+
+
+def build_split_index(subject_ids, labels, seed, train_frac=TRAIN_FRAC, n_folds=N_FOLDS):
+    """Sortierte Zeilen-Indizes (int32) für train/val und fold_0..fold_{k-1}."""
+    is_train = hash_split_mask(subject_ids, seed, "train", train_frac)
+    index = {"train": np.flatnonzero(is_train), "val": np.flatnonzero(~is_train)}
+    folds = stratified_folds(subject_ids, labels, seed, n_folds)
+    for k in range(n_folds):
+        index[f"fold_{k}"] = np.flatnonzero(folds == k)
+    return {name: rows.astype(np.int32) for name, rows in index.items()}
+
+
+def load_split_index(data_path, seed, train_frac=TRAIN_FRAC, n_folds=N_FOLDS):
+    """
+    Split-Index für das Sequenz-Parquet (Datei oder Dataset). Wird einmal gebaut und als
+    .npz daneben gespeichert. Jeder weitere setup() (Optuna-Trial, Eval, Dashboard) lädt
+    nur noch ein paar int32-Arrays, solange sich die Daten nicht geändert haben.
+    """
+    data_path = Path(data_path)
+    index_file = data_path.parent / SPLIT_INDEX_FILE.format(seed=seed)
+    meta = {"seed": seed, "train_frac": train_frac, "n_folds": n_folds, "source": source_fingerprint(data_path)}
+
+    if index_file.exists():
+        with np.load(index_file) as stored:
+            if json.loads(str(stored["meta"])) == meta:
+                return {name: stored[name] for name in stored.files if name != "meta"}
+        print(f"♻️  Split-Index veraltet, baue neu: {index_file.name}")
+
+    subject_ids, labels = read_split_columns(data_path)
+    index = build_split_index(subject_ids, labels, seed, train_frac, n_folds)
+    # Atomar ersetzen: parallele CV-Läufe bauen im Zweifel denselben Index
+    tmp_file = index_file.with_name(f"{index_file.name}.{os.getpid()}.tmp")
+    with open(tmp_file, "wb") as f:
+        np.savez(f, meta=np.array(json.dumps(meta)), **index)
+    os.replace(tmp_file, index_file)
+    print(f"💾 Split-Index gespeichert: {index_file.name} ({len(subject_ids)} Zeilen, {n_folds} Folds)")
+    return index
+
+
+def split_rows(index, fold=None):
+    """
+    (train_rows, val_rows). Ohne fold der feste Hash-Split, mit fold=k Cross-Validation:
+    Fold k ist Validierung, alle anderen Folds Training.
+    """
+    if fold is None:
+        return index["train"], index["val"]
+    n_folds = sum(name.startswith("fold_") for name in index)
+    if not 0 <= fold < n_folds:
+        raise ValueError(f"❌ fold={fold} außerhalb von 0..{n_folds - 1}")
+    train = np.sort(np.concatenate([index[f"fold_{k}"] for k in range(n_folds) if k != fold]))
+    return train, index[f"fold_{fold}"]
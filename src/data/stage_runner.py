@@ -0,0 +1,192 @@
+import duckdb
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from src.data.staging import sql_path
+
+STATE_TABLE = "pipeline_state"
+
+
+class ProfiledConnection:
+    """
+    Dünner Wrapper um eine DuckDB-Connection für den Stage-Report.
+    - Peak-RAM und Spill (Temp-Dateien): ein Hintergrund-Thread fragt duckdb_memory() über
+      einen eigenen Cursor ab. Die system_peak_* Werte aus dem Profiling taugen dafür nicht,
+      die sind kumulativ über die ganze Lebensdauer der DB.
+    - Laufzeit je Query: JSON-Profiling (profiling_output), daraus die langsamste Query der Stage.
+    Alles andere (df(), executemany, register, ...) wird direkt durchgereicht.
+    """
+    def __init__(self, con, profile_file, poll_interval=0.2):
+        self._con = con
+        self.profile_file = Path(profile_file)
+        self.profile_file.parent.mkdir(parents=True, exist_ok=True)
+        con.execute("SET enable_profiling='json'")
+        con.execute(f"SET profiling_output='{sql_path(self.profile_file)}'")
+
+        self._lock = threading.Lock()
+        self._pending = False
+        self.reset()
+        # Profiling ist pro Connection eingestellt -> der Cursor überschreibt das Profil nicht
+        self._cursor = con.cursor()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, args=(poll_interval,), daemon=True)
+        self._thread.start()
+
+    def reset(self):
+        self.flush()
+        with self._lock:
+            self.stats = {"queries": 0, "peak_memory_bytes": 0, "spilled_bytes": 0,
+                          "slowest_query_seconds": 0.0, "slowest_query": None}
+
+    def execute(self, query, *args, **kwargs):
+        # Das Profil wird erst nach dem Fetch geschrieben (z.B. .df()) -> erst vor der nächsten
+        # Query einsammeln. DDL schreibt kein Profil, daher alte Datei vorher weg.
+        self.flush()
+        if self.profile_file.exists(): os.remove(self.profile_file)
+        result = self._con.execute(query, *args, **kwargs)
+        self._pending = True
+        # Kurze Queries fallen sonst zwischen zwei Samples durch
+        self._sample()
+        return result
+
+    def flush(self):
+        if not self._pending:
+            return
+        self._pending = False
+        try:
+            with open(self.profile_file, "r") as f:
+                profile = json.load(f)
+        except (OSError, ValueError):
+            return
+        latency = float(profile.get("latency") or 0.0)
+        with self._lock:
+            self.stats["queries"] += 1
+            if latency >= self.stats["slowest_query_seconds"]:
+                self.stats["slowest_query_seconds"] = round(latency, 3)
+                self.stats["slowest_query"] = " ".join(str(profile.get("query_name", "")).split())[:200]
+
+    def close(self):
+        self.flush()
+        self._stop.set()
+        self._thread.join()
+        self._cursor.close()
+        self._con.close()
+
+    def _sample(self):
+        # Lock auch um die Abfrage: Hauptthread und Poller teilen sich den Cursor
+        with self._lock:
+            memory, spilled = self._cursor.execute(
+                "SELECT sum(memory_usage_bytes), sum(temporary_storage_bytes) FROM duckdb_memory()"
+            ).fetchone()
+            self.stats["peak_memory_bytes"] = max(self.stats["peak_memory_bytes"], int(memory or 0))
+            self.stats["spilled_bytes"] = max(self.stats["spilled_bytes"], int(spilled or 0))
+
+    def _poll(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self._sample()
+            except duckdb.Error:
+                return
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+
+def checkpoint_matches(db_file, config):
+    """True, wenn db_file Checkpoints aus einem Lauf mit identischer Konfiguration enthält."""
+    if not Path(db_file).exists():
+        return False
+    try:
+        con = duckdb.connect(str(db_file), read_only=True)
+        rows = con.execute(f"SELECT DISTINCT config FROM {STATE_TABLE}").fetchall()
+        con.close()
+    except duckdb.Error:
+        return False
+    return len(rows) > 0 and all(r[0] == json.dumps(config, sort_keys=True) for r in rows)
+
+
+def format_bytes(n):
+    return f"{n / (1024**3):.2f} GB" if n >= 1024**3 else f"{n / (1024**2):.1f} MB"
+
+
+class StageRunner:
+    """
+    Führt Pipeline-Stages idempotent aus. Jede fertige Stage bekommt einen Marker
+    (inkl. Metriken) in der Temp-DB; ein erneuter Lauf mit resume überspringt sie.
+    Nach jeder Stage wird der JSON-Report neu geschrieben, damit er auch nach einem
+    Absturz die bis dahin gemessenen Stages enthält.
+    """
+    def __init__(self, con, report_file, config):
+        self.con = con
+        self.report_file = Path(report_file)
+        self.config = json.dumps(config, sort_keys=True)
+        self.report = {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "config": config,
+            "stages": [],
+        }
+        self.started = time.perf_counter()
+        con.execute(f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} (stage VARCHAR, config VARCHAR, finished_at TIMESTAMP, metrics VARCHAR)")
+
+    def run(self, name, fn, cleanup=()):
+        """
+        fn() führt die Stage aus und gibt die Zeilenanzahl ihres Ergebnisses zurück (oder None)
+        bzw. ein dict mit Metriken (mindestens "rows").
+        cleanup: SQL-Statements (z.B. DROP der Input-Tabellen), die erst NACH dem Marker laufen,
+        damit eine abgebrochene Stage ihre Inputs beim Resume noch vorfindet.
+        """
+        row = self.con.execute(f"SELECT metrics FROM {STATE_TABLE} WHERE stage = ? AND config = ?", [name, self.config]).fetchone()
+        if row is not None:
+            metrics = {**json.loads(row[0]), "resumed": True}
+            print(f"   ⏭️  {name}: Checkpoint gefunden, überspringe")
+        else:
+            if isinstance(self.con, ProfiledConnection):
+                self.con.reset()
+            start = time.perf_counter()
+            result = fn()
+            metrics = {"stage": name, "seconds": round(time.perf_counter() - start, 3)}
+            if isinstance(self.con, ProfiledConnection):
+                self.con.flush()
+                metrics.update(self.con.stats)
+            # Stages mit Worker-Prozessen liefern ihre Metriken selbst (dict), sonst nur die Zeilen
+            metrics.update(result if isinstance(result, dict) else {"rows": result})
+            self.con.execute(f"INSERT INTO {STATE_TABLE} VALUES (?, ?, ?, ?)", [name, self.config, datetime.now(), json.dumps(metrics)])
+            self.con.execute("CHECKPOINT")
+            rows = metrics.get("rows")
+            print(f"      ⏱️  {metrics['seconds']:.1f}s | Zeilen: {rows if rows is not None else '-'}"
+                  f" | Peak RAM: {format_bytes(metrics.get('peak_memory_bytes', 0))}"
+                  f" | Spill: {format_bytes(metrics.get('spilled_bytes', 0))}")
+
+        for sql in cleanup:
+            self.con.execute(sql)
+        self.report["stages"].append(metrics)
+        self.write_report()
+        return metrics
+
+    def record(self, name, metrics):
+        # Einträge ohne Checkpoint (Staging-Check, im fused Pfad zusammengelegte Stages)
+        self.report["stages"].append({"stage": name, **metrics})
+        self.write_report()
+
+    def finish(self):
+        self.write_report(finished=True)
+        print(f"   📈 Stage-Report: {self.report_file}")
+        slowest = next((s for s in self.report["stages"] if s["stage"] == self.report.get("slowest_stage")), None)
+        if slowest:
+            print(f"      🐢 Langsamste Stage: {slowest['stage']} ({slowest['seconds']:.1f}s)")
+
+    def write_report(self, finished=False):
+        self.report["total_seconds"] = round(time.perf_counter() - self.started, 3)
+        self.report["finished"] = finished
+        # Übersprungene Stages zählen mit ihren Messwerten aus dem abgebrochenen Lauf
+        measured = [s for s in self.report["stages"] if s.get("seconds") is not None]
+        if measured:
+            self.report["slowest_stage"] = max(measured, key=lambda s: s["seconds"])["stage"]
+        tmp_file = self.report_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(self.report, f, indent=2)
+        os.replace(tmp_file, self.report_file)
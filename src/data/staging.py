@@ -0,0 +1,167 @@
+import duckdb
+import hashlib
+import json
+import os
+import argparse
+from pathlib import Path
+
+# --- KONFIGURATION ---
+MIMIC_PATH = Path("../data/mimic-iv-3.1")
+STAGING_DIR = Path("../ML_DATA/staged")
+
+MANIFEST_FILE = "staging_manifest.json"
+ROW_GROUP_SIZE = 500_000
+
+# Rohtabelle -> Quelldatei + Sortierung. Sortiert nach subject_id, damit die
+# Row-Group Statistiken (min/max) Filter auf Patienten direkt wegpruning können.
+RAW_TABLES = {
+    "admissions": {"file": "hosp/admissions.csv.gz", "order_by": "subject_id, admittime"},
+    "labevents": {"file": "hosp/labevents.csv.gz", "order_by": "subject_id, charttime"},
+    "prescriptions": {"file": "hosp/prescriptions.csv.gz", "order_by": "subject_id, starttime"},
+    "diagnoses_icd": {"file": "hosp/diagnoses_icd.csv.gz", "order_by": "subject_id, hadm_id"},
+}
+
+
+def sql_path(path):
+    # DuckDB braucht Forward-Slashes (WICHTIG für Windows)
+    return str(path).replace("\\", "/")
+
+
+def file_sha256(path, block_size=1 << 24):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_manifest(staging_dir):
+    manifest_file = Path(staging_dir) / MANIFEST_FILE
+    if not manifest_file.exists():
+        return {}
+    with open(manifest_file, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(staging_dir, manifest):
+    manifest_file = Path(staging_dir) / MANIFEST_FILE
+    tmp_file = manifest_file.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_file, manifest_file)
+
+
+def is_fresh(entry, source, staged_file):
+    """
+    Prüft, ob die gestagte Kopie noch zur Quelldatei passt.
+    Schnellpfad über Größe + mtime, bei abweichender mtime entscheidet der Hash
+    (z.B. nach einem Kopieren der Rohdaten ohne inhaltliche Änderung).
+    Gibt (fresh, entry) zurück, entry ggf. mit aktualisierter mtime.
+    """
+    if not entry or not staged_file.exists() or not source.exists():
+        return False, entry
+
+    stat = source.stat()
+    if entry["size"] != stat.st_size:
+        return False, entry
+    if entry["mtime_ns"] == stat.st_mtime_ns:
+        return True, entry
+
+    if file_sha256(source) == entry["sha256"]:
+        return True, {**entry, "mtime_ns": stat.st_mtime_ns}
+    return False, entry
+
+
+def stage_table(con, name, source, staged_file):
+    spec = RAW_TABLES[name]
+    tmp_file = staged_file.with_suffix(".parquet.tmp")
+    # subject_id einmalig typisieren, Rest übernimmt der Sniffer wie bisher
+    con.execute(f"""
+        COPY (
+            SELECT * REPLACE (CAST(subject_id AS BIGINT) AS subject_id)
+            FROM read_csv('{sql_path(source)}', AUTO_DETECT=TRUE)
+            ORDER BY {spec['order_by']}
+        ) TO '{sql_path(tmp_file)}' (FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE {ROW_GROUP_SIZE})
+    """)
+    os.replace(tmp_file, staged_file)
+
+
+def stage_raw_tables(mimic_path=MIMIC_PATH, staging_dir=STAGING_DIR, tables=None, force=False,
+                     memory_limit="8GB", threads=4):
+    """
+    Konvertiert die Roh-CSVs einmalig in typisierte, sortierte Parquet-Dateien.
+    Veraltete Kopien (Quelle geändert) werden automatisch neu erzeugt.
+    Gibt {tabelle: pfad zur gestagten Datei} zurück.
+    """
+    abs_mimic = Path(mimic_path).resolve()
+    abs_staging = Path(staging_dir).resolve()
+    abs_staging.mkdir(parents=True, exist_ok=True)
+
+    manifest = load_manifest(abs_staging)
+    staged = {}
+    con = None
+
+    for name in tables or RAW_TABLES:
+        source = abs_mimic / RAW_TABLES[name]["file"]
+        staged_file = abs_staging / f"{name}.parquet"
+
+        fresh, entry = (False, None) if force else is_fresh(manifest.get(name), source, staged_file)
+        if fresh:
+            manifest[name] = entry
+            staged[name] = staged_file
+            continue
+
+        if not source.exists():
+            print(f"   ⚠️ Quelle fehlt, überspringe Staging: {source}")
+            continue
+
+        if con is None:
+            con = duckdb.connect()
+            con.execute(f"SET memory_limit='{memory_limit}'")
+            con.execute(f"SET temp_directory='{sql_path(abs_staging / 'tmp')}'")
+            con.execute(f"SET threads={threads}")
+
+        print(f"   📦 Stage {name} -> {staged_file.name}")
+        stat = source.stat()
+        stage_table(con, name, source, staged_file)
+        manifest[name] = {
+            "source": str(source),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": file_sha256(source),
+        }
+        # Nach jeder Tabelle sichern -> ein Abbruch kostet nur die aktuelle Tabelle
+        save_manifest(abs_staging, manifest)
+        staged[name] = staged_file
+
+    if con is not None:
+        con.close()
+    save_manifest(abs_staging, manifest)
+    return staged
+
+
+def table_source(name, mimic_path=MIMIC_PATH, staging_dir=STAGING_DIR):
+    """
+    SQL-Quelle für eine Rohtabelle: die gestagte Parquet-Kopie, falls sie aktuell ist,
+    sonst die CSV.gz. Staged selbst nichts (dafür stage_raw_tables).
+    """
+    source = Path(mimic_path).resolve() / RAW_TABLES[name]["file"]
+    staged_file = Path(staging_dir).resolve() / f"{name}.parquet"
+
+    fresh, _ = is_fresh(load_manifest(staging_dir).get(name), source, staged_file)
+    if fresh:
+        return f"read_parquet('{sql_path(staged_file)}')"
+    return f"read_csv('{sql_path(source)}', AUTO_DETECT=TRUE)"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mimic-path", type=Path, default=MIMIC_PATH)
+    parser.add_argument("--staging-dir", type=Path, default=STAGING_DIR)
+    parser.add_argument("--force", action="store_true", help="Alle Tabellen neu stagen")
+    args = parser.parse_args()
+
+    print("🦆 Stage MIMIC Rohtabellen nach Parquet...")
+    result = stage_raw_tables(args.mimic_path, args.staging_dir, force=args.force)
+    for name, path in result.items():
+        print(f"   ✅ {name}: {path} ({path.stat().st_size / (1024*1024):.2f} MB)")
@@ -0,0 +1,311 @@
+import duckdb
+import gzip
+import json
+import math
+import os
+import shutil
+import sys
+import time
+import argparse
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from pathlib import Path
+
+# Damit 'src' auch beim direkten Aufruf als Skript gefunden wird
+root_path = Path(__file__).resolve().parent.parent.parent
+sys.path.append(str(root_path))
+
+from src.data.staging import RAW_TABLES, sql_path
+
+# --- KONFIGURATION ---
+OUTPUT_PATH = Path("../data/mimic-synthetic")
+
+# Grobe Kennzahlen aus MIMIC-IV 3.1 (eda/mimic_tabellen_report.md, plan.md).
+# Mengen pro Aufnahme sind log-normal verteilt (median, sigma) -> lange, schiefe Sequenzen.
+PROFILE = {
+    "positive_rate": 0.107,         # Anteil verstorbener Patienten (plan.md)
+    "readmission_p": 0.35,          # geometrisch: P(weitere Aufnahme) -> Ø ~1.5 Aufnahmen
+    "max_admissions": 99,
+    "los_minutes": (5040, 0.9),     # Liegedauer, Median 3.5 Tage
+    "gap_days": (120, 1.2),         # Abstand zwischen Aufnahmen
+    "labs": (80, 1.5),              # Ø ~250 Laborwerte pro Aufnahme
+    "max_labs": 20000,
+    "meds": (15, 1.2),
+    "diagnoses": (9, 0.6),
+    "max_diagnoses": 39,
+    "n_lab_items": 1650,            # Distinct itemids / Medikamente / ICD-Codes, Zipf-artig gezogen
+    "n_drugs": 9000,
+    "n_icd_codes": 28000,
+    "null_starttime_rate": 0.001,   # Wie im Original gibt es Verordnungen ohne starttime
+}
+
+DISCHARGE_LOCATIONS = [
+    ("HOME", 0.363), (None, 0.280), ("HOME HEALTH CARE", 0.186), ("SKILLED NURSING FACILITY", 0.099),
+    ("REHAB", 0.026), ("CHRONIC/LONG TERM ACUTE CARE", 0.015), ("HOSPICE", 0.010), ("AGAINST ADVICE", 0.006),
+    ("PSYCH FACILITY", 0.006), ("ACUTE HOSPITAL", 0.004), ("OTHER FACILITY", 0.003), ("ASSISTED LIVING", 0.002),
+]
+
+
+def create_macros(con, seed):
+    """
+    Zufall über hash() statt random(): deterministisch pro (Seed, Schlüssel), unabhängig
+    von Thread-Anzahl und Reihenfolge -> gleiche Daten bei jedem Lauf und jeder Skalierung.
+    """
+    con.execute(f"CREATE OR REPLACE MACRO rnd(a, b, salt) AS ((hash(a, b, salt, {int(seed)}) % 1000000007) + 0.5) / 1000000007.0")
+    # Box-Muller aus zwei unabhängigen Uniformen
+    con.execute("CREATE OR REPLACE MACRO rnorm(a, b, salt) AS sqrt(-2 * ln(rnd(a, b, salt || '_1'))) * cos(2 * pi() * rnd(a, b, salt || '_2'))")
+    con.execute("CREATE OR REPLACE MACRO rlognorm(a, b, salt, median, sigma) AS median * exp(sigma * rnorm(a, b, salt))")
+    # Zipf-artig: kleine Indizes sind viel häufiger als große
+    con.execute("CREATE OR REPLACE MACRO rzipf(a, b, salt, n) AS CAST(floor(pow(rnd(a, b, salt), 3) * n) AS BIGINT)")
+
+
+def discharge_location_sql(u_expr):
+    # Kumulative Verteilung -> CASE über eine Uniforme
+    whens, cum = [], 0.0
+    total = sum(p for _, p in DISCHARGE_LOCATIONS)
+    for loc, p in DISCHARGE_LOCATIONS:
+        cum += p / total
+        value = f"'{loc}'" if loc else "NULL"
+        whens.append(f"WHEN {u_expr} < {cum:.6f} THEN {value}")
+    return "CASE " + " ".join(whens) + " ELSE 'HOME' END"
+
+
+def create_admissions(con, n_patients, profile):
+    # Schwelle so, dass P(frailty + Rauschen > q) = positive_rate (beides N(0,1) gemischt)
+    q = normal_quantile(1 - profile["positive_rate"])
+    los_median, los_sigma = profile["los_minutes"]
+    gap_median, gap_sigma = profile["gap_days"]
+
+    con.execute(f"""
+        CREATE OR REPLACE TABLE patients AS
+        SELECT
+            subject_id,
+            z,
+            (0.8 * z + 0.6 * rnorm(subject_id, 0, 'death')) > {q} as dies,
+            -- Kränkere Patienten kommen öfter wieder
+            LEAST({profile['max_admissions']}, 1 + CAST(floor(ln(rnd(subject_id, 0, 'n_adm')) / ln({profile['readmission_p']} + 0.1 * tanh(z))) AS INTEGER)) as n_adm,
+            TIMESTAMP '2110-01-01' + to_minutes(CAST(rnd(subject_id, 0, 'start') * 60 * 525600 AS BIGINT)) as first_admit
+        FROM (
+            SELECT 10000000 + range as subject_id, rnorm(10000000 + range, 0, 'frailty') as z
+            FROM range({int(n_patients)})
+        )
+    """)
+
+    con.execute(f"""
+        CREATE OR REPLACE TABLE synth_admissions AS
+        WITH adm AS (
+            SELECT
+                p.subject_id, p.z, p.dies, p.n_adm, p.first_admit,
+                a.adm_idx,
+                20000000 + (p.subject_id - 10000000) * 100 + a.adm_idx as hadm_id,
+                CAST(rlognorm(p.subject_id, a.adm_idx, 'los', {los_median}, {los_sigma}) * exp(0.3 * p.z) AS BIGINT) + 60 as los_min,
+                CAST(rlognorm(p.subject_id, a.adm_idx, 'gap', {gap_median}, {gap_sigma}) * 1440 AS BIGINT) as gap_min
+            FROM patients p, (SELECT UNNEST(range(p.n_adm)) as adm_idx) a
+        ),
+        timed AS (
+            SELECT *,
+                first_admit + to_minutes(CAST(COALESCE(SUM(los_min + gap_min) OVER (
+                    PARTITION BY subject_id ORDER BY adm_idx ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                ), 0) AS BIGINT)) as admittime
+            FROM adm
+        )
+        SELECT
+            subject_id, hadm_id, adm_idx, z,
+            admittime,
+            admittime + to_minutes(los_min) as dischtime,
+            -- Sterben kann man nur in der letzten Aufnahme
+            CAST(dies AND adm_idx = n_adm - 1 AS INTEGER) as hospital_expire_flag
+        FROM timed
+    """)
+
+
+def normal_quantile(p):
+    # Inverse Normalverteilung per Bisektion, reicht für eine Konstante
+    lo, hi = -10.0, 10.0
+    for _ in range(100):
+        mid = (lo + hi) / 2
+        if 0.5 * (1 + math.erf(mid / math.sqrt(2))) < p:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+
+def export_table(con, query, target, batch_rows=262144):
+    """
+    Streamt das Ergebnis als CSV.gz. Nicht über COPY ... COMPRESSION GZIP: das komprimiert
+    single-threaded mit hohem Level und dominiert sonst die Laufzeit. Hier pyarrow-CSV pro
+    Record-Batch + gzip Level 1 (ein Member pro Batch, gzip-Leser hängen die einfach an).
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = target.with_name(target.name + ".tmp")
+    reader = con.execute(query).fetch_record_batch(batch_rows)
+    header = True
+    with open(tmp_file, "wb") as f:
+        for batch in reader:
+            buf = pa.BufferOutputStream()
+            pacsv.write_csv(batch, buf, pacsv.WriteOptions(include_header=header))
+            f.write(gzip.compress(buf.getvalue().to_pybytes(), compresslevel=1))
+            header = False
+    os.replace(tmp_file, target)
+
+
+def admissions_sql():
+    return f"""
+        SELECT
+            subject_id, hadm_id, admittime, dischtime,
+            CASE WHEN hospital_expire_flag = 1 THEN dischtime END as deathtime,
+            CASE WHEN rnd(hadm_id, 0, 'type') < 0.45 THEN 'EW EMER.' WHEN rnd(hadm_id, 0, 'type') < 0.7 THEN 'URGENT' ELSE 'ELECTIVE' END as admission_type,
+            CASE WHEN rnd(hadm_id, 0, 'aloc') < 0.5 THEN 'EMERGENCY ROOM' ELSE 'PHYSICIAN REFERRAL' END as admission_location,
+            CASE WHEN hospital_expire_flag = 1 THEN 'DIED' ELSE {discharge_location_sql("rnd(hadm_id, 0, 'dloc')")} END as discharge_location,
+            CASE WHEN rnd(subject_id, 0, 'ins') < 0.45 THEN 'Medicare' WHEN rnd(subject_id, 0, 'ins') < 0.7 THEN 'Private' ELSE 'Medicaid' END as insurance,
+            hospital_expire_flag
+        FROM synth_admissions
+        ORDER BY subject_id, admittime
+    """
+
+
+def labevents_sql(profile):
+    median, sigma = profile["labs"]
+    # Referenzbereich pro itemid fest, Werte driften mit der Frailty -> kränkere Patienten
+    # haben mehr abnormale Laborwerte (Signal fürs Modell)
+    return f"""
+        WITH labs AS (
+            SELECT
+                a.subject_id,
+                a.hadm_id,
+                a.z,
+                l.lab_idx,
+                a.admittime + to_minutes(CAST(rnd(a.hadm_id, l.lab_idx, 'lab_t') * date_diff('minute', a.admittime, a.dischtime) AS BIGINT)) as charttime,
+                50800 + rzipf(a.hadm_id, l.lab_idx, 'lab_item', {profile['n_lab_items']}) as itemid
+            FROM synth_admissions a,
+                 (SELECT UNNEST(range(LEAST({profile['max_labs']}, CAST(rlognorm(a.hadm_id, 0, 'n_labs', {median}, {sigma}) * exp(0.2 * a.z) AS BIGINT) + 1))) as lab_idx) l
+        ),
+        valued AS (
+            SELECT *,
+                5 + (hash(itemid, 'mean') % 2000) / 10.0 as ref_mean,
+                0.5 + (hash(itemid, 'sd') % 200) / 10.0 as ref_sd
+            FROM labs
+        ),
+        measured AS (
+            SELECT *, round(ref_mean + ref_sd * (rnorm(hadm_id, lab_idx, 'val') + 0.5 * z), 2) as valuenum
+            FROM valued
+        )
+        SELECT
+            -- Aus Schlüssel abgeleitet statt row_number() -> stabil über Läufe und Thread-Anzahl
+            (hadm_id - 20000000) * 100000 + lab_idx + 1 as labevent_id,
+            subject_id,
+            CASE WHEN rnd(hadm_id, lab_idx, 'lab_hadm') < 0.1 THEN NULL ELSE hadm_id END as hadm_id,
+            itemid,
+            charttime,
+            CAST(valuenum AS VARCHAR) as value,
+            valuenum,
+            'mg/dL' as valueuom,
+            round(ref_mean - 1.3 * ref_sd, 2) as ref_range_lower,
+            round(ref_mean + 1.3 * ref_sd, 2) as ref_range_upper,
+            CASE WHEN abs(valuenum - ref_mean) > 1.3 * ref_sd THEN 'abnormal' END as flag
+        FROM measured
+        ORDER BY subject_id, charttime, labevent_id
+    """
+
+
+def prescriptions_sql(profile):
+    median, sigma = profile["meds"]
+    return f"""
+        WITH meds AS (
+            SELECT
+                a.subject_id, a.hadm_id, m.med_idx,
+                a.admittime + to_minutes(CAST(rnd(a.hadm_id, m.med_idx, 'med_t') * date_diff('minute', a.admittime, a.dischtime) AS BIGINT)) as t
+            FROM synth_admissions a,
+                 (SELECT UNNEST(range(CAST(rlognorm(a.hadm_id, 0, 'n_meds', {median}, {sigma}) AS BIGINT))) as med_idx) m
+        )
+        SELECT
+            subject_id, hadm_id,
+            CASE WHEN rnd(hadm_id, med_idx, 'med_null') < {profile['null_starttime_rate']} THEN NULL ELSE t END as starttime,
+            t + to_minutes(CAST(rlognorm(hadm_id, med_idx, 'med_dur', 1440, 1.0) AS BIGINT)) as stoptime,
+            'MAIN' as drug_type,
+            'Drug ' || rzipf(hadm_id, med_idx, 'drug', {profile['n_drugs']}) as drug
+        FROM meds
+        ORDER BY subject_id, starttime, hadm_id, stoptime, drug
+    """
+
+
+def diagnoses_sql(profile):
+    median, sigma = profile["diagnoses"]
+    return f"""
+        WITH diags AS (
+            SELECT
+                a.subject_id, a.hadm_id, d.seq_num,
+                rzipf(a.hadm_id, d.seq_num, 'icd', {profile['n_icd_codes']}) as code_idx
+            FROM synth_admissions a,
+                 (SELECT UNNEST(range(1, LEAST({profile['max_diagnoses']}, CAST(rlognorm(a.hadm_id, 0, 'n_diag', {median}, {sigma}) AS BIGINT) + 1) + 1)) as seq_num) d
+        )
+        SELECT
+            subject_id, hadm_id, seq_num,
+            -- Ältere Aufnahmen ICD-9 (numerisch), neuere ICD-10 (Buchstabe + Ziffern)
+            CASE WHEN hash(code_idx, 'ver') % 10 < 4 THEN lpad(CAST(code_idx % 10000 AS VARCHAR), 4, '0')
+                 ELSE chr(65 + CAST(code_idx % 26 AS INTEGER)) || lpad(CAST(code_idx // 26 AS VARCHAR), 3, '0') END as icd_code,
+            CASE WHEN hash(code_idx, 'ver') % 10 < 4 THEN 9 ELSE 10 END as icd_version
+        FROM diags
+        ORDER BY subject_id, hadm_id, seq_num
+    """
+
+
+def generate(output_path=OUTPUT_PATH, n_patients=1000, seed=42, profile=None,
+             memory_limit="8GB", threads=4, temp_dir=None):
+    """
+    Schreibt synthetische hosp/{admissions,labevents,prescriptions,diagnoses_icd}.csv.gz im
+    MIMIC-IV Layout. Nur die Aufnahmen werden materialisiert, die Event-Tabellen
+    streamen aus DuckDB (Spill auf temp_dir) -> skaliert bis 10M+ Patienten.
+    """
+    profile = {**PROFILE, **(profile or {})}
+    out = Path(output_path).resolve()
+    out.mkdir(parents=True, exist_ok=True)
+
+    con = duckdb.connect()
+    con.execute(f"SET memory_limit='{memory_limit}'")
+    con.execute(f"SET threads={threads}")
+    temp_dir = Path(temp_dir).resolve() if temp_dir else out / "tmp"
+    con.execute(f"SET temp_directory='{sql_path(temp_dir)}'")
+    # Reihenfolge in den Dateien kommt aus ORDER BY, nicht aus der Einfügereihenfolge
+    con.execute("SET preserve_insertion_order=false")
+    create_macros(con, seed)
+
+    print(f"🧬 Generiere {n_patients} synthetische Patienten (Seed {seed}) -> {out}")
+    create_admissions(con, n_patients, profile)
+
+    tables = {
+        "admissions": admissions_sql(),
+        "labevents": labevents_sql(profile),
+        "prescriptions": prescriptions_sql(profile),
+        "diagnoses_icd": diagnoses_sql(profile),
+    }
+    for name, query in tables.items():
+        start = time.perf_counter()
+        target = out / RAW_TABLES[name]["file"]
+        export_table(con, query, target)
+        print(f"   ✅ {name:<14} {target.stat().st_size / (1024*1024):>9.2f} MB  ({time.perf_counter() - start:.1f}s)")
+
+    n_adm, n_pos, n_pat = con.execute("""
+        SELECT count(*), (SELECT count(*) FROM patients WHERE dies), (SELECT count(*) FROM patients)
+        FROM synth_admissions
+    """).fetchone()
+    summary = {"patients": n_pat, "admissions": n_adm, "positive_rate": round(n_pos / max(n_pat, 1), 4), "seed": seed, "profile": profile}
+    with open(out / "synthetic_meta.json", "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"   📊 Aufnahmen: {n_adm} | Verstorbene Patienten: {n_pos} ({summary['positive_rate']:.1%})")
+    con.close()
+    if temp_dir.exists(): shutil.rmtree(temp_dir)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", type=Path, default=OUTPUT_PATH, help="Zielverzeichnis (bekommt hosp/*.csv.gz)")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--memory-limit", type=str, default="8GB")
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    generate(args.out, args.patients, args.seed, memory_limit=args.memory_limit, threads=args.threads)
@@ -0,0 +1,174 @@
+import duckdb
+import json
+import os
+import shutil
+import sys
+import argparse
+import numpy as np
+from pathlib import Path
+
+# Damit 'src' auch beim direkten Aufruf als Skript gefunden wird
+root_path = Path(__file__).resolve().parent.parent.parent
+sys.path.append(str(root_path))
+
+from src.data.staging import sql_path
+from src.data.vocab import parquet_vocab_hash
+
+# CSR-Layout: alle Token hintereinander in tokens.npy, Sequenz i = tokens[offsets[i]:offsets[i+1]]
+TOKEN_STORE_DIR = "token_store"
+STORE_META_FILE = "store_meta.json"
+STORE_ARRAYS = {
+    "tokens": None,          # int16 oder int32, je nach Vokabulargröße
+    "offsets": np.int64,     # Länge n_sequences + 1
+    "subject_id": np.int64,
+    "chunk_id": np.int32,
+    "label": np.int8,
+    "time_deltas": np.int32, # parallel zu tokens, Minuten seit dem vorherigen Token
+}
+# Fehlen, wenn das Sequenz-Parquet aus einer älteren Pipeline-Version stammt
+OPTIONAL_ARRAYS = {"time_deltas"}
+
+
+def token_dtype(vocab_size):
+    # IDs laufen von 0 bis vocab_size - 1
+    return np.int16 if vocab_size <= np.iinfo(np.int16).max + 1 else np.int32
+
+
+def parquet_source(data_path):
+    data_path = Path(data_path)
+    if data_path.is_dir():
+        # Hive-partitioniertes Dataset aus dem Parallel-Modus
+        return f"read_parquet('{sql_path(data_path)}/**/*.parquet')"
+    return f"read_parquet('{sql_path(data_path)}')"
+
+
+def export_token_store(data_path, store_dir, vocab_size=None, batch_rows=65536, memory_limit="4GB"):
+    """
+    Schreibt die Chunks aus dem Sequenz-Parquet (Datei oder Dataset) als memory-mappbare
+    .npy Arrays. Reihenfolge wie die Einzeldatei (subject_id, chunk_id). Gestreamt in
+    Record-Batches, der RAM-Bedarf hängt also nicht an der Datengröße.
+    """
+    store_dir = Path(store_dir)
+    source = parquet_source(data_path)
+
+    con = duckdb.connect()
+    con.execute(f"SET memory_limit='{memory_limit}'")
+    n_sequences, n_tokens, max_id = con.execute(
+        f"SELECT count(*), COALESCE(sum(len(token_ids)), 0), COALESCE(max(list_max(token_ids)), 0) FROM {source}"
+    ).fetchone()
+    columns = [row[0] for row in con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+    names = [name for name in STORE_ARRAYS if name not in OPTIONAL_ARRAYS or name in columns]
+    vocab_size = vocab_size or int(max_id) + 1
+    if max_id >= vocab_size:
+        raise ValueError(f"❌ Token-ID {max_id} passt nicht zu vocab_size={vocab_size}")
+
+    dtypes = {**STORE_ARRAYS, "tokens": token_dtype(vocab_size)}
+    shapes = {"tokens": n_tokens, "offsets": n_sequences + 1, "subject_id": n_sequences, "chunk_id": n_sequences,
+              "label": n_sequences, "time_deltas": n_tokens}
+
+    # Erst in ein Temp-Verzeichnis, dann austauschen -> nie ein halber Store
+    tmp_dir = store_dir.with_name(store_dir.name + ".tmp")
+    if tmp_dir.exists(): shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    arrays = {
+        name: np.lib.format.open_memmap(tmp_dir / f"{name}.npy", mode="w+", dtype=dtypes[name], shape=(shapes[name],))
+        for name in names
+    }
+    arrays["offsets"][0] = 0
+
+    reader = con.execute(f"""
+        SELECT subject_id, chunk_id, label, token_ids{", time_deltas" if "time_deltas" in arrays else ""} FROM {source}
+        ORDER BY subject_id, chunk_id
+    """).fetch_record_batch(batch_rows)
+
+    row, pos = 0, 0
+    for batch in reader:
+        n = batch.num_rows
+        token_lists = batch.column("token_ids")
+        values = token_lists.flatten().to_numpy(zero_copy_only=False)
+        lengths = np.diff(token_lists.offsets.to_numpy())
+
+        arrays["tokens"][pos:pos + len(values)] = values
+        arrays["offsets"][row + 1:row + n + 1] = pos + np.cumsum(lengths)
+        arrays["subject_id"][row:row + n] = batch.column("subject_id").to_numpy(zero_copy_only=False)
+        arrays["chunk_id"][row:row + n] = batch.column("chunk_id").to_numpy(zero_copy_only=False)
+        arrays["label"][row:row + n] = batch.column("label").fill_null(0).to_numpy(zero_copy_only=False)
+        if "time_deltas" in arrays:
+            arrays["time_deltas"][pos:pos + len(values)] = batch.column("time_deltas").flatten().to_numpy(zero_copy_only=False)
+        row += n
+        pos += len(values)
+    con.close()
+
+    for arr in arrays.values():
+        arr.flush()
+    del arrays
+
+    meta = {
+        "n_sequences": int(n_sequences),
+        "n_tokens": int(n_tokens),
+        "token_dtype": np.dtype(dtypes["tokens"]).name,
+        "vocab_size": int(vocab_size),
+        "arrays": names,
+        "vocab_hash": parquet_vocab_hash(data_path),
+        "source": str(data_path),
+    }
+    with open(tmp_dir / STORE_META_FILE, "w") as f:
+        json.dump(meta, f, indent=2)
+
+    if store_dir.exists(): shutil.rmtree(store_dir)
+    os.replace(tmp_dir, store_dir)
+    return meta
+
+
+class TokenStore:
+    """
+    Read-only Zugriff auf einen exportierten Token-Store. Alle Arrays sind np.memmap:
+    Öffnen kostet nur die Header, Seiten werden vom OS zwischen Prozessen geteilt.
+    """
+    def __init__(self, store_dir, mmap_mode="r"):
+        self.store_dir = Path(store_dir)
+        with open(self.store_dir / STORE_META_FILE, "r") as f:
+            self.meta = json.load(f)
+        for name in STORE_ARRAYS:
+            path = self.store_dir / f"{name}.npy"
+            setattr(self, name, np.load(path, mmap_mode=mmap_mode) if path.exists() else None)
+
+    @property
+    def vocab_hash(self):
+        return self.meta.get("vocab_hash")
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def deltas(self, idx):
+        # Minuten seit dem vorherigen Token, gleiche Länge wie self[idx]
+        return self.time_deltas[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def __getitem__(self, idx):
+        # View auf den memmap, keine Kopie
+        return self.tokens[self.offsets[idx]:self.offsets[idx + 1]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", type=Path, default=Path("../ML_DATA/processed/mimic_sequences.parquet"),
+                        help="Sequenz-Parquet (Datei) oder Parallel-Dataset (Verzeichnis)")
+    parser.add_argument("--out", type=Path, default=None, help=f"Zielverzeichnis (Default: <data>/../{TOKEN_STORE_DIR})")
+    parser.add_argument("--vocab-size", type=int, default=None, help="Default: aus vocab.json neben den Daten bzw. max ID + 1")
+    args = parser.parse_args()
+
+    data_path = args.data if args.data.exists() else args.data.with_suffix("")
+    vocab_size = args.vocab_size
+    vocab_file = data_path.parent / "vocab.json"
+    if vocab_size is None and vocab_file.exists():
+        with open(vocab_file, "r") as f:
+            vocab_size = len(json.load(f))
+
+    out_dir = args.out or data_path.parent / TOKEN_STORE_DIR
+    print(f"📦 Exportiere Token-Store: {data_path} -> {out_dir}")
+    meta = export_token_store(data_path, out_dir, vocab_size)
+    print(f"   ✅ {meta['n_sequences']} Sequenzen, {meta['n_tokens']} Token ({meta['token_dtype']})")
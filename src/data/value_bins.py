@@ -0,0 +1,72 @@
+import duckdb
+import os
+from pathlib import Path
+
+from src.data.staging import sql_path
+
+# Bin-Grenzen pro itemid, liegen neben vocab.json (gehören zum Vokabular wie die Token-IDs)
+BIN_EDGES_FILE = "lab_bin_edges.parquet"
+BIN_COUNT_KEY = "value_bins"
+# Generische Value-Tokens statt LAB_<itemid>_Q<k> -> das Vokabular wächst nur um n_bins
+VALUE_TOKEN_PREFIX = "VAL_Q"
+
+
+def value_tokens(n_bins):
+    return [f"{VALUE_TOKEN_PREFIX}{k}" for k in range(1, n_bins + 1)] if n_bins else []
+
+
+def value_id_sql(bin_expr, vocab, n_bins):
+    """
+    Ausdruck value_bin -> Token-ID per Listen-Lookup (kein Join). Fehlt ein Value-Token
+    im Vokabular (z.B. frozen Vocab ohne Bins), wird es zu <UNK>.
+    """
+    ids = ", ".join(str(vocab.get(token, 1)) for token in value_tokens(n_bins))
+    return f"[{ids}][{bin_expr}]" if n_bins else "CAST(NULL AS INTEGER)"
+
+
+def compute_bin_edges(con, n_bins, target, min_count=5):
+    """
+    Quantil-Grenzen pro itemid über raw_labs mit approx_quantile (T-Digest, ein Hash-Aggregat
+    statt eines Sorts pro itemid). Ergebnis als kleine Range-Tabelle (itemid, bin, lo, hi).
+    """
+    target = Path(target)
+    quantiles = ", ".join(f"{k / n_bins:.6f}" for k in range(1, n_bins))
+    tmp_file = target.with_name(target.name + ".tmp")
+    con.execute(f"""
+        COPY (
+            WITH edges AS (
+                SELECT itemid, approx_quantile(valuenum, [{quantiles}]) as q
+                FROM raw_labs
+                WHERE valuenum IS NOT NULL AND isfinite(valuenum)
+                GROUP BY itemid
+                HAVING count(*) >= {min_count}
+            ),
+            bounds AS (
+                SELECT itemid, list_concat([CAST('-infinity' AS DOUBLE)], q, [CAST('infinity' AS DOUBLE)]) as b
+                FROM edges
+            )
+            SELECT itemid, CAST(k AS INTEGER) as bin, b[k] as lo, b[k + 1] as hi
+            FROM bounds, range(1, {n_bins + 1}) r(k)
+            ORDER BY itemid, bin
+        ) TO '{sql_path(tmp_file)}' (FORMAT PARQUET, KV_METADATA {{{BIN_COUNT_KEY}: '{n_bins}'}})
+    """)
+    os.replace(tmp_file, target)
+    return con.execute(f"SELECT count(DISTINCT itemid) FROM read_parquet('{sql_path(target)}')").fetchone()[0]
+
+
+def read_bin_count(path):
+    # Anzahl Bins aus dem Parquet-Footer, None wenn es keine (gültige) Datei gibt
+    path = Path(path)
+    if not path.exists():
+        return None
+    try:
+        row = duckdb.execute(
+            f"SELECT value FROM parquet_kv_metadata('{sql_path(path)}') WHERE key = '{BIN_COUNT_KEY}'"
+        ).fetchone()
+    except duckdb.Error:
+        return None
+    return int(row[0]) if row else None
+
+
+def create_bin_view(con, path):
+    con.execute(f"CREATE OR REPLACE VIEW lab_bins AS SELECT * FROM read_parquet('{sql_path(path)}')")
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+VOCAB_FILE = "vocab.json"
+# Hash + Version des Vokabulars, liegt neben dem Parquet
+VOCAB_META_FILE = "vocab_meta.json"
+# Key im Parquet-Footer (KV-Metadata) der Sequenz-Dateien
+VOCAB_HASH_KEY = "vocab_hash"
+
+
+class VocabMismatchError(ValueError):
+    """Daten bzw. Modell wurden mit einem anderen Vokabular (andere Token-IDs) erzeugt."""
+
+
+def vocab_hash(vocab):
+    """
+    Kurzer Hash über das Mapping Token -> ID. Identisches Mapping ergibt denselben Hash,
+    unabhängig von der Reihenfolge in der JSON-Datei.
+    """
+    canonical = json.dumps(sorted(vocab.items(), key=lambda kv: kv[1]), ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def load_vocab(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def read_vocab_meta(vocab_dir):
+    """
+    Metadaten zum Vokabular in vocab_dir. Für ältere Outputs ohne vocab_meta.json wird
+    der Hash aus vocab.json berechnet. None, wenn es gar kein Vokabular gibt.
+    """
+    vocab_dir = Path(vocab_dir)
+    meta_file = vocab_dir / VOCAB_META_FILE
+    if meta_file.exists():
+        with open(meta_file, "r") as f:
+            return json.load(f)
+    if (vocab_dir / VOCAB_FILE).exists():
+        vocab = load_vocab(vocab_dir / VOCAB_FILE)
+        return {"vocab_hash": vocab_hash(vocab), "vocab_size": len(vocab), "version": None}
+    return None
+
+
+def save_vocab(vocab, vocab_dir, frozen_from=None):
+    """
+    Schreibt vocab.json + vocab_meta.json. Die Version zählt nur hoch, wenn sich das
+    Mapping tatsächlich ändert (neuer Hash).
+    """
+    vocab_dir = Path(vocab_dir)
+    new_hash = vocab_hash(vocab)
+    previous = read_vocab_meta(vocab_dir) or {}
+    version = previous.get("version") or 0
+    if previous.get("vocab_hash") != new_hash:
+        version += 1
+
+    meta = {
+        "vocab_hash": new_hash,
+        "vocab_size": len(vocab),
+        "version": version,
+        "created_at": previous.get("created_at") if previous.get("vocab_hash") == new_hash else datetime.now().isoformat(timespec="seconds"),
+        "frozen_from": str(frozen_from) if frozen_from else None,
+    }
+    for name, content in ((VOCAB_FILE, vocab), (VOCAB_META_FILE, meta)):
+        tmp_file = vocab_dir / f"{name}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(content, f, indent=2 if name == VOCAB_META_FILE else None)
+        os.replace(tmp_file, vocab_dir / name)
+    return meta
+
+
+def parquet_vocab_hash(data_path):
+    """
+    Vokabular-Hash aus dem Parquet-Footer (liest nur die Metadaten, keine Daten).
+    data_path darf eine Datei oder ein Hive-partitioniertes Dataset sein.
+    """
+    import pyarrow.parquet as pq
+
+    data_path = Path(data_path)
+    if data_path.is_dir():
+        parts = sorted(data_path.rglob("*.parquet"))
+        if not parts:
+            return None
+        data_path = parts[0]
+    metadata = pq.read_schema(data_path).metadata or {}
+    value = metadata.get(VOCAB_HASH_KEY.encode())
+    return value.decode() if value else None
+
+
+def check_vocab_hash(expected, actual, context=""):
+    # Ohne Erwartungswert (z.B. alte Modelle) oder ohne Hash in den Daten wird nicht geprüft
+    if expected and actual and expected != actual:
+        raise VocabMismatchError(
+            f"❌ Vokabular passt nicht{f' ({context})' if context else ''}: erwartet {expected}, gefunden {actual}"
+        )
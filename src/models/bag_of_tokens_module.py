@@ -0,0 +1,17 @@
+# src/models/bag_of_tokens_module.py
+import torch.nn as nn
+from src.models.base_module import BaseDiseasePredictor
+
+class DiseasePredictor(BaseDiseasePredictor):
+    """
+    Linearer Bag-of-Tokens Scorer: Mittelwert der Token-Embeddings (EmbeddingBag, <PAD>
+    zählt nicht mit) und ein Linear-Layer. Keine Reihenfolge, keine Attention -> Kosten
+    linear in der Anzahl Token, gedacht als erste Stufe der Kaskade (src/models/cascade.py).
+    """
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.embedding = nn.EmbeddingBag(cfg.model.input_dim, cfg.model.embed_dim, mode="mean", padding_idx=0)
+        self.fc = nn.Linear(cfg.model.embed_dim, cfg.model.num_classes)
+
+    def forward(self, x):
+        return self.fc(self.embedding(x))
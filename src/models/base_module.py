@@ -6,6 +6,7 @@ from pytorch_lightning.loggers import MLFlowLogger
 import torchmetrics
 import mlflow
 import matplotlib.pyplot as plt
+from src.models.distillation import distillation_loss
 
 class BaseDiseasePredictor(pl.LightningModule):
     """
@@ -33,15 +34,23 @@ class BaseDiseasePredictor(pl.LightningModule):
         self.conf_mat = torchmetrics.classification.BinaryConfusionMatrix()
 
     def training_step(self, batch, batch_idx):
-        x, y = batch
-        logits = self(x) # Ruft forward() der Kind-Klasse auf
+        distill = self.cfg.get("distill", {})
+        if distill.get("teacher_uri"):
+            # Distillation: (x, teacher_logits, y), Soft-Targets des Teachers + echte Labels
+            x, teacher_logits, y = batch
+            loss = distillation_loss(self(x), teacher_logits, y, distill.temperature, distill.alpha)
+            self.log('train_loss', loss, prog_bar=True)
+            return loss
+        # Gepackte Batches (data.packing): (x, segment_ids, y), Labels pro Segment
+        *inputs, y = batch
+        logits = self(*inputs) # Ruft forward() der Kind-Klasse auf
         loss = self.criterion(logits, y.long())
         self.log('train_loss', loss, prog_bar=True)
         return loss
 
     def validation_step(self, batch, batch_idx):
-        x, y = batch
-        logits = self(x)
+        *inputs, y = batch
+        logits = self(*inputs)
         y = y.long()
         loss = self.criterion(logits, y.long())
         
@@ -0,0 +1,109 @@
+# src/models/cascade.py
+# Ohne Lightning/MLflow-Imports: wird von der API und von eval/eval_cascade.py genutzt
+import time
+
+import numpy as np
+import torch
+
+
+def risk(model, x):
+    # Wahrscheinlichkeit für Klasse 1 (Tod) pro Zeile
+    return torch.softmax(model(x).float(), dim=1)[:, 1]
+
+
+class CascadePredictor:
+    """
+    Zweistufige Inferenz: der billige Scorer (LSTM / Bag-of-Tokens) bewertet jede Zeile,
+    der teure Transformer nur Zeilen mit billigem Risiko in [low, high]. Außerhalb des
+    Bandes ist der billige Score schon sicher genug (die meisten Patienten überleben).
+    """
+    def __init__(self, cheap, full, low=0.05, high=0.5):
+        if not 0.0 <= low <= high <= 1.0:
+            raise ValueError(f"❌ Unsicherheits-Band braucht 0 <= low <= high <= 1, nicht [{low}, {high}]")
+        self.cheap = cheap
+        self.full = full
+        self.low = low
+        self.high = high
+
+    @torch.no_grad()
+    def predict(self, x):
+        """x: [Batch, SeqLen]. Gibt (Risiko, billiges Risiko, eskaliert-Maske) zurück."""
+        cheap_probs = risk(self.cheap, x)
+        escalate = (cheap_probs >= self.low) & (cheap_probs <= self.high)
+        probs = cheap_probs.clone()
+        if bool(escalate.any()):
+            rows = x[escalate]
+            # Nur bis zur längsten eskalierten Sequenz, Padding rechts
+            width = max(int((rows != 0).sum(dim=1).max()), 1)
+            probs[escalate] = risk(self.full, rows[:, :width]).to(probs.dtype)
+        return probs, cheap_probs, escalate
+
+
+@torch.no_grad()
+def collect_scores(cheap, full, loader, device="cpu", max_batches=None):
+    """
+    Beide Modelle über den ganzen Val-Split (jede Zeile durch beide). Daraus lassen sich
+    beliebige Bänder ohne weiteren Forward auswerten. Die Latenz misst request_latency.
+    """
+    cheap_probs, full_probs, targets = [], [], []
+    for i, (x, y) in enumerate(loader):
+        if max_batches is not None and i >= max_batches:
+            break
+        x = x.to(device)
+        cheap_probs.append(risk(cheap, x).cpu())
+        full_probs.append(risk(full, x).cpu())
+        targets.append(y.long())
+    return {
+        "cheap": torch.cat(cheap_probs).numpy(),
+        "full": torch.cat(full_probs).numpy(),
+        "targets": torch.cat(targets).numpy(),
+    }
+
+
+@torch.inference_mode()
+def request_latency(fn, rows):
+    """
+    Wie einzelne /predict-Anfragen: jede Zeile als Batch 1 ohne Padding, Latenz pro Aufruf
+    in ms (ein Wert pro Zeile, für p50/p95). Auf der CPU messen, wie im Serving-Container.
+    """
+    fn(rows[0])  # Warm-up
+    times = []
+    for x in rows:
+        start = time.perf_counter()
+        fn(x)
+        times.append(1000 * (time.perf_counter() - start))
+    return np.array(times)
+
+
+def percentiles(times):
+    return {"p50_ms": float(np.percentile(times, 50)), "p95_ms": float(np.percentile(times, 95))}
+
+
+def band_report(scores, bands, latency=None):
+    """
+    Pro Band [low, high]: Eskalationsrate, AUROC/AUPRC der Kaskade (vs. nur billig / nur
+    Transformer). Mit latency ({"rows", "cheap_ms", "full_ms"} aus request_latency) auch
+    p50/p95 pro Anfrage: billig + Transformer für die Stichproben-Zeilen, die eskalieren.
+    """
+    from sklearn.metrics import average_precision_score, roc_auc_score
+
+    cheap, full, y = scores["cheap"], scores["full"], scores["targets"]
+    rows = []
+    for low, high in bands:
+        escalate = (cheap >= low) & (cheap <= high)
+        probs = np.where(escalate, full, cheap)
+        rate = float(escalate.mean()) if len(escalate) else 0.0
+        row = {
+            "low": low,
+            "high": high,
+            "escalation_rate": rate,
+            "auroc": roc_auc_score(y, probs),
+            "auprc": average_precision_score(y, probs),
+            "auroc_full": roc_auc_score(y, full),
+            "auroc_cheap": roc_auc_score(y, cheap),
+        }
+        if latency is not None:
+            sample = escalate[latency["rows"]]
+            row.update(percentiles(latency["cheap_ms"] + np.where(sample, latency["full_ms"], 0.0)))
+        rows.append(row)
+    return rows
@@ -0,0 +1,135 @@
+# src/models/causal_transformer_module.py
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import math
+from src.models.base_module import BaseDiseasePredictor
+from src.models.transformer_module import PositionalEncoding
+
+
+class CausalSelfAttention(nn.Module):
+    """
+    Multi-Head Self-Attention mit Kausal-Maske und optionalem KV-Cache.
+    cache = (k, v) der bisherigen Positionen, je [Batch, Heads, T_alt, Head_Dim].
+    """
+    def __init__(self, d_model, nhead, dropout):
+        super().__init__()
+        self.nhead = nhead
+        self.dropout = dropout
+        self.qkv = nn.Linear(d_model, 3 * d_model)
+        self.out_proj = nn.Linear(d_model, d_model)
+
+    def forward(self, x, cache=None):
+        batch, length, d_model = x.shape
+        q, k, v = self.qkv(x).view(batch, length, 3, self.nhead, d_model // self.nhead).permute(2, 0, 3, 1, 4)
+        if cache is not None:
+            k = torch.cat([cache[0], k], dim=2)
+            v = torch.cat([cache[1], v], dim=2)
+        past = k.size(2) - length
+        dropout = self.dropout if self.training else 0.0
+
+        if past == 0:
+            out = F.scaled_dot_product_attention(q, k, v, dropout_p=dropout, is_causal=True)
+        else:
+            # Neue Query i sieht den ganzen Cache und die neuen Positionen bis einschließlich i
+            mask = torch.ones(length, past + length, dtype=torch.bool, device=x.device).tril(diagonal=past)
+            out = F.scaled_dot_product_attention(q, k, v, attn_mask=mask, dropout_p=dropout)
+
+        out = out.transpose(1, 2).reshape(batch, length, d_model)
+        return self.out_proj(out), (k, v)
+
+
+class CausalBlock(nn.Module):
+    # Aufbau wie nn.TransformerEncoderLayer (Post-Norm, ReLU), nur mit Kausal-Attention + Cache
+    def __init__(self, d_model, nhead, dim_feedforward, dropout):
+        super().__init__()
+        self.attn = CausalSelfAttention(d_model, nhead, dropout)
+        self.ff = nn.Sequential(
+            nn.Linear(d_model, dim_feedforward),
+            nn.ReLU(),
+            nn.Dropout(dropout),
+            nn.Linear(dim_feedforward, d_model),
+        )
+        self.norm1 = nn.LayerNorm(d_model)
+        self.norm2 = nn.LayerNorm(d_model)
+        self.dropout = nn.Dropout(dropout)
+
+    def forward(self, x, cache=None):
+        attn, cache = self.attn(x, cache)
+        x = self.norm1(x + self.dropout(attn))
+        x = self.norm2(x + self.dropout(self.ff(x)))
+        return x, cache
+
+
+class DiseasePredictor(BaseDiseasePredictor):
+    """
+    Kausaler Transformer: Position t sieht nur Token <= t, der Output an Position t ist
+    also das Risiko nach t Events. Ein Forward liefert das Risiko für jeden Präfix
+    (trajectory), step() hängt neue Events mit KV-Cache an -> O(n) pro Event statt
+    eines kompletten Re-Encodes in O(n²).
+
+    Padding steht rechts: echte Token sehen es wegen der Kausal-Maske nie, eine
+    Padding-Maske ist unnötig. forward() nimmt den Output am letzten echten Token.
+    """
+    def __init__(self, cfg):
+        super().__init__(cfg)
+
+        self.embedding = nn.Embedding(cfg.model.input_dim, cfg.model.d_model, padding_idx=0)
+        self.pos_encoder = PositionalEncoding(cfg.model.d_model)
+        self.blocks = nn.ModuleList([
+            CausalBlock(cfg.model.d_model, cfg.model.nhead, cfg.model.dim_feedforward, cfg.model.dropout)
+            for _ in range(cfg.model.num_layers)
+        ])
+        self.fc = nn.Linear(cfg.model.d_model, cfg.model.num_classes)
+
+    def encode(self, x, cache=None):
+        # x: [Batch, T_neu], cache: Liste (k, v) pro Layer oder None
+        past = 0 if cache is None else cache[0][0].size(2)
+        if past + x.size(1) > self.max_positions:
+            # Sonst IndexError tief in PositionalEncoding; weiter als gelernt trägt der Kontext ohnehin nicht
+            raise ValueError(f"❌ Kontext voll: {past} + {x.size(1)} Token > {self.max_positions} Positionen."
+                             " Neuen Präfix beginnen (cache=None) bzw. auf die letzten Token kürzen")
+        positions = torch.arange(past, past + x.size(1), device=x.device)
+        h = self.embedding(x) * math.sqrt(self.cfg.model.d_model)
+        h = self.pos_encoder(h, positions)
+        new_cache = []
+        for i, block in enumerate(self.blocks):
+            h, layer_cache = block(h, None if cache is None else cache[i])
+            new_cache.append(layer_cache)
+        return h, new_cache
+
+    @property
+    def max_positions(self):
+        # Länge der Positions-Tabelle, Grenze für Präfix + Cache
+        return self.pos_encoder.pe.size(1)
+
+    def trajectory(self, x):
+        # Logits nach jedem Token [Batch, SeqLen, num_classes] aus einem Forward
+        h, _ = self.encode(x)
+        return self.fc(h)
+
+    def forward(self, x):
+        h, _ = self.encode(x)
+        last = ((x != 0).sum(dim=1) - 1).clamp(min=0)
+        return self.fc(h[torch.arange(x.size(0), device=x.device), last])
+
+    def step(self, x, cache=None):
+        """
+        Inkrementelle Inferenz: neue Token x [Batch, n_neu] an den Cache des bisherigen Präfix
+        anhängen (None = Beginn). Gibt (logits nach dem letzten neuen Token, cache) zurück.
+        Höchstens max_positions Token pro Präfix, danach ValueError.
+        """
+        h, cache = self.encode(x, cache)
+        return self.fc(h[:, -1]), cache
+
+    def training_step(self, batch, batch_idx):
+        if not self.cfg.model.get("position_loss", True):
+            return super().training_step(batch, batch_idx)
+        # Loss an jeder echten Position mit dem Label des Aufenthalts -> lernt Frühwarnung
+        x, y = batch
+        logits = self.trajectory(x)
+        real = x != 0
+        targets = y.long()[:, None].expand_as(x)
+        loss = self.criterion(logits[real], targets[real])
+        self.log('train_loss', loss, prog_bar=True)
+        return loss
@@ -0,0 +1,70 @@
+# src/models/distillation.py
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+
+from src.data.mimic_loader import collate_fn
+
+# Studenten, deren forward() (x) -> Logits nimmt; kausal/hierarchisch haben eigene Losses bzw. Batches
+STUDENT_MODELS = ("lstm_baseline", "transformer_encoder", "bag_of_tokens")
+
+
+def distillation_loss(logits, teacher_logits, y, temperature=2.0, alpha=0.7):
+    """
+    Hinton-Distillation: KL zwischen den weichen Verteilungen von Teacher und Student bei
+    Temperatur T (mal T², damit die Gradienten-Größe nicht von T abhängt), gemischt mit
+    Cross-Entropy auf die echten Labels.
+    """
+    soft = F.kl_div(
+        F.log_softmax(logits / temperature, dim=1),
+        F.softmax(teacher_logits.float() / temperature, dim=1),
+        reduction="batchmean",
+    ) * temperature ** 2
+    hard = F.cross_entropy(logits, y.long())
+    return alpha * soft + (1 - alpha) * hard
+
+
+@torch.no_grad()
+def compute_teacher_logits(teacher, dataset, batch_size=512):
+    # Einmal in fester Reihenfolge über den Train-Split, Zeile i = dataset[i]
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    teacher = teacher.to(device).eval()
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, collate_fn=collate_fn, num_workers=4)
+    out = []
+    for x, _ in loader:
+        out.append(teacher(x.to(device)).float().cpu().numpy())
+    return np.concatenate(out) if out else np.zeros((0, 2), dtype=np.float32)
+
+
+def load_teacher_logits(teacher, dataset, cache_file, meta, batch_size=512):
+    """
+    Teacher-Logits für den Train-Split, auf Platte gecacht (.npy + .json). Der Cache gilt
+    nur, solange Teacher, Split und Datenmenge (meta) gleich bleiben -> jeder weitere
+    Distillation-Lauf (andere Studenten, Optuna) überspringt den Teacher-Forward.
+    """
+    cache_file = Path(cache_file)
+    meta_file = cache_file.with_suffix(".json")
+    meta = {**meta, "rows": len(dataset)}
+    if cache_file.exists() and meta_file.exists():
+        with open(meta_file, "r") as f:
+            if json.load(f) == meta:
+                print(f"♻️  Teacher-Logits aus Cache: {cache_file.name}")
+                return np.load(cache_file)
+        print(f"♻️  Teacher-Logits veraltet, rechne neu: {cache_file.name}")
+
+    print(f"🧑‍🏫 Berechne Teacher-Logits für {len(dataset)} Chunks...")
+    logits = compute_teacher_logits(teacher, dataset, batch_size)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    # Atomar ersetzen, wie der Split-Index
+    tmp_file = cache_file.with_name(f"{cache_file.stem}.{os.getpid()}.tmp.npy")
+    np.save(tmp_file, logits)
+    os.replace(tmp_file, cache_file)
+    with open(meta_file, "w") as f:
+        json.dump(meta, f)
+    print(f"💾 Teacher-Logits gespeichert: {cache_file}")
+    return logits
@@ -0,0 +1,157 @@
+# src/models/export.py
+import json
+import math
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+
+from src.models.onnx_runtime import ONNX_FILE, ONNX_META_KEY, OnnxRuntimeModel
+from src.models.transformer_module import masked_pool
+
+# Eigenständige Inferenz-Artefakte: TorchScript (lädt mit reinem torch) bzw. ONNX (onnxruntime)
+INFERENCE_FILE = "model.pt"
+META_FILE = "meta.json"
+
+
+class TransformerInference(nn.Module):
+    """Nur Embedding, Encoder und Head von transformer_module.DiseasePredictor (ohne Packing)."""
+    def __init__(self, model):
+        super().__init__()
+        self.embedding = model.embedding
+        self.register_buffer("pe", model.pos_encoder.pe[0].clone())
+        self.transformer_encoder = model.transformer_encoder
+        self.fc = model.fc
+        self.scale = math.sqrt(model.cfg.model.d_model)
+        self.pooling = str(model.cfg.model.get("pooling", "mean"))
+        self.skip_padding = bool(model.cfg.model.get("skip_padding", False))
+
+    def forward(self, x):
+        padding_mask = x == 0
+        h = self.embedding(x) * self.scale
+        h = h + self.pe[:x.size(1)]
+        h = self.transformer_encoder(h, src_key_padding_mask=padding_mask)
+        return self.fc(masked_pool(h, padding_mask, self.pooling, self.skip_padding))
+
+
+class LSTMInference(nn.Module):
+    """Embedding, LSTM und Head von rnn_module.DiseasePredictor (Output am letzten echten Token)."""
+    def __init__(self, model):
+        super().__init__()
+        self.embedding = model.embedding
+        self.rnn = model.rnn
+        self.fc = model.fc
+        self.skip_padding = bool(model.cfg.model.get("skip_padding", False))
+
+    def forward(self, x):
+        output, _ = self.rnn(self.embedding(x))
+        if not self.skip_padding:
+            return self.fc(output[:, -1])
+        last = ((x != 0).sum(dim=1) - 1).clamp(min=0)
+        return self.fc(output[torch.arange(x.size(0), device=x.device), last])
+
+
+INFERENCE_MODULES = {
+    "transformer_encoder": TransformerInference,
+    "lstm_baseline": LSTMInference,
+}
+
+
+def inference_meta(model, vocab_hash=None):
+    return {
+        "model_name": model.cfg.model.get("name"),
+        "vocab_hash": vocab_hash,
+        "input_dim": int(model.cfg.model.input_dim),
+        "seq_len": int(model.cfg.data.seq_len),
+        "torch_version": torch.__version__,
+    }
+
+
+def example_batch(model):
+    # Zwei Zeilen, eine mit Padding: Exporte müssen dieselben Logits liefern wie das Original
+    example = torch.randint(1, model.cfg.model.input_dim, (2, 64))
+    example[1, 40:] = 0
+    return example
+
+
+def inference_module(model):
+    name = model.cfg.model.get("name")
+    if name not in INFERENCE_MODULES:
+        raise NotImplementedError(f"Kein Inferenz-Export für model={name}, nur {sorted(INFERENCE_MODULES)}")
+    return INFERENCE_MODULES[name](model.cpu().eval()).eval()
+
+
+def export_inference_model(model, out_dir, vocab_hash=None, atol=1e-4):
+    """
+    Schreibt out_dir/model.pt (TorchScript) mit meta.json als Extra-File. Vorher wird das
+    Artefakt gegen model.forward auf einem gepaddeten Beispiel-Batch geprüft.
+    Gibt den Pfad zurück.
+    """
+    scripted = torch.jit.script(inference_module(model))
+
+    example = example_batch(model)
+    with torch.no_grad():
+        diff = (scripted(example) - model(example)).abs().max().item()
+    if diff > atol:
+        raise RuntimeError(f"❌ Export weicht vom Modell ab (max. {diff:.2e})")
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / INFERENCE_FILE
+    torch.jit.save(scripted, str(path), _extra_files={META_FILE: json.dumps(inference_meta(model, vocab_hash))})
+    return path
+
+
+def export_onnx_model(model, out_dir, vocab_hash=None, opset=17, atol=1e-4):
+    """
+    Schreibt out_dir/model.onnx: Eingang token_ids [batch, seq_len] (int64), Ausgang
+    logits [batch, num_classes], beide Achsen dynamisch. Metadaten in metadata_props.
+    Mit installiertem onnxruntime wird das Ergebnis gegen model.forward geprüft.
+    """
+    import onnx
+
+    module = inference_module(model)
+    example = example_batch(model)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / ONNX_FILE
+
+    # Den Nested-Tensor-Fast-Path kann ONNX nicht abbilden -> für den Export aus
+    mha = getattr(torch.backends, "mha", None)
+    fastpath = mha.get_fastpath_enabled() if mha is not None and hasattr(mha, "get_fastpath_enabled") else None
+    if fastpath is not None:
+        mha.set_fastpath_enabled(False)
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                module, (example,), str(path),
+                input_names=["token_ids"], output_names=["logits"],
+                dynamic_axes={"token_ids": {0: "batch", 1: "seq_len"}, "logits": {0: "batch"}},
+                opset_version=opset,
+            )
+    finally:
+        if fastpath is not None:
+            mha.set_fastpath_enabled(fastpath)
+
+    proto = onnx.load(str(path))
+    entry = proto.metadata_props.add()
+    entry.key, entry.value = ONNX_META_KEY, json.dumps(inference_meta(model, vocab_hash))
+    onnx.save(proto, str(path))
+
+    try:
+        session = OnnxRuntimeModel(path)
+    except ImportError:
+        print("⚠️ onnxruntime nicht installiert, ONNX-Export ungeprüft")
+        return path
+    with torch.no_grad():
+        diff = (session(example) - model(example)).abs().max().item()
+    if diff > atol:
+        raise RuntimeError(f"❌ ONNX-Export weicht vom Modell ab (max. {diff:.2e})")
+    return path
+
+
+def load_inference_model(path, map_location="cpu"):
+    # (model, meta) ohne Lightning, MLflow oder src.models
+    extra = {META_FILE: ""}
+    model = torch.jit.load(str(path), map_location=map_location, _extra_files=extra)
+    return model.eval(), json.loads(extra[META_FILE] or "{}")
@@ -0,0 +1,195 @@
+# src/models/hierarchical_module.py
+import math
+import threading
+from collections import OrderedDict
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.nn.utils.rnn import pack_padded_sequence
+
+from src.models.base_module import BaseDiseasePredictor
+from src.models.transformer_module import PositionalEncoding, masked_pool
+
+
+class DiseasePredictor(BaseDiseasePredictor):
+    """
+    Hierarchisches Modell für lange Historien: ein Chunk-Encoder (Transformer wie
+    transformer_module, ein Chunk = bis zu CHUNK_SIZE Token aus preprocess_duckdb) macht
+    aus jedem Chunk ein Embedding, ein LSTM über die Chunk-Embeddings liefert das Risiko
+    des Patienten.
+
+    Input x: [Batch, Chunks, ChunkLen], Chunks in der Reihenfolge chunk_id, rechts mit
+    leeren Chunks aufgefüllt (oder flach [Batch, SeqLen], wird in Chunks geteilt).
+    Beim Serving (ChunkCache) wird pro Anfrage nur der neueste Chunk encodiert, der
+    LSTM-Zustand der älteren Chunks liegt im Cache.
+    """
+    def __init__(self, cfg):
+        super().__init__(cfg)
+
+        self.embedding = nn.Embedding(cfg.model.input_dim, cfg.model.d_model, padding_idx=0)
+        self.pos_encoder = PositionalEncoding(cfg.model.d_model)
+        encoder_layer = nn.TransformerEncoderLayer(
+            d_model=cfg.model.d_model,
+            nhead=cfg.model.nhead,
+            dim_feedforward=cfg.model.dim_feedforward,
+            dropout=cfg.model.dropout,
+            batch_first=True
+        )
+        self.chunk_encoder = nn.TransformerEncoder(
+            encoder_layer, num_layers=cfg.model.num_layers, enable_nested_tensor=True
+        )
+        self.chunk_rnn = nn.LSTM(
+            input_size=cfg.model.d_model,
+            hidden_size=cfg.model.d_model,
+            num_layers=cfg.model.get("chunk_layers", 1),
+            batch_first=True
+        )
+        self.fc = nn.Linear(cfg.model.d_model, cfg.model.num_classes)
+
+    def encode_chunks(self, x):
+        # x: [N, ChunkLen] -> ein Embedding pro Chunk [N, D_Model]
+        padding_mask = (x == 0)
+        h = self.embedding(x) * math.sqrt(self.cfg.model.d_model)
+        h = self.pos_encoder(h)
+        h = self.chunk_encoder(h, src_key_padding_mask=padding_mask)
+        # Immer nur über echte Token: sonst hinge das Embedding eines Chunks davon ab, wie stark
+        # sein Batch gepaddet ist (und ChunkCache.score wiche von forward() ab)
+        return masked_pool(h, padding_mask, self.cfg.model.get("pooling", "max"), skip_padding=True)
+
+    def forward(self, x):
+        if x.dim() == 2:
+            # Flache Sequenz (API /predict, eval_early_warnings): in Chunks zu chunk_size Token teilen
+            chunk_size = self.cfg.model.get("chunk_size", 512)
+            x = F.pad(x, (0, (-x.size(1)) % chunk_size)).view(x.size(0), -1, chunk_size)
+        batch, n_chunks, chunk_len = x.shape
+        # Nur echte Chunks durch den Encoder, leere (nur Padding) bleiben Null
+        real = (x != 0).any(dim=2)
+        # dtype vom Encoder-Output: nach quantize_for_cpu ist fc.weight eine Methode, kein Tensor
+        encoded = self.encode_chunks(x[real])
+        chunk_emb = encoded.new_zeros(batch, n_chunks, self.cfg.model.d_model)
+        chunk_emb[real] = encoded
+
+        counts = real.sum(dim=1).cpu()
+        if bool((counts < n_chunks).any()):
+            chunk_emb = pack_padded_sequence(chunk_emb, counts.clamp(min=1), batch_first=True, enforce_sorted=False)
+        _, (hidden, _) = self.chunk_rnn(chunk_emb)
+        return self.fc(hidden[-1])
+
+    def step(self, chunk_emb, state=None):
+        """
+        Inkrementell: Chunk-Embeddings [Batch, n_neu, D_Model] ab dem Zustand state=(h, c)
+        der bisherigen Chunks (None = erster Chunk). Gibt (logits, state) zurück.
+        """
+        _, state = self.chunk_rnn(chunk_emb, state)
+        return self.fc(state[0][-1]), state
+
+
+class ChunkCache:
+    """
+    Serving-Cache pro Patient: Chunk-Embeddings pro (subject_id, chunk_id) und der
+    LSTM-Zustand nach dem letzten abgeschlossenen Chunk. Der neueste Chunk wächst noch
+    (bis CHUNK_SIZE Token) und wird bei jeder Anfrage neu encodiert, ältere nie wieder.
+    Die Kosten pro Anfrage hängen damit nicht an der Länge der Historie.
+
+    LRU über Patienten, max_patients begrenzt den Speicher. Thread-sicher: FastAPI führt
+    sync-Endpoints im Threadpool aus. Ein Lock schützt das LRU-Dict, ein Lock pro Patient
+    die Aktualisierung seines Eintrags (parallele Anfragen verschiedener Patienten laufen weiter).
+    """
+    def __init__(self, max_patients=10_000):
+        self.max_patients = max_patients
+        # subject_id -> {"committed": letzte chunk_id im Zustand, "state": (h, c),
+        #                "chunks": {chunk_id: (n_token, emb)} nur für noch nicht übernommene Chunks, "lock"}
+        self.patients = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.patients)
+
+    def entry(self, subject_id):
+        with self.lock:
+            entry = self.patients.pop(subject_id, None) or {
+                "committed": -1, "state": None, "chunks": {}, "lock": threading.Lock()
+            }
+            self.patients[subject_id] = entry
+            while len(self.patients) > self.max_patients:
+                self.patients.popitem(last=False)
+        return entry
+
+    @torch.no_grad()
+    def score(self, model, subject_id, chunks, first_chunk_id=0):
+        """
+        chunks: Token-Listen der Chunks first_chunk_id, first_chunk_id+1, ... (der letzte
+        ist der aktuelle). Bereits gecachte Chunks dürfen fehlen, neue Patienten schicken
+        die ganze Historie. Gibt (logits [1, num_classes], Anzahl neu encodierter Chunks) zurück.
+        """
+        entry = self.entry(subject_id)
+        with entry["lock"]:
+            return self.update(entry, model, subject_id, chunks, first_chunk_id)
+
+    def update(self, entry, model, subject_id, chunks, first_chunk_id):
+        last_id = first_chunk_id + len(chunks) - 1
+        if first_chunk_id > entry["committed"] + 1:
+            raise LookupError(
+                f"Chunks {entry['committed'] + 1}..{first_chunk_id - 1} von Patient {subject_id} fehlen im Cache, "
+                "ganze Historie schicken"
+            )
+        if last_id < entry["committed"] + 1:
+            raise ValueError(f"Chunk {last_id} von Patient {subject_id} ist schon abgeschlossen")
+
+        # Nur neue oder gewachsene Chunks encodieren, in einem Batch
+        device = next(model.parameters()).device
+        todo = [
+            (cid, tokens) for cid, tokens in enumerate(chunks, start=first_chunk_id)
+            if cid > entry["committed"] and entry["chunks"].get(cid, (None,))[0] != len(tokens)
+        ]
+        if todo:
+            width = max(len(tokens) for _, tokens in todo)
+            x = torch.zeros(len(todo), width, dtype=torch.long, device=device)
+            for row, (_, tokens) in enumerate(todo):
+                x[row, :len(tokens)] = torch.tensor(tokens, dtype=torch.long)
+            for (cid, tokens), emb in zip(todo, model.encode_chunks(x)):
+                entry["chunks"][cid] = (len(tokens), emb)
+
+        # Abgeschlossene Chunks (alle vor dem aktuellen) fest in den Zustand übernehmen
+        pending = range(entry["committed"] + 1, last_id)
+        if len(pending):
+            emb = torch.stack([entry["chunks"][cid][1] for cid in pending])[None]
+            _, entry["state"] = model.step(emb, entry["state"])
+            entry["committed"] = last_id - 1
+            # Steckt jetzt im Zustand, das Embedding wird nie wieder gebraucht
+            for cid in pending:
+                del entry["chunks"][cid]
+
+        # Aktueller Chunk nur vorläufig, der Zustand bleibt beim letzten abgeschlossenen
+        logits, _ = model.step(entry["chunks"][last_id][1][None, None], entry["state"])
+        return logits, len(todo)
+
+
+@torch.no_grad()
+def check_chunk_cache(model, patients, atol=1e-4):
+    """
+    Spielt /predict_patient nach und vergleicht mit forward(): pro Patient (Liste von
+    Token-Listen pro Chunk) kommt Chunk für Chunk dazu, der aktuelle wächst von einem Token
+    bis voll, geschickt wird jeweils nur ab dem ersten nicht übernommenen Chunk. Jeder Score aus dem
+    Cache muss forward() auf derselben Historie entsprechen, sonst RuntimeError.
+    Gibt die größte Abweichung zurück.
+    """
+    cache = ChunkCache()
+    device = next(model.parameters()).device
+    worst = 0.0
+    for subject_id, chunks in enumerate(patients):
+        for k, current in enumerate(chunks):
+            # Kurze Chunks sind der kritische Fall: neben vollen Chunks fast nur Padding
+            for n in sorted({1, max(len(current) // 4, 1), max(len(current) // 2, 1), len(current)}):
+                history = list(chunks[:k]) + [current[:n]]
+                first = cache.entry(subject_id)["committed"] + 1
+                logits, _ = cache.score(model, subject_id, history[first:], first)
+
+                x = torch.zeros(1, len(history), max(len(t) for t in history), dtype=torch.long, device=device)
+                for c, tokens in enumerate(history):
+                    x[0, c, :len(tokens)] = torch.as_tensor(tokens, dtype=torch.long)
+                worst = max(worst, (logits - model(x)).abs().max().item())
+    if worst > atol:
+        raise RuntimeError(f"❌ ChunkCache weicht von forward() ab (max. {worst:.2e})")
+    return worst
@@ -0,0 +1,80 @@
+# src/models/onnx_runtime.py
+# Bewusst ohne Lightning/MLflow-Imports: wird von der API im ONNX-Modus direkt geladen
+import json
+import os
+
+import numpy as np
+import torch
+
+ONNX_FILE = "model.onnx"
+# Schlüssel in den ONNX metadata_props, Inhalt wie meta.json des TorchScript-Artefakts
+ONNX_META_KEY = "med_pred_meta"
+
+GRAPH_OPTIMIZATIONS = ("disabled", "basic", "extended", "all")
+
+
+def session_options(intra_op_threads=None, inter_op_threads=None, graph_optimization="all"):
+    import onnxruntime as ort
+
+    levels = {
+        "disabled": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    if graph_optimization not in levels:
+        raise ValueError(f"❌ Unbekannte Graph-Optimierung: {graph_optimization} (erlaubt: {', '.join(GRAPH_OPTIMIZATIONS)})")
+    options = ort.SessionOptions()
+    options.graph_optimization_level = levels[graph_optimization]
+    # 0 = onnxruntime entscheidet (alle physischen Kerne)
+    options.intra_op_num_threads = intra_op_threads or 0
+    options.inter_op_num_threads = inter_op_threads or 0
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    return options
+
+
+class OnnxRuntimeModel:
+    """
+    ONNX-Export (src/models/export.py) im CPUExecutionProvider. Verhält sich für die API
+    wie das Torch-Modell: model(token_ids [Batch, SeqLen]) -> Logits als torch.Tensor.
+    """
+    def __init__(self, path, intra_op_threads=None, inter_op_threads=None, graph_optimization="all"):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("❌ ONNX-Backend braucht onnxruntime (Extra: uv pip install -r pyproject.toml --extra serving)") from e
+        self.path = str(path)
+        self.session = ort.InferenceSession(
+            self.path,
+            sess_options=session_options(intra_op_threads, inter_op_threads, graph_optimization),
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_name = self.session.get_inputs()[0].name
+        custom = self.session.get_modelmeta().custom_metadata_map
+        self.meta = json.loads(custom.get(ONNX_META_KEY, "{}"))
+
+    @classmethod
+    def from_env(cls, path):
+        # ORT_INTRA_OP_THREADS, ORT_INTER_OP_THREADS, ORT_GRAPH_OPTIMIZATION (API/Docker)
+        intra = os.environ.get("ORT_INTRA_OP_THREADS")
+        inter = os.environ.get("ORT_INTER_OP_THREADS")
+        return cls(
+            path,
+            intra_op_threads=int(intra) if intra else None,
+            inter_op_threads=int(inter) if inter else None,
+            graph_optimization=os.environ.get("ORT_GRAPH_OPTIMIZATION", "all"),
+        )
+
+    def __call__(self, x):
+        tokens = x.numpy() if isinstance(x, torch.Tensor) else np.asarray(x)
+        (logits,) = self.session.run(None, {self.input_name: tokens.astype(np.int64, copy=False)})
+        return torch.from_numpy(logits)
+
+    # Gleiche Schnittstelle wie nn.Module, damit die API nicht unterscheiden muss
+    def eval(self):
+        return self
+
+    def to(self, device):
+        if str(device) != "cpu":
+            raise ValueError("❌ ONNX-Backend läuft nur auf der CPU")
+        return self
@@ -0,0 +1,92 @@
+# src/models/quantization.py
+import copy
+import io
+import time
+
+import torch
+import torch.nn as nn
+import torchmetrics
+
+EMBEDDING_DTYPES = {"float16": torch.float16, "bfloat16": torch.bfloat16}
+
+
+class LowPrecisionEmbedding(nn.Module):
+    """
+    Embedding-Tabelle in fp16/bf16 (halber Speicher bei ~21k Token), Output wieder fp32,
+    damit der Rest des Modells unverändert rechnet. Das Lookup selbst ist nur ein Gather.
+    Für nn.EmbeddingBag (Bag-of-Tokens) bleibt die Reduktion (mode, <PAD> ignoriert) erhalten.
+    """
+    def __init__(self, embedding, dtype):
+        super().__init__()
+        self.padding_idx = embedding.padding_idx
+        self.mode = embedding.mode if isinstance(embedding, nn.EmbeddingBag) else None
+        self.weight = nn.Parameter(embedding.weight.detach().to(dtype), requires_grad=False)
+
+    def forward(self, x, offsets=None):
+        if self.mode is None:
+            return nn.functional.embedding(x, self.weight, self.padding_idx).float()
+        return nn.functional.embedding_bag(x, self.weight, offsets, mode=self.mode,
+                                           padding_idx=self.padding_idx).float()
+
+
+def disable_mha_fastpath():
+    """
+    Der Fast-Path von nn.TransformerEncoder(Layer) liest linear1.weight als Tensor, bei
+    dynamisch quantisierten Layern ist das eine Methode -> Fehler. Prozessweit abschalten,
+    der normale Pfad ruft die quantisierten Module ganz regulär auf.
+    """
+    if hasattr(torch.backends, "mha") and hasattr(torch.backends.mha, "set_fastpath_enabled"):
+        torch.backends.mha.set_fastpath_enabled(False)
+
+
+def quantize_for_cpu(model, embedding_dtype=None):
+    """
+    Post-Training Dynamic Quantization für CPU-Serving: nn.Linear (Heads, Feed-Forward der
+    Transformer-Layer, QKV des kausalen Transformers) und nn.LSTM mit int8-Gewichten,
+    Aktivierungen werden pro Batch quantisiert. Kein Kalibrierungs-Datensatz nötig.
+    Die Attention-Projektion von nn.MultiheadAttention bleibt fp32 (nicht dynamisch
+    quantisierbar). Optional die Embedding-Tabelle in fp16/bf16.
+    Gibt eine quantisierte Kopie zurück, das Original bleibt unverändert.
+    """
+    model = copy.deepcopy(model).cpu().eval()
+    if embedding_dtype:
+        model.embedding = LowPrecisionEmbedding(model.embedding, EMBEDDING_DTYPES[embedding_dtype])
+    model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear, nn.LSTM}, dtype=torch.qint8)
+    # Markierung für die API (CPU-only, Fast-Path aus) und fürs Logging
+    model.quantization = {"weights": "dynamic_int8", "embedding": embedding_dtype or "float32"}
+    disable_mha_fastpath()
+    return model
+
+
+def model_size_mb(model):
+    # Größe des serialisierten state_dict, Näherung für den RAM der Gewichte
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes / 1024 ** 2
+
+
+@torch.no_grad()
+def evaluate_auc(model, loader, max_batches=None):
+    """AUROC, AUPRC und mittlere Latenz pro Batch (Sekunden) auf der CPU."""
+    model = model.cpu().eval()
+    auroc = torchmetrics.classification.BinaryAUROC()
+    auprc = torchmetrics.classification.BinaryAveragePrecision()
+    seconds = 0.0
+    n_batches = 0
+    for *inputs, y in loader:
+        if max_batches is not None and n_batches >= max_batches:
+            break
+        inputs = [t.cpu() for t in inputs]
+        start = time.perf_counter()
+        logits = model(*inputs)
+        seconds += time.perf_counter() - start
+        n_batches += 1
+        probs = torch.softmax(logits.float(), dim=1)[:, 1]
+        y = y.cpu().long()
+        auroc.update(probs, y)
+        auprc.update(probs, y)
+    return {
+        "auroc": auroc.compute().item(),
+        "auprc": auprc.compute().item(),
+        "latency_ms": 1000 * seconds / max(n_batches, 1),
+    }
@@ -15,10 +15,56 @@ class PositionalEncoding(nn.Module):
         pe = pe.unsqueeze(0)
         self.register_buffer('pe', pe)
 
-    def forward(self, x):
+    def forward(self, x, positions=None):
+        if positions is not None:
+            # Gepackte Zeilen: Position zählt pro Segment ab 0
+            return x + self.pe[0, positions]
         x = x + self.pe[:, :x.size(1), :]
         return x
 
+
+def segment_positions(segment_ids):
+    # Position innerhalb des Segments: Index minus Startindex des eigenen Segments
+    idx = torch.arange(segment_ids.size(1), device=segment_ids.device).expand_as(segment_ids)
+    is_start = torch.ones_like(segment_ids, dtype=torch.bool)
+    is_start[:, 1:] = segment_ids[:, 1:] != segment_ids[:, :-1]
+    start = torch.where(is_start, idx, torch.zeros_like(idx)).cummax(dim=1).values
+    return idx - start
+
+
+def block_diagonal_mask(segment_ids, nhead):
+    """
+    Attention-Maske für gepackte Zeilen: True = verboten (nn.MultiheadAttention-Konvention).
+    Token sehen nur ihr eigenes Segment. Padding (Segment 0) sieht nur Padding, so hat
+    jede Zeile der Maske erlaubte Einträge und es entsteht kein NaN im Softmax.
+    """
+    mask = segment_ids[:, :, None] != segment_ids[:, None, :]
+    return mask.repeat_interleave(nhead, dim=0)
+
+def masked_pool(x, padding_mask, pooling_type: str, skip_padding: bool = False):
+    """
+    Pooling über die Zeitachse [Batch, SeqLen, D] -> [Batch, D] nur über echte Token.
+    Ohne Padding identisch zu x.max(dim=1) / x.mean(dim=1). skip_padding=False ist das
+    alte Verhalten (Padding zählt mit), nur für Modelle, die so trainiert wurden.
+    Typ-Annotationen für TorchScript (src/models/export.py).
+    """
+    if pooling_type == "max":
+        # Max-Pooling: Sucht das stärkste Signal in der gesamten Sequenz
+        if skip_padding:
+            x = x.masked_fill(padding_mask[:, :, None], float("-inf"))
+        values, _ = x.max(dim=1)
+        return values
+
+    if pooling_type == "mean":
+        # Mean-Pooling: Durchschnitt, Padding zählt weder in der Summe noch im Nenner
+        if not skip_padding:
+            return x.mean(dim=1)
+        real = (~padding_mask).sum(dim=1, keepdim=True).clamp(min=1)
+        return x.masked_fill(padding_mask[:, :, None], 0.0).sum(dim=1) / real
+
+    raise ValueError(f"Unbekannte Pooling Strategie: {pooling_type}")
+
+
 class DiseasePredictor(BaseDiseasePredictor):
     def __init__(self, cfg):
         # 1. Basis-Klasse initialisieren
@@ -35,15 +81,21 @@ class DiseasePredictor(BaseDiseasePredictor):
             dropout=cfg.model.dropout,
             batch_first=True
         )
-        self.transformer_encoder = nn.TransformerEncoder(encoder_layer, num_layers=cfg.model.num_layers)
+        # Inferenz (eval + no_grad): Fast-Path mit Nested Tensor, gepaddete Positionen werden
+        # gar nicht erst gerechnet. Im Training greift der normale Pfad mit Padding-Maske.
+        self.transformer_encoder = nn.TransformerEncoder(
+            encoder_layer, num_layers=cfg.model.num_layers, enable_nested_tensor=True
+        )
         
         self.fc = nn.Linear(cfg.model.d_model, cfg.model.num_classes)
         
         # Logging, welche Strategie genutzt wird
         print(f"🔧 Model initialized with Pooling Strategy: {cfg.model.pooling.upper()}")
 
-    def forward(self, x):
+    def forward(self, x, segment_ids=None):
         # x: [Batch, SeqLen]
+        if segment_ids is not None:
+            return self.forward_packed(x, segment_ids)
         src_key_padding_mask = (x == 0)
         
         # Embedding & PosEncoding
@@ -56,22 +108,38 @@ class DiseasePredictor(BaseDiseasePredictor):
         
         # --- POOLING STRATEGIE (Der entscheidende Teil) ---
         pooling_type = self.cfg.model.get("pooling", "mean") # Fallback auf Mean
-        
-        if pooling_type == "max":
-            # Max-Pooling: Sucht das stärkste Signal in der gesamten Sequenz
-            # Wir nehmen das Max über Dimension 1 (Zeit)
-            # x.max(dim=1) gibt (values, indices) zurück, wir brauchen nur values
-            x, _ = x.max(dim=1)
-            
-        elif pooling_type == "mean":
-            # Mean-Pooling: Der Durchschnitt (verwässert oft Signale)
-            # Um es sauber zu machen, sollten wir Padding nicht mitzählen,
-            # aber einfaches Mean ist Standard und oft gut genug.
-            x = x.mean(dim=1)
-            
-        else:
-            raise ValueError(f"Unbekannte Pooling Strategie: {pooling_type}")
+        x = masked_pool(x, src_key_padding_mask, pooling_type, skip_padding=self.cfg.model.get("skip_padding", False))
         
         # Classification Head
         logits = self.fc(x)
-        return logits
\ No newline at end of file
+        return logits
+
+    def forward_packed(self, x, segment_ids):
+        """
+        Sequence Packing: x enthält pro Zeile mehrere Chunks, segment_ids (1..k, 0 = Padding)
+        trennt sie. Block-diagonale Attention, Positionen pro Segment, Pooling pro Segment.
+        Gibt Logits pro Segment zurück [n_segments, num_classes], in Zeilen-Reihenfolge.
+        """
+        mask = block_diagonal_mask(segment_ids, self.cfg.model.nhead)
+        positions = segment_positions(segment_ids)
+
+        x = self.embedding(x) * math.sqrt(self.cfg.model.d_model)
+        x = self.pos_encoder(x, positions)
+        x = self.transformer_encoder(x, mask=mask)
+
+        # Globale Segment-Nummer: Offset der Zeile + lokale Segment-ID
+        counts = segment_ids.max(dim=1).values
+        offsets = torch.cumsum(counts, dim=0) - counts
+        real = segment_ids > 0
+        seg = (offsets[:, None] + segment_ids - 1)[real]
+        tokens = x[real]
+        index = seg[:, None].expand_as(tokens)
+
+        pooling_type = self.cfg.model.get("pooling", "mean")
+        if pooling_type not in ("max", "mean"):
+            raise ValueError(f"Unbekannte Pooling Strategie: {pooling_type}")
+        # Hier ohne Padding (Segmente haben keins), auch bei Mean
+        reduce = "amax" if pooling_type == "max" else "mean"
+        pooled = tokens.new_zeros(int(counts.sum()), tokens.size(1))
+        pooled = pooled.scatter_reduce(0, index, tokens, reduce=reduce, include_self=False)
+        return self.fc(pooled)
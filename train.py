@@ -11,11 +11,109 @@ import torch
 
 # --- IMPORTS FÜR UNSERE MODULE ---
 from src.data.mimic_loader import MimicDataModule
+from src.data.vocab import VOCAB_META_FILE, check_vocab_hash, read_vocab_meta
 from src.models.rnn_module import DiseasePredictor as RNNPredictor
 from src.models.transformer_module import DiseasePredictor as TransformerPredictor
+from src.models.causal_transformer_module import DiseasePredictor as CausalTransformerPredictor
+from src.models.hierarchical_module import DiseasePredictor as HierarchicalPredictor
+from src.models.bag_of_tokens_module import DiseasePredictor as BagOfTokensPredictor
+from src.models.quantization import evaluate_auc, model_size_mb, quantize_for_cpu
+from src.models.export import export_inference_model, export_onnx_model
+from src.models.distillation import STUDENT_MODELS, load_teacher_logits
 
 torch.set_float32_matmul_precision('medium')
 
+def prepare_distillation(cfg, dm, model_name, ml_data_path):
+    """
+    Teacher aus der Registry laden und seine Logits für den Train-Split bereitstellen
+    (einmal gerechnet, danach aus ML_DATA/distill). Gibt den Teacher zurück.
+    """
+    if model_name not in STUDENT_MODELS:
+        raise ValueError(f"❌ Distillation-Student muss eins von {STUDENT_MODELS} sein, nicht {model_name}")
+    teacher_uri = cfg.distill.teacher_uri
+    print(f"🧑‍🏫 Distillation: Teacher {teacher_uri}, T={cfg.distill.temperature}, alpha={cfg.distill.alpha}")
+    teacher = mlflow.pytorch.load_model(teacher_uri, map_location="cpu")
+    # Teacher und Student müssen dieselben Token-IDs sehen
+    check_vocab_hash(teacher.cfg.data.get("vocab_hash"), cfg.data.get("vocab_hash"), teacher_uri)
+
+    dm.setup("fit")
+    # Dieselben Zeilen wie der Student (seine hours_before_end wählen die Chunks), aber
+    # gekürzt auf die seq_len, mit der der Teacher trainiert wurde
+    hours = cfg.data.get("hours_before_end")
+    teacher_len = teacher.cfg.data.seq_len
+    if teacher.cfg.data.get("hours_before_end") != hours:
+        print(f"⚠️ Teacher trainiert mit hours_before_end={teacher.cfg.data.get('hours_before_end')},"
+              f" Logits für die Fenster des Studenten ({hours})")
+    # model_uuid statt "latest": eine neue Teacher-Version bekommt einen neuen Cache
+    teacher_id = mlflow.models.get_model_info(teacher_uri).model_uuid
+    cache_file = ml_data_path / "distill" / (
+        f"teacher_{teacher_id}_len{teacher_len}_seed{cfg.seed}_fold{cfg.data.get('fold')}.npy"
+    )
+    meta = {
+        "teacher": teacher_id,
+        "data": str(dm.data_path),
+        "vocab_hash": dm.vocab_hash,
+        "seed": cfg.seed,
+        "fold": cfg.data.get("fold"),
+        "teacher_seq_len": teacher_len,
+        "hours_before_end": hours,
+    }
+    dataset = dm.make_dataset("train", hours, max_len=teacher_len)
+    dm.teacher_logits = load_teacher_logits(teacher, dataset, cache_file, meta, cfg.data.batch_size)
+    return teacher
+
+def log_distillation_comparison(teacher, student, dm, cfg):
+    # Teacher vs. Student auf dem Val-Split (CPU, wie beim Serving), im aktiven MLflow-Run
+    max_batches = cfg.distill.get("compare_batches")
+    t = evaluate_auc(teacher, dm.val_dataloader(max_len=teacher.cfg.data.seq_len), max_batches)
+    s = evaluate_auc(student, dm.val_dataloader(), max_batches)
+    mlflow.log_metrics({
+        "teacher_val_auroc": t["auroc"], "teacher_val_auprc": t["auprc"], "teacher_latency_ms": t["latency_ms"],
+        "student_val_auroc": s["auroc"], "student_val_auprc": s["auprc"], "student_latency_ms": s["latency_ms"],
+        "student_speedup": t["latency_ms"] / max(s["latency_ms"], 1e-9),
+    })
+    mlflow.set_tag("teacher_uri", cfg.distill.teacher_uri)
+    print(f"   AUPRC Teacher {t['auprc']:.4f} | Student {s['auprc']:.4f}"
+          f" | Latenz {t['latency_ms']:.1f} -> {s['latency_ms']:.1f} ms/Batch")
+
+def log_quantized_model(best_model, dm, cfg, reg_name):
+    """
+    int8-Variante des besten Modells für CPU-Serving. AUROC/AUPRC beider Modelle auf dem
+    Val-Split (CPU) -> registriert wird nur, wenn die Parität hält. Läuft im aktiven MLflow-Run.
+    """
+    serving = cfg.serving
+    max_batches = serving.get("parity_batches")
+    # fp32 zuerst: quantize_for_cpu schaltet den Transformer-Fast-Path prozessweit ab
+    fp32 = evaluate_auc(best_model, dm.val_dataloader(), max_batches)
+    print(f"🗜️  Quantisiere Modell (int8 dynamic, Embedding {serving.get('embedding_dtype') or 'float32'})...")
+    quantized = quantize_for_cpu(best_model, serving.get("embedding_dtype"))
+    int8 = evaluate_auc(quantized, dm.val_dataloader(), max_batches)
+    auroc_drop = fp32["auroc"] - int8["auroc"]
+    auprc_drop = fp32["auprc"] - int8["auprc"]
+    parity = auroc_drop <= serving.max_auroc_drop and auprc_drop <= serving.max_auprc_drop
+
+    mlflow.log_metrics({
+        "fp32_cpu_val_auroc": fp32["auroc"], "fp32_cpu_val_auprc": fp32["auprc"],
+        "int8_val_auroc": int8["auroc"], "int8_val_auprc": int8["auprc"],
+        "int8_auroc_drop": auroc_drop, "int8_auprc_drop": auprc_drop,
+        "fp32_cpu_latency_ms": fp32["latency_ms"], "int8_latency_ms": int8["latency_ms"],
+        "fp32_size_mb": model_size_mb(best_model), "int8_size_mb": model_size_mb(quantized),
+    })
+    mlflow.set_tag("int8_parity", "passed" if parity else "failed")
+    print(f"   AUROC {fp32['auroc']:.4f} -> {int8['auroc']:.4f} | AUPRC {fp32['auprc']:.4f} -> {int8['auprc']:.4f}"
+          f" | Latenz {fp32['latency_ms']:.1f} -> {int8['latency_ms']:.1f} ms/Batch")
+
+    if not parity:
+        print(f"⚠️ int8-Modell nicht registriert: AUROC -{auroc_drop:.4f}, AUPRC -{auprc_drop:.4f} über dem Limit")
+        return
+    mlflow.pytorch.log_model(
+        pytorch_model=quantized,
+        artifact_path="model_int8",
+        registered_model_name=f"{reg_name}_int8" if reg_name else None,
+        metadata={"vocab_hash": cfg.data.get("vocab_hash"), "quantization": quantized.quantization}
+    )
+    print("✅ int8-Modell registriert.")
+
 @hydra.main(version_base=None, config_path="conf", config_name="config")
 def main(cfg: DictConfig):
     
@@ -59,6 +157,15 @@ def main(cfg: DictConfig):
     else:
         print("⚠️ Kein Vokabular gefunden. Nutze Config input_dim.")
 
+    vocab_meta = read_vocab_meta(processed_path)
+    if vocab_meta:
+        # Ein fest vorgegebener Hash (data.vocab_hash=...) muss zum aktuellen Vokabular passen
+        check_vocab_hash(cfg.data.get("vocab_hash"), vocab_meta["vocab_hash"], str(vocab_file))
+        print(f"🔑 Vokabular-Hash: {vocab_meta['vocab_hash']} (v{vocab_meta.get('version')})")
+        # Landet in model.cfg -> Eval & API können Daten mit anderem Vokabular ablehnen
+        with open_dict(cfg):
+            cfg.data.vocab_hash = vocab_meta["vocab_hash"]
+
     # ---------------------------------------------------------
     # 3. DATEN LADEN
     # ---------------------------------------------------------
@@ -72,10 +179,23 @@ def main(cfg: DictConfig):
     if model_name == "transformer_encoder":
         print(f"🤖 Starte Training mit TRANSFORMER (Pooling: {cfg.model.get('pooling', 'mean')})")
         model = TransformerPredictor(cfg)
+    elif model_name == "causal_transformer":
+        print("⏩ Starte Training mit KAUSALEM TRANSFORMER (Risiko pro Event, KV-Cache)")
+        model = CausalTransformerPredictor(cfg)
+    elif model_name == "hierarchical":
+        print(f"🧱 Starte Training mit HIERARCHISCHEM Modell (Chunk-Encoder + LSTM, max. {cfg.model.get('max_chunks')} Chunks)")
+        model = HierarchicalPredictor(cfg)
+    elif model_name == "bag_of_tokens":
+        print("🎒 Starte Training mit BAG-OF-TOKENS (linear, Kaskaden-Vorstufe)")
+        model = BagOfTokensPredictor(cfg)
     else:
         print("🔄 Starte Training mit LSTM/RNN")
         model = RNNPredictor(cfg)
 
+    teacher = None
+    if cfg.get("distill", {}).get("teacher_uri"):
+        teacher = prepare_distillation(cfg, dm, model_name, ml_data_path)
+
     # ---------------------------------------------------------
     # 5. LOGGER & CALLBACKS
     # ---------------------------------------------------------
@@ -90,6 +210,11 @@ def main(cfg: DictConfig):
 
     # Hyperparameter loggen
     mlf_logger.log_hyperparams(OmegaConf.to_container(cfg, resolve=True))
+    if vocab_meta:
+        mlf_logger.experiment.set_tag(mlf_logger.run_id, "vocab_hash", vocab_meta["vocab_hash"])
+        for f in (vocab_file, processed_path / VOCAB_META_FILE):
+            if f.exists():
+                mlf_logger.experiment.log_artifact(mlf_logger.run_id, str(f), artifact_path="vocab")
 
     checkpoint_callback = ModelCheckpoint(
         monitor="val_auprc",    # Wir optimieren auf AUPRC
@@ -142,14 +267,39 @@ def main(cfg: DictConfig):
             
             # Nur registrieren, wenn gewünscht (Default: True). Bei Sweeps auf False setzen!
             reg_name = "MIMIC_Mortality_Predictor" if cfg.get("register_model", True) else None
+            if reg_name and teacher is not None:
+                # Student getrennt vom Teacher registrieren
+                reg_name = f"{reg_name}_student"
             
             # Wir müssen sicherstellen, dass wir in denselben Run loggen
             with mlflow.start_run(run_id=mlf_logger.run_id):
                 mlflow.pytorch.log_model(
                     pytorch_model=best_model,
                     artifact_path="model",
-                    registered_model_name=reg_name
+                    registered_model_name=reg_name,
+                    metadata={"vocab_hash": cfg.data.get("vocab_hash")}
                 )
+                if teacher is not None:
+                    log_distillation_comparison(teacher, best_model, dm, cfg)
+                if cfg.get("serving", {}).get("export_torchscript", True):
+                    try:
+                        export_dir = Path("checkpoints") / "inference" / mlf_logger.run_id
+                        export_path = export_inference_model(best_model, export_dir, cfg.data.get("vocab_hash"))
+                        mlflow.log_artifact(str(export_path), artifact_path="inference")
+                        print(f"📦 TorchScript-Artefakt exportiert: inference/{export_path.name}")
+                    except Exception as e:
+                        # Export ist Zusatz, das MLflow-Modell ist schon registriert
+                        print(f"⚠️ TorchScript-Export übersprungen: {e}")
+                if cfg.get("serving", {}).get("export_onnx", False):
+                    try:
+                        export_dir = Path("checkpoints") / "inference" / mlf_logger.run_id
+                        export_path = export_onnx_model(best_model, export_dir, cfg.data.get("vocab_hash"))
+                        mlflow.log_artifact(str(export_path), artifact_path="inference")
+                        print(f"📦 ONNX-Artefakt exportiert: inference/{export_path.name}")
+                    except Exception as e:
+                        print(f"⚠️ ONNX-Export übersprungen: {e}")
+                if cfg.get("serving", {}).get("quantize", False):
+                    log_quantized_model(best_model, dm, cfg, reg_name)
             print(f"✅ Modell erfolgreich registriert! (Run ID: {mlf_logger.run_id})")
         else:
             print("⚠️ Kein Checkpoint gefunden. (Training war zu kurz oder kein val_auprc berechnet)")